@@ -15,7 +15,10 @@ setup(
     # http://pypi.python.org/pypi?:action=list_classifiers
     classifiers=[
         "Operating System :: OS Independent",
+        "Programming Language :: Python :: 2.7",
         "Programming Language :: Python :: 3",
+        "Programming Language :: Python :: Implementation :: CPython",
+        "Programming Language :: Python :: Implementation :: PyPy",
         "License :: OSI Approved :: GNU General Public License v2 (GPLv2)",
     ],
     keywords=["senaite", "lims", "rs-232", "lis1-a"],
@@ -29,6 +32,7 @@ setup(
     zip_safe=False,
     install_requires=[
         "pyserial",
+        "requests",
     ],
     # List additional groups of dependencies here (e.g. development
     # dependencies). You can install these using the following syntax,
@@ -41,6 +45,15 @@ setup(
         ]
     },
     entry_points={
-        "console_scripts": ["senaite_serial=senaite.serial.cli.app:main"]
+        "console_scripts": [
+            "senaite_serial=senaite.serial.cli.app:main",
+            "senaite_serial_fakelims=senaite.serial.cli.fakelims:main",
+            "senaite_serial_pushbench=senaite.serial.cli.pushbench:main",
+            "senaite_serial_framebench=senaite.serial.cli.framebench:main",
+            "senaite_serial_archive=senaite.serial.cli.archive:main",
+            "senaite_serial_uploader=senaite.serial.cli.relay:main",
+            "senaite_serial_fuzz=senaite.serial.cli.fuzz:main",
+            "senaite_serial_control=senaite.serial.cli.control:main",
+        ]
     }
 )
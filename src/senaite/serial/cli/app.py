@@ -20,67 +20,247 @@
 
 import argparse
 import logging
+import os
+import signal
 import sys
+import time
 
-import serial
 from serial.serialutil import to_bytes
 
-import lims
+from . import lims
+from . import link
 from . import logger
+from .archive import Archive
+from .charset import Decoder
+from .charset import get_output_encoding
+from .control import ControlServer
+from .control import Controller
+from .control import get_control_path
+from .control import load_config
+from .dedup import MODES
+from .dedup import PushIndex
+from .download import OrderDownloader
+from .export import FORMATS
+from .export import Exporter
+from .link import CommandReader
+from .link import get_link_profile
 from .lis1a import LIS1AHandler
 from .lis1a import LIS1AToSenaiteHandler
+from .lis1a import STX
+from .profiling import run_profiled
+from .profiling import span
+from .profiling import tracer
+from .quality import LineMonitor
+from .quality import MODES as LINE_MODES
+from .query import QueryResponder
+from .relay import SOCKET_PATH
+from .relay import RelayClient
+from .relay import get_spool_dir
+from .relay import make_private_dir
+from .routing import RoutingUploader
+from .routing import load_router
+from .samples import SampleCache
+from .sender import LIS1ASender
+from .session import budget
+from .worklist import WorklistCache
 
 
-def start_server(port, baud_rate, receiver):
-    """Start serial server. Keeps listening to the given port at the baud rate
-    specified and writes the commands coming in to the receiver
+def start_server(port, profile, receiver, monitor=None):
+    """Start serial server. Keeps listening to the given port with the link
+    profile specified and writes the commands coming in to the receiver
     :param port: the serial port address to listen at
-    :param baud_rate: the data transmission rate
+    :param profile: the link profile with the settings of the serial port
     :param receiver: the receiver in charge of handling the incoming messages
+    :param monitor: the monitor of the quality of the line, if any
     """
-    with serial.Serial(port, baud_rate, timeout=2) as ser:
+    reader = CommandReader()
+    with profile.open(port) as ser:
         print("Listening on port {}, press Ctrl+c to exit.".format(port))
+        logger.debug("Link profile: {}".format(profile.to_dict()))
         while True:
             if receiver.is_timeout():
                 logger.warn("Timeout")
                 receiver.reset()
+                reader.reset()
 
             # Read from the sender
-            line = ser.readline()
-            if not line:
-                continue
+            start = time.time()
+            data = link.read(ser, profile.chunk_size)
+            if data:
+                tracer.record("read", start, time.time() - start,
+                              size=len(data))
 
-            # Notify the receiver with the new command
-            receiver.write(line)
+            for command in reader.feed(data):
 
-            # Does the receiver has to send something back?
-            response = receiver.read()
-            if response:
-                socket = serial.Serial(port, baud_rate, timeout=10)
-                socket.write(to_bytes(response))
+                # Notify the receiver with the new command
+                start = time.time()
+                receiver.write(command)
 
+                # Does the receiver has to send something back?
+                write_responses(ser, receiver)
+                if monitor and command[:1] == STX:
+                    monitor.add_turnaround(time.time() - start)
 
-def get_receiver(args):
+            if not data:
+                # Idle line. Does the receiver has something to send?
+                write_responses(ser, receiver)
+
+            if monitor:
+                # Apply the link profile changes, if any, in neutral state
+                monitor.poll(ser, idle=receiver.is_idle())
+
+
+def write_responses(ser, receiver):
+    """Writes to the serial port the responses from the receiver, if any
+    """
+    response = receiver.read()
+    while response:
+        with span("write", size=len(response)):
+            ser.write(to_bytes(response))
+        response = receiver.read()
+
+
+def get_receiver(args, decoder, monitor=None):
     """Returns the receiver in charge to handle the incoming messages based on
-    the arguments passed-in
+    the arguments passed-in, the decoder of the messages and the monitor of
+    the quality of the line
     """
+    encoding = get_output_encoding(decoder.encoding)
     params = {
+        "decoder": decoder,
+        "monitor": monitor,
         "dry-run": args.dry_run,
         "retries": args.retries,
         "delay": args.delay,
+        "stream": args.stream,
+        "split": args.split,
+        "workers": args.workers,
+        "adaptive": args.adaptive,
+        "pipeline": args.pipeline,
+        "parse-processes": args.parse_processes,
+        "spool-size": args.session_memory * 1024 * 1024,
     }
+    if args.archive:
+        # Keep a copy of all messages received
+        params["archive"] = Archive(args.archive)
+
+    if args.export:
+        # Write the results to files for their import in bulk
+        exporter = Exporter(args.export,
+                            fmt=args.export_format,
+                            max_size=args.export_size * 1024 * 1024,
+                            interval=args.export_interval)
+        exporter.start()
+        params["exporter"] = exporter
+
+    if args.uploader_socket:
+        # Messages are pushed by the uploader process shared by all ports
+        spool = args.uploader_spool
+        try:
+            if not spool:
+                spool = get_spool_dir(args.port)
+                make_private_dir(os.path.dirname(spool))
+            uploader = RelayClient(args.uploader_socket, spool=spool,
+                                   delay=args.delay)
+        except (OSError, IOError, ValueError) as e:
+            logger.error(e)
+            sys.exit(-1)
+        uploader.start()
+        params["uploader"] = uploader
+        if args.dedup:
+            logger.warn("Duplicates are handled by the uploader process. "
+                        "Ignoring --dedup")
+
+    if args.routes and args.uploader_socket:
+        logger.warn("Messages are routed by the uploader process. "
+                    "Ignoring --routes")
+
+    elif args.routes:
+        # Route the messages to several SENAITE instances
+        try:
+            router = load_router(args.routes)
+        except (IOError, ValueError) as e:
+            logger.error(e)
+            sys.exit(-1)
+
+    if args.url or args.routes:
+        # Rate limit for the requests to SENAITE
+        lims.limiter.configure(requests=args.max_requests,
+                               nbytes=args.max_bytes)
+
+        if args.dedup and not args.uploader_socket:
+            # Index of recently pushed messages, to skip duplicates
+            params["dedup"] = PushIndex(args.dedup,
+                                        maxsize=args.dedup_size,
+                                        ttl=args.dedup_ttl)
+            params["dedup-mode"] = args.dedup_mode
+
     if args.url:
         # SENAITE URL provided
         try:
             info = lims.get_senaite_connection_info(args.url)
             params.update(info)
         except Exception as e:
-            logger.error(e.message)
+            logger.error(e)
             sys.exit(-1)
 
+        if args.routes and not args.uploader_socket:
+            # Messages no route matches are pushed to this SENAITE
+            router.add_default(info)
+
+        if args.validate and args.routes:
+            logger.warn("Samples are spread among the targets of the routes. "
+                        "Ignoring --validate")
+
+        elif args.validate:
+            # Local copy of the samples, to check the messages before push
+            samples = SampleCache(interval=args.worklist_interval,
+                                  maxsize=args.samples_size,
+                                  ttl=args.samples_ttl,
+                                  parking=Archive(args.validate), **info)
+            samples.start()
+            params["samples"] = samples
+
+        if args.query or args.download:
+            # Local copy of the worklist, fetched from SENAITE
+            worklist = WorklistCache(interval=args.worklist_interval, **info)
+            worklist.start()
+            params["worklist"] = worklist
+            params["sender"] = LIS1ASender()
+
+        if args.query:
+            # Answer queries from the worklist
+            params["responder"] = QueryResponder(worklist, encoding=encoding)
+
+        if args.download:
+            # Download the orders from the worklist to the instrument
+            downloader = OrderDownloader(worklist, params["sender"],
+                                         batch_size=args.download_batch,
+                                         interval=args.worklist_interval,
+                                         encoding=encoding)
+            downloader.start()
+
+    if args.routes and not args.uploader_socket:
+        # Each SENAITE instance has its own uploader
+        uploader = RoutingUploader(router,
+                                   retries=args.retries,
+                                   delay=args.delay,
+                                   workers=args.workers,
+                                   index=params.get("dedup"),
+                                   adaptive=args.adaptive)
+        uploader.start()
+        params["uploader"] = uploader
+
+    if args.url:
         # LIS1A-to-SENAITE handler
         receiver = LIS1AToSenaiteHandler(**params)
 
+    elif args.uploader_socket or args.routes:
+        # LIS1A-to-SENAITE handler, through the uploader process or the
+        # SENAITE instances of the routes
+        receiver = LIS1AToSenaiteHandler(url=None, user=None, password=None,
+                                         **params)
+
     else:
         # Basic LIS1-A handler
         receiver = LIS1AHandler(**params)
@@ -107,14 +287,55 @@ def main():
                         help="Verbose logging")
 
     parser.add_argument("-b", "--baudrate",
-                        type=int, default=9600,
-                        help="Baudrate")
+                        type=int,
+                        help="Baudrate. Overrides the baudrate of the link "
+                             "profile (9600 unless set by the profile)")
+
+    parser.add_argument("-l", "--link-profile", type=str,
+                        default="default",
+                        help="Name of the link profile with the settings of "
+                             "the serial port (data bits, parity, flow "
+                             "control, timeouts, etc.). Built-in profiles: "
+                             "{}".format(", ".join(sorted(link.PROFILES))))
+
+    parser.add_argument("--link-profiles", type=str, metavar="FILE",
+                        help="JSON file with the link profiles of the "
+                             "instruments, mapping each profile name to its "
+                             "settings")
+
+    parser.add_argument("--line-tuning", choices=LINE_MODES,
+                        default=LINE_MODES[0],
+                        help="What to do when the quality of the line "
+                             "degrades: log alerts and suggest a change of "
+                             "the link profile (lower baud rate or hardware "
+                             "flow control), apply the change to the port "
+                             "too, reverting it if the line does not "
+                             "improve, or nothing")
+
+    parser.add_argument("--line-threshold", type=float,
+                        default=0.05,
+                        help="Ratio of frames with errors (0 to 1) beyond "
+                             "which the quality of the line is degraded")
+
+    parser.add_argument("-e", "--encoding", type=str,
+                        help="Character encoding of the messages sent by the "
+                             "instrument (e.g. latin-1, utf-8, cp1252). "
+                             "Overrides the encoding of the link profile "
+                             "('auto' unless set by the profile: UTF-8 if "
+                             "valid, Latin-1 otherwise)")
 
     parser.add_argument("-u", "--url", type=str,
                         help="SENAITE full URL address, with username and "
                              "password: "
                              "'http(s)://<user>:<password>@<senaite_url>'. ")
 
+    parser.add_argument("--routes", type=str, metavar="FILE",
+                        help="JSON file with the SENAITE instances to push "
+                             "the messages to, and the routes that map the "
+                             "instruments or the values of the records to "
+                             "them. SENAITE URL, if set, gets the messages no "
+                             "route matches")
+
     parser.add_argument("-r", "--retries", type=int,
                         default=3,
                         help="Number of attempts of reconnection when SENAITE "
@@ -133,20 +354,286 @@ def main():
                              "This argument only has effect when argument "
                              "--url is set")
 
+    parser.add_argument("-w", "--workers", type=int,
+                        default=4,
+                        help="Number of messages pushed to SENAITE at the "
+                             "same time. Messages waiting are pushed by "
+                             "order priority: STAT first, then ASAP and "
+                             "routine")
+
+    parser.add_argument("--adaptive",
+                        action="store_true",
+                        help="Adapt the number of messages pushed at the "
+                             "same time to the response times of SENAITE, up "
+                             "to the number of workers")
+
+    parser.add_argument("--max-requests", type=float,
+                        default=0,
+                        help="Maximum number of requests per second sent to "
+                             "SENAITE. No limit if 0")
+
+    parser.add_argument("--max-bytes", type=int,
+                        default=0,
+                        help="Maximum number of bytes per second sent to "
+                             "SENAITE. No limit if 0")
+
+    parser.add_argument("-s", "--stream",
+                        action="store_true",
+                        help="Stream mode. Each order is notified as soon "
+                             "as the next order or terminator record is "
+                             "received, without waiting for the end of the "
+                             "transmission")
+
+    parser.add_argument("--split",
+                        action="store_true",
+                        help="Split the messages at the Patient and Order "
+                             "records and push each sample on its own, so "
+                             "the samples of a large transfer are pushed by "
+                             "the workers at the same time and retried "
+                             "independently")
+
+    parser.add_argument("--dedup", type=str, metavar="FILE",
+                        help="Index file of the messages pushed recently. "
+                             "Messages with same content as one already "
+                             "pushed are considered duplicates. Only has "
+                             "effect when argument --url is set")
+
+    parser.add_argument("--dedup-mode", choices=MODES,
+                        default=MODES[0],
+                        help="Whether duplicates are not pushed or pushed "
+                             "with a 'duplicate' flag")
+
+    parser.add_argument("--dedup-ttl", type=int,
+                        default=86400,
+                        help="Time in seconds a pushed message is kept in "
+                             "the duplicates index")
+
+    parser.add_argument("--dedup-size", type=int,
+                        default=10000,
+                        help="Maximum number of messages kept in the "
+                             "duplicates index")
+
+    parser.add_argument("--validate", type=str, metavar="DIR",
+                        help="Check the sample ids of the messages against a "
+                             "local copy of the samples from SENAITE before "
+                             "push. Messages of unknown or closed samples "
+                             "are not pushed, but parked in this archive "
+                             "directory. Only has effect when argument --url "
+                             "is set")
+
+    parser.add_argument("--samples-size", type=int,
+                        default=100000,
+                        help="Maximum number of samples kept in the local "
+                             "copy used by --validate")
+
+    parser.add_argument("--samples-ttl", type=int,
+                        default=3600,
+                        help="Time in seconds a sample is kept in the local "
+                             "copy used by --validate, unless modified")
+
+    parser.add_argument("-q", "--query",
+                        action="store_true",
+                        help="Answer the queries (Q records) sent by the "
+                             "instrument with the tests pending for the "
+                             "samples requested. Only has effect when "
+                             "argument --url is set")
+
+    parser.add_argument("--download",
+                        action="store_true",
+                        help="Download the orders from the worklist to the "
+                             "instrument, as soon as they are available. Only "
+                             "has effect when argument --url is set")
+
+    parser.add_argument("--download-batch", type=int,
+                        default=100,
+                        help="Maximum number of orders per message sent to "
+                             "the instrument")
+
+    parser.add_argument("--worklist-interval", type=int,
+                        default=60,
+                        help="Time in seconds between refreshes of the "
+                             "local copies of the worklist and the samples, "
+                             "used to answer queries, download orders and "
+                             "validate the messages")
+
+    parser.add_argument("--profile", type=str, metavar="FILE",
+                        help="Run within the profiler and write the stats to "
+                             "this file on exit or on SIGUSR1. Stats can be "
+                             "read with Python's pstats module")
+
+    parser.add_argument("--uploader-socket", type=str, metavar="PATH",
+                        nargs="?", const=SOCKET_PATH,
+                        help="Unix socket of the uploader process "
+                             "(senaite_serial_uploader) that pushes the "
+                             "messages to SENAITE on behalf of the listeners "
+                             "of all ports, in the runtime directory of the "
+                             "user if no path is set. SENAITE URL is only "
+                             "required for the queries and the orders "
+                             "download")
+    parser.add_argument("--uploader-spool", type=str, metavar="DIR",
+                        help="Directory where the messages wait while the "
+                             "uploader process is not available, once more "
+                             "than 1000 are queued or when stopped. By "
+                             "default, in the runtime directory of the user")
+
+    parser.add_argument("--pipeline", type=int, default=0, metavar="SIZE",
+                        help="Process the messages received in a pipeline "
+                             "of stages (parse, archive, export and notify) "
+                             "apart from the serial communication, with up to "
+                             "SIZE messages queued per stage. New transfers "
+                             "are refused while the pipeline is full. Set to "
+                             "0 to process them inline")
+
+    parser.add_argument("--parse-processes", type=int, default=0,
+                        help="Number of processes that parse the messages "
+                             "in the pipeline. Set to 0 to parse them in a "
+                             "thread")
+
+    parser.add_argument("--session-memory", type=int, default=8,
+                        help="Maximum size in MB of the data of a session "
+                             "held in memory. Beyond, the data received is "
+                             "written to a temporary file, and read from "
+                             "there by the next stages. Set to 0 for no "
+                             "limit")
+
+    parser.add_argument("--max-memory", type=int, default=0,
+                        help="Maximum size in MB of the data held in memory "
+                             "by all sessions of the process. Beyond, the "
+                             "data received is written to temporary files. "
+                             "Set to 0 for no limit")
+
+    parser.add_argument("--archive", type=str, metavar="DIR",
+                        help="Archive all messages received in this "
+                             "directory, indexed by time, instrument, sample "
+                             "and content. Use senaite_serial_archive to "
+                             "find and re-push them")
+
+    parser.add_argument("--export", type=str, metavar="DIR",
+                        help="Write the results received to files in this "
+                             "directory, for their import in bulk. Files "
+                             "being written have the '.part' suffix")
+
+    parser.add_argument("--export-format", type=str, default="ndjson",
+                        choices=FORMATS,
+                        help="Format of the export files")
+
+    parser.add_argument("--export-size", type=int, default=64,
+                        help="Maximum size in MB of the export files")
+
+    parser.add_argument("--export-interval", type=int, default=3600,
+                        help="Maximum time in seconds an export file is "
+                             "written before a new one is started")
+
+    parser.add_argument("--config", type=str, metavar="FILE",
+                        help="JSON file with settings that override the "
+                             "arguments: url, retries, delay, verbose, "
+                             "max_requests and max_bytes. The file is "
+                             "reloaded on SIGHUP without interrupting the "
+                             "transfer in progress")
+
+    parser.add_argument("--control", type=str, metavar="PATH", nargs="?",
+                        const="",
+                        help="Unix socket to control the gateway while "
+                             "running with senaite_serial_control: status, "
+                             "pause, resume, drain, reload and set. By "
+                             "default, in the runtime directory of the user")
+
+    parser.add_argument("--log-file", type=str, metavar="FILE",
+                        help="Write the log to this file instead of the "
+                             "standard error. The file is reopened on SIGHUP, "
+                             "so it can be rotated")
+
+    parser.add_argument("--trace", type=str, metavar="FILE",
+                        help="Write the time spent in each processing stage "
+                             "(read, parse, validate, write, notify, auth, "
+                             "decode and post) to this file, as JSON lines")
+
     args = parser.parse_args()
 
+    # Settings from the configuration file
+    if args.config:
+        try:
+            for key, value in load_config(args.config).items():
+                setattr(args, key, value)
+        except (IOError, ValueError) as e:
+            print(e)
+            sys.exit(-1)
+
     # Set logging
     if args.verbose:
         logger.setLevel(logging.DEBUG)
     else:
         logger.setLevel(logging.INFO)
-    logger.addHandler(logging.StreamHandler())
+    log_handler = None
+    if args.log_file:
+        log_handler = logging.FileHandler(args.log_file)
+        log_handler.setFormatter(logging.Formatter(
+            "%(asctime)s %(levelname)s %(message)s"))
+        logger.addHandler(log_handler)
+    else:
+        logger.addHandler(logging.StreamHandler())
+
+    # Get the link profile and the decoder of the messages
+    try:
+        profile = get_link_profile(args.link_profile, args.link_profiles)
+        if args.encoding:
+            profile.encoding = args.encoding
+        decoder = Decoder(profile.encoding)
+    except (IOError, ValueError) as e:
+        logger.error(e)
+        sys.exit(-1)
+    if args.baudrate:
+        profile.baudrate = args.baudrate
+
+    # Memory held by the sessions of the process
+    budget.configure(args.max_memory * 1024 * 1024)
+
+    # Quality of the line
+    monitor = LineMonitor(args.port, profile, mode=args.line_tuning,
+                          threshold=args.line_threshold)
 
     # Instantiate the receiver
-    receiver = get_receiver(args)
+    receiver = get_receiver(args, decoder, monitor=monitor)
+
+    # Trace the processing stages
+    if args.trace:
+        tracer.open(args.trace)
+
+    # Reload the configuration and reopen the log file on SIGHUP
+    controller = Controller(receiver, args.port, config=args.config,
+                            log_handler=log_handler)
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, controller.on_hangup)
+
+    # Control socket
+    control = None
+    if args.control is not None:
+        path = args.control
+        try:
+            if not path:
+                path = get_control_path(args.port)
+                make_private_dir(os.path.dirname(path))
+            control = ControlServer(path, controller)
+        except (OSError, IOError, ValueError) as e:
+            logger.error(e)
+            sys.exit(-1)
+        logger.info("Control socket: {}".format(path))
+        control.start()
 
     # Start the server
-    start_server(args.port, args.baudrate, receiver)
+    try:
+        if args.profile:
+            run_profiled(args.profile, start_server, args.port, profile,
+                         receiver, monitor=monitor)
+        else:
+            start_server(args.port, profile, receiver, monitor=monitor)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if control:
+            control.server_close()
+        receiver.release()
+        tracer.close()
 
 
 if __name__ == "__main__":
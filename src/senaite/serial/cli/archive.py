@@ -0,0 +1,421 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.SERIAL.CLI.
+#
+# SENAITE.SERIAL.CLI is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2020 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+import argparse
+import binascii
+import fcntl
+import logging
+import mmap
+import os
+import sqlite3
+import struct
+import sys
+import threading
+import time
+import zlib
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime
+
+from . import lims
+from . import logger
+from .records import get_digest
+from .records import get_instrument
+from .records import get_sample_ids
+from .records import iter_chunks
+from .records import to_text
+from .uploader import Uploader
+
+#: Name of the index file
+INDEX_NAME = "index.dat"
+
+#: Name of the database with the keys of the index entries
+KEYS_NAME = "keys.db"
+
+#: Name of the segment files, with a placeholder for the segment number
+SEGMENT_NAME = "segment-{:06d}.dat"
+
+#: Maximum size of a segment file in bytes
+SEGMENT_SIZE = 64 * 1024 * 1024
+
+#: Size of the text fields of the index entries. Longer values are
+#: truncated, but stored in full in the keys database
+KEY_SIZE = 32
+
+#: Index entry: timestamp, segment, offset, length, digest (sha1),
+#: instrument and sample id. Text fields are null-padded
+ENTRY = struct.Struct("<dIQI20s{0}s{0}s".format(KEY_SIZE))
+
+#: Table of the keys database, with one row per index entry. Entries are
+#: not appended in time order (e.g. queries are archived before the results
+#: received earlier), so the reception time is indexed too
+KEYS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS keys (
+    num INTEGER PRIMARY KEY,
+    timestamp REAL NOT NULL,
+    digest TEXT NOT NULL,
+    instrument TEXT NOT NULL,
+    sample_id TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS keys_timestamp ON keys (timestamp);
+CREATE INDEX IF NOT EXISTS keys_digest ON keys (digest, timestamp);
+CREATE INDEX IF NOT EXISTS keys_instrument ON keys (instrument, timestamp);
+CREATE INDEX IF NOT EXISTS keys_sample_id ON keys (sample_id, timestamp);
+"""
+
+Entry = namedtuple("Entry", ["timestamp", "segment", "offset", "length",
+                             "digest", "instrument", "sample_id"])
+
+
+def to_key(value):
+    """Returns the value as null-padded bytes of KEY_SIZE length, as stored
+    in the index
+    """
+    value = to_text(value or u"").encode("utf-8")[:KEY_SIZE]
+    return value.ljust(KEY_SIZE, b"\0")
+
+
+def from_key(value):
+    return value.rstrip(b"\0").decode("utf-8", "replace")
+
+
+class Archive(object):
+    """Append-only archive of the messages received. Messages are compressed
+    and stored in segment files of limited size. A compact index of fixed-size
+    entries (one per sample of each message) allows to look up the messages
+    by time, instrument, sample id and content digest. Lookups are done in a
+    secondary index (sqlite), that keeps the keys in full, and the entries
+    found are read from the index through a memory map
+    """
+
+    def __init__(self, path, segment_size=SEGMENT_SIZE):
+        self.path = path
+        self.segment_size = segment_size
+        self._lock = threading.Lock()
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.segment = self.get_last_segment()
+        self._db = self.connect()
+        with self.locked():
+            self.sync()
+
+    @property
+    def index_path(self):
+        return os.path.join(self.path, INDEX_NAME)
+
+    @property
+    def keys_path(self):
+        return os.path.join(self.path, KEYS_NAME)
+
+    def connect(self):
+        """Returns a connection to the keys database. Connections are shared
+        by the threads that add messages, always under the archive lock
+        """
+        db = sqlite3.connect(self.keys_path, timeout=30,
+                             check_same_thread=False)
+        db.executescript(KEYS_SCHEMA)
+        return db
+
+    @contextmanager
+    def locked(self):
+        """Holds the archive for writing. Several processes (e.g. one per
+        port) might share the archive, so the lock is taken on the index file
+        as well. Yields the index file, open for append
+        """
+        with self._lock:
+            with open(self.index_path, "ab") as index:
+                fcntl.flock(index.fileno(), fcntl.LOCK_EX)
+                try:
+                    # Other processes might have written meanwhile
+                    index.seek(0, os.SEEK_END)
+                    self.segment = self.get_last_segment()
+                    yield index
+                finally:
+                    index.flush()
+                    fcntl.flock(index.fileno(), fcntl.LOCK_UN)
+
+    def get_count(self):
+        """Returns the number of entries of the index
+        """
+        if not os.path.exists(self.index_path):
+            return 0
+        return os.path.getsize(self.index_path) // ENTRY.size
+
+    def sync(self):
+        """Adds the keys of the index entries missing in the keys database,
+        e.g. written by a process that stopped right after. Keys are taken
+        from the index entries, so they might be truncated
+        """
+        start = self._db.execute(
+            "SELECT COALESCE(MAX(num) + 1, 0) FROM keys").fetchone()[0]
+        count = self.get_count()
+        if start >= count:
+            return
+        logger.info("Indexing the keys of {} archived messages".format(
+            count - start))
+        with open(self.index_path, "rb") as index:
+            index.seek(start * ENTRY.size)
+            rows = []
+            for num in range(start, count):
+                entry = self.to_entry(index.read(ENTRY.size))
+                rows.append((num, entry.timestamp, entry.digest,
+                             entry.instrument, entry.sample_id))
+        with self._db:
+            self._db.executemany("INSERT INTO keys VALUES (?, ?, ?, ?, ?)",
+                                 rows)
+
+    def get_segment_path(self, segment):
+        return os.path.join(self.path, SEGMENT_NAME.format(segment))
+
+    def get_last_segment(self):
+        segments = filter(lambda n: n.startswith("segment-"),
+                          os.listdir(self.path))
+        segments = sorted(segments)
+        if not segments:
+            return 1
+        return int(segments[-1][8:14])
+
+    def add(self, message, timestamp=None):
+        """Adds the message to the archive. Returns its digest. The message is
+        either a text or an iterable of text chunks, compressed as read
+        """
+        timestamp = timestamp or time.time()
+        compressor = zlib.compressobj()
+        chunks = []
+        for chunk in iter_chunks(message):
+            chunks.append(compressor.compress(to_text(chunk).encode("utf-8")))
+        chunks.append(compressor.flush())
+        data = b"".join(chunks)
+        digest = get_digest(message)
+        instrument = to_text(get_instrument(message) or u"")
+        sample_ids = get_sample_ids(message) or [u""]
+
+        with self.locked() as index:
+            segment_path = self.get_segment_path(self.segment)
+            if os.path.exists(segment_path):
+                if os.path.getsize(segment_path) >= self.segment_size:
+                    self.segment += 1
+                    segment_path = self.get_segment_path(self.segment)
+
+            with open(segment_path, "ab") as segment:
+                offset = segment.tell()
+                segment.write(data)
+
+            entries = map(lambda sample_id: ENTRY.pack(
+                timestamp, self.segment, offset, len(data),
+                binascii.unhexlify(digest), to_key(instrument),
+                to_key(sample_id)), sample_ids)
+            start = index.tell() // ENTRY.size
+            index.write(b"".join(entries))
+            index.flush()
+
+            rows = map(lambda num, sample_id: (
+                start + num, timestamp, digest, instrument,
+                to_text(sample_id)), range(len(sample_ids)), sample_ids)
+            with self._db:
+                self._db.executemany(
+                    "INSERT INTO keys VALUES (?, ?, ?, ?, ?)", rows)
+
+        return digest
+
+    def read(self, entry):
+        """Returns the message of the index entry passed-in
+        """
+        with open(self.get_segment_path(entry.segment), "rb") as segment:
+            segment.seek(entry.offset)
+            data = segment.read(entry.length)
+        return zlib.decompress(data).decode("utf-8")
+
+    def find(self, sample_id=None, instrument=None, digest=None, since=None,
+             until=None, limit=None):
+        """Returns the index entries that match with the criteria, from the
+        oldest to the newest. Messages with several samples are returned once
+        """
+        if not os.path.exists(self.index_path):
+            return []
+        if not os.path.getsize(self.index_path):
+            return []
+
+        db = self.connect()
+        with open(self.index_path, "rb") as index:
+            mm = mmap.mmap(index.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                return self._find(mm, db, sample_id=sample_id,
+                                  instrument=instrument, digest=digest,
+                                  since=since, until=until, limit=limit)
+            finally:
+                mm.close()
+                db.close()
+
+    def _find(self, mm, db, sample_id=None, instrument=None, digest=None,
+              since=None, until=None, limit=None):
+        # Search in the secondary index. Entries written after the index
+        # was mapped are left out
+        query = ["SELECT num, instrument, sample_id FROM keys",
+                 "WHERE num < ?"]
+        params = [len(mm) // ENTRY.size]
+        if since is not None:
+            query.append("AND timestamp >= ?")
+            params.append(since)
+        if until is not None:
+            query.append("AND timestamp <= ?")
+            params.append(until)
+        for name, value in (("digest", digest), ("sample_id", sample_id),
+                            ("instrument", instrument)):
+            if value:
+                query.append("AND {} = ?".format(name))
+                params.append(to_text(value))
+        query.append("ORDER BY timestamp, num")
+
+        entries = []
+        seen = set()
+        for num, instrument, sample_id in db.execute(" ".join(query), params):
+            entry = self.get_entry(mm, num)._replace(instrument=instrument,
+                                                     sample_id=sample_id)
+            key = (entry.segment, entry.offset)
+            if key in seen:
+                continue
+            seen.add(key)
+            entries.append(entry)
+            if limit and len(entries) >= limit:
+                break
+        return entries
+
+    def to_entry(self, data):
+        """Returns the index entry of the bytes passed-in
+        """
+        values = ENTRY.unpack(data)
+        timestamp, segment, offset, length, digest, instrument, sample = values
+        digest = binascii.hexlify(digest).decode("ascii")
+        return Entry(timestamp, segment, offset, length, digest,
+                     from_key(instrument), from_key(sample))
+
+    def get_entry(self, mm, num):
+        """Returns the index entry at the given position
+        """
+        offset = num * ENTRY.size
+        return self.to_entry(mm[offset:offset + ENTRY.size])
+
+
+def to_timestamp(value):
+    """Returns the timestamp of the date passed-in, as YYYY-MM-DD or
+    YYYY-MM-DD HH:MM[:SS]
+    """
+    if not value:
+        return None
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            date = datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+        return time.mktime(date.timetuple())
+    raise ValueError("Not a valid date: {}".format(value))
+
+
+def main():
+    """Entry-point of the archive command line tool, to find and re-push the
+    messages from the archive
+    """
+    parser = argparse.ArgumentParser(
+        description="SENAITE Serial archive of received messages",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("archive", help="Archive directory")
+    parser.add_argument("action", choices=["find", "show", "push"],
+                        help="Action to do with the messages found: list "
+                             "them, print their contents or push them to "
+                             "SENAITE")
+    parser.add_argument("-s", "--sample", type=str,
+                        help="Sample ID")
+    parser.add_argument("-i", "--instrument", type=str,
+                        help="Instrument name, as sent in the header")
+    parser.add_argument("--digest", type=str,
+                        help="Digest of the message content")
+    parser.add_argument("--since", type=str,
+                        help="Received since date (YYYY-MM-DD [HH:MM])")
+    parser.add_argument("--until", type=str,
+                        help="Received until date (YYYY-MM-DD [HH:MM])")
+    parser.add_argument("-n", "--limit", type=int,
+                        help="Maximum number of messages")
+    parser.add_argument("-u", "--url", type=str,
+                        help="SENAITE full URL address, with username and "
+                             "password. Required to push the messages")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="Verbose logging")
+    args = parser.parse_args()
+
+    logger.setLevel(args.verbose and logging.DEBUG or logging.INFO)
+    logger.addHandler(logging.StreamHandler())
+
+    try:
+        since = to_timestamp(args.since)
+        until = to_timestamp(args.until)
+    except ValueError as e:
+        logger.error(e)
+        sys.exit(-1)
+
+    archive = Archive(args.archive)
+    start = time.time()
+    entries = archive.find(sample_id=args.sample,
+                           instrument=args.instrument,
+                           digest=args.digest,
+                           since=since,
+                           until=until,
+                           limit=args.limit)
+    logger.debug("{} messages found in {:.3f}s".format(
+        len(entries), time.time() - start))
+
+    if args.action == "find":
+        for entry in entries:
+            date = datetime.fromtimestamp(entry.timestamp)
+            print("{} {} {} {}".format(date.strftime("%Y-%m-%d %H:%M:%S"),
+                                       entry.digest, entry.instrument or "-",
+                                       entry.sample_id or "-"))
+
+    elif args.action == "show":
+        for entry in entries:
+            print("-" * 80)
+            print(archive.read(entry))
+        if entries:
+            print("-" * 80)
+
+    elif args.action == "push":
+        if not args.url:
+            logger.error("Argument --url is required to push")
+            sys.exit(-1)
+
+        try:
+            info = lims.get_senaite_connection_info(args.url)
+        except ValueError as e:
+            logger.error(e)
+            sys.exit(-1)
+        uploader = Uploader(info["url"], info["user"], info["password"],
+                            workers=1)
+        for entry in entries:
+            uploader.put(archive.read(entry))
+        uploader.start()
+        uploader.stop()
+        uploader.join()
+        print("{pushed} messages pushed, {failed} failed".format(
+            **uploader.stats))
+
+
+if __name__ == "__main__":
+    main()
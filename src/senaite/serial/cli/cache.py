@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.SERIAL.CLI.
+#
+# SENAITE.SERIAL.CLI is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2020 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """Thread-safe mapping that keeps up to `maxsize` items, discarding the
+    least recently used ones first. Items older than `ttl` seconds are
+    considered expired and are never returned
+    """
+
+    def __init__(self, maxsize=10000, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def is_expired(self, timestamp, now=None):
+        """Returns whether an item stored at the given time has expired
+        """
+        if not self.ttl:
+            return False
+        now = now or time.time()
+        return now - timestamp > self.ttl
+
+    def get(self, key, default=None):
+        """Returns the value for the given key, if present and not expired
+        """
+        with self._lock:
+            item = self._items.pop(key, None)
+            if item is None:
+                return default
+            value, timestamp = item
+            if self.is_expired(timestamp):
+                return default
+            # Move to the end, this is the most recently used now
+            self._items[key] = item
+            return value
+
+    def set(self, key, value, timestamp=None):
+        """Stores the value for the given key
+        """
+        timestamp = timestamp or time.time()
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = (value, timestamp)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """Removes the given key and returns its value
+        """
+        with self._lock:
+            item = self._items.pop(key, None)
+        return default if item is None else item[0]
+
+    def purge(self):
+        """Removes all expired items
+        """
+        now = time.time()
+        with self._lock:
+            expired = [key for key, (value, timestamp) in self._items.items()
+                       if self.is_expired(timestamp, now)]
+            for key in expired:
+                del self._items[key]
+        return len(expired)
+
+    def items(self):
+        """Returns a list of (key, value, timestamp) tuples of the items that
+        are not expired, from least to most recently used
+        """
+        now = time.time()
+        with self._lock:
+            return [(key, value, timestamp)
+                    for key, (value, timestamp) in self._items.items()
+                    if not self.is_expired(timestamp, now)]
+
+    def __contains__(self, key):
+        marker = object()
+        return self.get(key, marker) is not marker
+
+    def __len__(self):
+        return len(self._items)
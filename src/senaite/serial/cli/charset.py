@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.SERIAL.CLI.
+#
+# SENAITE.SERIAL.CLI is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2020 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+import binascii
+import codecs
+import re
+import unicodedata
+
+from .records import DEFAULT_DELIMITERS
+
+#: Pseudo-encoding: UTF-8 if the message is valid UTF-8, Latin-1 otherwise
+AUTO = "auto"
+
+#: Encoding of the records sent to the instrument when set to auto
+OUTPUT_ENCODING = "latin-1"
+
+#: Sample of the characters a message starts with, used to check whether an
+#: encoding is a superset of ASCII
+ASCII_SAMPLE = u"H|\\^&|||0123456789ABCXYZabcxyz.-\r"
+
+
+def get_output_encoding(encoding):
+    """Returns the encoding of the records sent to the instrument
+    """
+    return encoding == AUTO and OUTPUT_ENCODING or encoding
+
+
+class Decoder(object):
+    """Decodes the messages received from an instrument to text, once per
+    message: bytes are decoded with the encoding of the instrument, the text
+    is normalized (NFC) and the escape sequences that do not stand for a
+    delimiter are resolved. Escaped delimiters (&F&, &S&, &R& and &E&) are
+    kept, so the message is still valid, and resolved when a field value is
+    read (see records.get_field)
+    """
+
+    def __init__(self, encoding=AUTO):
+        self.encoding = encoding
+        if encoding != AUTO:
+            try:
+                codecs.lookup(encoding)
+            except LookupError:
+                raise ValueError("Unknown encoding: {}".format(encoding))
+        # Pure ASCII messages are decoded as ASCII when the encoding is a
+        # superset of it, as no normalization is needed then
+        self.ascii = encoding == AUTO or self.is_ascii_compatible(encoding)
+        self._escapes = {}
+
+    def is_ascii_compatible(self, encoding):
+        try:
+            encoded = ASCII_SAMPLE.encode(encoding)
+        except UnicodeError:
+            return False
+        return encoded == ASCII_SAMPLE.encode("ascii")
+
+    def decode(self, data):
+        """Returns the message (bytes) as normalized text
+        """
+        if not isinstance(data, bytes):
+            return data
+        text, encoding = self.decode_data(data)
+        return self.resolve(text, encoding)
+
+    def iter_decode(self, lines):
+        """Yields the text of each line (bytes) passed-in, decoded as decode
+        does. Lines are decoded one at a time, so data of any size is decoded
+        with little memory. Escape sequences are resolved with the delimiters
+        of the last Header record
+        """
+        delimiters = DEFAULT_DELIMITERS
+        for line in lines:
+            text, encoding = self.decode_data(line)
+            record = text.lstrip(u"\r\n")
+            if record[:1] == u"H" and len(record) >= 5:
+                delimiters = record[1:5]
+            yield self.resolve(text, encoding, delimiters)
+
+    def decode_data(self, data):
+        """Returns a tuple with the normalized text of the data and the
+        encoding of its hexadecimal data
+        """
+        if self.ascii:
+            try:
+                text = data.decode("ascii")
+            except UnicodeDecodeError:
+                pass
+            else:
+                return text, self.get_hex_encoding()
+        text, encoding = self.decode_text(data)
+        return unicodedata.normalize("NFC", text), encoding
+
+    def get_hex_encoding(self):
+        """Returns the encoding of the hexadecimal data of a message in ASCII
+        """
+        return self.encoding == AUTO and "utf-8" or self.encoding
+
+    def decode_text(self, data):
+        """Returns a tuple with the text and the encoding used
+        """
+        if self.encoding != AUTO:
+            return data.decode(self.encoding, "replace"), self.encoding
+        try:
+            return data.decode("utf-8"), "utf-8"
+        except UnicodeDecodeError:
+            return data.decode("latin-1"), "latin-1"
+
+    def get_escape(self, escape):
+        """Returns the regex of the escape sequences resolved on decoding:
+        hexadecimal data (&Xhhhh&) and highlighting (&H& and &N&)
+        """
+        pattern = self._escapes.get(escape)
+        if pattern is None:
+            pattern = re.compile(u"{0}(X[0-9A-Fa-f]+|[HN]){0}".format(
+                re.escape(escape)))
+            self._escapes[escape] = pattern
+        return pattern
+
+    def resolve(self, text, encoding, delimiters=None):
+        """Resolves the escape sequences of the text in a single pass, with
+        the delimiters passed-in or the ones of the header the text starts
+        with
+        """
+        is_header = text[:1] == u"H" and len(text) >= 5
+        if delimiters is None:
+            delimiters = is_header and text[1:5] or DEFAULT_DELIMITERS
+        escape = delimiters[3]
+        if text.find(escape, is_header and 5 or 0) < 0:
+            # No escape sequences
+            return text
+
+        def replace(match):
+            sequence = match.group(1)
+            if sequence in (u"H", u"N"):
+                # Highlighting is not kept
+                return u""
+            data = sequence[1:]
+            if len(data) % 2:
+                return match.group(0)
+            value = binascii.unhexlify(data.encode("ascii"))
+            value = value.decode(encoding, "replace")
+            if any(map(lambda c: c in value, delimiters + u"\r\n")):
+                # Escaped delimiters are resolved when the field is read
+                return match.group(0)
+            return value
+
+        return self.get_escape(escape).sub(replace, text)
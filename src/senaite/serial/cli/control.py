@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.SERIAL.CLI.
+#
+# SENAITE.SERIAL.CLI is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2020 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+import argparse
+import json
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+
+try:
+    from SocketServer import StreamRequestHandler
+    from SocketServer import ThreadingMixIn
+    from SocketServer import UnixStreamServer
+except ImportError:
+    from socketserver import StreamRequestHandler
+    from socketserver import ThreadingMixIn
+    from socketserver import UnixStreamServer
+
+from . import lims
+from . import logger
+from .relay import get_runtime_dir
+
+#: Settings that can be changed while running, with their type
+SETTINGS = {
+    "url": str,
+    "retries": int,
+    "delay": int,
+    "verbose": bool,
+    "max_requests": float,
+    "max_bytes": int,
+}
+
+#: Commands of the control socket
+COMMANDS = ("status", "pause", "resume", "drain", "reload", "set")
+
+
+def get_control_path(port):
+    """Returns the default path of the control socket of the listener of the
+    port, in the runtime directory of the user
+    """
+    name = "control-{}.sock".format(os.path.basename(port.rstrip("/\\")))
+    return os.path.join(get_runtime_dir(), name)
+
+
+def load_config(path):
+    """Returns the settings from the JSON configuration file
+    """
+    with open(path, "r") as config:
+        settings = json.load(config)
+    unknown = set(settings) - set(SETTINGS)
+    if unknown:
+        raise ValueError("Unknown settings in {}: {}".format(
+            path, ", ".join(sorted(unknown))))
+    return settings
+
+
+def to_setting(key, value):
+    """Returns the value converted to the type of the setting
+    """
+    if key not in SETTINGS:
+        raise ValueError("Unknown setting: {}".format(key))
+    if SETTINGS[key] is bool:
+        return value.lower() in ("1", "true", "yes", "on")
+    return SETTINGS[key](value)
+
+
+class Controller(object):
+    """Changes the behavior of the running gateway: reloads the settings,
+    reopens the log file, pauses and resumes the port and reports the state
+    of the session. Transfers in progress are never interrupted
+    """
+
+    def __init__(self, receiver, port, config=None, log_handler=None):
+        self.receiver = receiver
+        self.port = port
+        self.config = config
+        self.log_handler = log_handler
+        self._lock = threading.Lock()
+
+    def status(self):
+        status = self.receiver.get_status()
+        status.update({
+            "port": self.port,
+            "rate_limit": lims.limiter.levels(),
+        })
+        return status
+
+    def pause(self):
+        """Stops accepting new transfers. The transfer in progress, if any,
+        is completed
+        """
+        self.receiver.paused = True
+        logger.info("Paused")
+        return self.status()
+
+    def resume(self):
+        self.receiver.paused = False
+        logger.info("Resumed")
+        return self.status()
+
+    def drain(self, timeout=60):
+        """Pauses and waits until the transfer in progress is completed and
+        the messages received are processed, up to timeout seconds
+        """
+        self.pause()
+        start = time.time()
+        while time.time() - start < timeout:
+            status = self.status()
+            if not status["in_transfer"] and not status["queued"]:
+                logger.info("Drained")
+                status["drained"] = True
+                return status
+            time.sleep(0.1)
+        status = self.status()
+        status["drained"] = False
+        return status
+
+    def reload(self):
+        """Reopens the log file and applies the settings of the
+        configuration file
+        """
+        self.reopen_log()
+        if not self.config:
+            return self.status()
+        try:
+            settings = load_config(self.config)
+        except (IOError, ValueError) as e:
+            logger.error("Cannot reload the configuration: {}".format(e))
+            raise
+        self.configure(**settings)
+        logger.info("Configuration reloaded from {}".format(self.config))
+        return self.status()
+
+    def on_hangup(self, signum=None, frame=None):
+        """Handler of SIGHUP. Reloads in a thread, so the locks held by the
+        interrupted code (e.g. logging) are not acquired again
+        """
+        def reload():
+            try:
+                self.reload()
+            except (IOError, ValueError):
+                pass
+        thread = threading.Thread(target=reload)
+        thread.daemon = True
+        thread.start()
+
+    def reopen_log(self):
+        """Reopens the log file, so it can be rotated by an external tool
+        """
+        handler = self.log_handler
+        if not handler:
+            return
+        handler.acquire()
+        try:
+            handler.close()
+            # The file is reopened on next write
+            handler.stream = None
+        finally:
+            handler.release()
+
+    def configure(self, **settings):
+        """Applies the settings to the running gateway
+        """
+        with self._lock:
+            if "verbose" in settings:
+                level = settings["verbose"] and logging.DEBUG or logging.INFO
+                logger.setLevel(level)
+
+            if "max_requests" in settings or "max_bytes" in settings:
+                requests = settings.get("max_requests",
+                                        lims.limiter.requests.rate)
+                nbytes = settings.get("max_bytes", lims.limiter.bytes.rate)
+                lims.limiter.configure(requests=requests, nbytes=nbytes)
+
+            params = {}
+            for key in ("retries", "delay"):
+                if key in settings:
+                    params[key] = settings[key]
+            if settings.get("url"):
+                params.update(lims.get_senaite_connection_info(
+                    settings["url"]))
+            if params and hasattr(self.receiver, "configure"):
+                self.receiver.configure(**params)
+        return self.status()
+
+    def handle(self, line):
+        """Runs the command line passed-in and returns the reply
+        """
+        tokens = line.split()
+        if not tokens or tokens[0] not in COMMANDS:
+            raise ValueError("Unknown command. Available: {}".format(
+                ", ".join(COMMANDS)))
+        command, args = tokens[0], tokens[1:]
+        if command == "drain":
+            return self.drain(*map(float, args))
+        if command == "set":
+            if len(args) != 2:
+                raise ValueError("Usage: set <setting> <value>")
+            return self.configure(**{args[0]: to_setting(*args)})
+        return getattr(self, command)()
+
+
+class ControlServer(ThreadingMixIn, UnixStreamServer):
+    """Unix socket server of the control commands, one per line. Each reply
+    is a JSON object in a single line
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path, controller):
+        if os.path.exists(path):
+            # Socket left by a previous run
+            os.remove(path)
+        UnixStreamServer.__init__(self, path, ControlRequestHandler)
+        # Only the user running the gateway can control it
+        os.chmod(path, 0o600)
+        self.path = path
+        self.controller = controller
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def server_close(self):
+        UnixStreamServer.server_close(self)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class ControlRequestHandler(StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                line = line.decode("utf-8").strip()
+                reply = {"success": True}
+                reply.update(self.server.controller.handle(line))
+            except Exception as e:
+                reply = {"success": False, "message": str(e)}
+            self.wfile.write(json.dumps(reply).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+
+def send_command(path, command, timeout=120):
+    """Sends the command to the control socket and returns the reply
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(path)
+        sock.sendall(command.encode("utf-8") + b"\n")
+        reply = b""
+        while not reply.endswith(b"\n"):
+            chunk = sock.recv(4096)
+            if not chunk:
+                break
+            reply += chunk
+    finally:
+        sock.close()
+    return json.loads(reply.decode("utf-8"))
+
+
+def main():
+    """Entry-point of the command line tool to control a running gateway
+    through its control socket
+    """
+    parser = argparse.ArgumentParser(
+        description="Controls a running SENAITE Serial gateway",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("socket", help="Control socket of the gateway")
+    parser.add_argument("command", choices=COMMANDS,
+                        help="status: state of the session and queues. "
+                             "pause/resume: stop/start accepting new "
+                             "transfers. drain: pause and wait until the "
+                             "messages received are processed. reload: "
+                             "reload the configuration file and reopen the "
+                             "log file. set: change a setting ({})".format(
+                                 ", ".join(sorted(SETTINGS))))
+    parser.add_argument("args", nargs="*",
+                        help="Arguments of the command")
+    args = parser.parse_args()
+
+    try:
+        reply = send_command(args.socket, " ".join(
+            [args.command] + args.args))
+    except socket.error as e:
+        print("Cannot connect to {}: {}".format(args.socket, e))
+        sys.exit(-1)
+    print(json.dumps(reply, indent=2, sort_keys=True))
+    if not reply.get("success"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.SERIAL.CLI.
+#
+# SENAITE.SERIAL.CLI is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2020 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+import os
+import threading
+import time
+
+from . import logger
+from .cache import LRUCache
+from .records import get_digest
+
+#: Duplicates are not pushed
+SUPPRESS = "suppress"
+#: Duplicates are pushed, but flagged as such
+FLAG = "flag"
+
+MODES = (SUPPRESS, FLAG)
+
+
+class PushIndex(object):
+    """Bounded index of the content digests of the messages pushed recently.
+    When a path is given, the index is persisted in an append-only journal,
+    so it survives restarts. The journal is compacted on load
+    """
+
+    def __init__(self, path=None, maxsize=10000, ttl=86400):
+        self.path = path
+        self._cache = LRUCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self._journal = None
+        if self.path:
+            self.load()
+
+    def load(self):
+        """Loads the journal from disk and compacts it
+        """
+        if os.path.exists(self.path):
+            with open(self.path, "r") as journal:
+                for line in journal:
+                    tokens = line.split()
+                    if len(tokens) != 2:
+                        continue
+                    try:
+                        timestamp = float(tokens[1])
+                    except ValueError:
+                        continue
+                    self._cache.set(tokens[0], True, timestamp=timestamp)
+
+        # Rewrite the journal with the entries that are still valid
+        items = self._cache.items()
+        tmp_path = "{}.tmp".format(self.path)
+        with open(tmp_path, "w") as journal:
+            for digest, value, timestamp in items:
+                journal.write("{} {:.0f}\n".format(digest, timestamp))
+        os.rename(tmp_path, self.path)
+        self._journal = open(self.path, "a")
+        logger.info("Duplicates index loaded: {} entries".format(len(items)))
+
+    def claim(self, message):
+        """Returns the digest of the message if it was not pushed recently and
+        registers it as pushed. Returns None if the message is a duplicate
+        """
+        digest = get_digest(message)
+        with self._lock:
+            if digest in self._cache:
+                return None
+            self._cache.set(digest, True)
+        return digest
+
+    def commit(self, digest):
+        """Persists a digest previously claimed, once the push succeeded
+        """
+        if not self._journal:
+            return
+        with self._lock:
+            self._journal.write("{} {:.0f}\n".format(digest, time.time()))
+            self._journal.flush()
+
+    def discard(self, digest):
+        """Forgets a digest previously claimed, because the push failed
+        """
+        self._cache.pop(digest)
+
+    def close(self):
+        if self._journal:
+            self._journal.close()
+            self._journal = None
+
+    def __len__(self):
+        return len(self._cache)
+
+    def __bool__(self):
+        # An empty index is still an index
+        return True
+
+    __nonzero__ = __bool__
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.SERIAL.CLI.
+#
+# SENAITE.SERIAL.CLI is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2020 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+import threading
+
+from . import logger
+from .query import get_order_records
+from .records import PRIORITIES
+
+
+class OrderDownloader(object):
+    """Downloads the orders from the worklist to the instrument. Orders not
+    downloaded yet are queued in the sender in batches, one message per batch,
+    so a whole rack of orders is sent to the instrument in a single session.
+    Orders of a batch the sender fails to deliver are downloaded again
+    """
+
+    def __init__(self, worklist, sender, batch_size=100, interval=60,
+                 encoding="latin-1"):
+        self.worklist = worklist
+        self.sender = sender
+        self.batch_size = batch_size
+        self.interval = interval
+        self.encoding = encoding
+        self.downloaded = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        """Downloads the orders pending and keeps downloading the new ones
+        in a background thread
+        """
+        self.download()
+        self._thread = threading.Thread(target=self.run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.download()
+            except Exception as e:
+                logger.error("Cannot download orders: {}".format(e))
+
+    def download(self):
+        """Queues the orders not downloaded yet into the sender
+        """
+        orders = self.worklist.get_orders()
+
+        with self._lock:
+            # Forget the orders that are no longer in the worklist
+            self.downloaded.intersection_update(
+                map(lambda o: o.sample_id, orders))
+            orders = filter(lambda o: o.sample_id not in self.downloaded,
+                            orders)
+            orders = sorted(orders, key=lambda o: (
+                PRIORITIES.find(o.priority), o.sample_id))
+        for start in range(0, len(orders), self.batch_size):
+            batch = orders[start:start + self.batch_size]
+            records = get_order_records(batch)
+            records.append(u"L|1|N")
+            records = map(lambda r: r.encode(self.encoding), records)
+            sample_ids = list(map(lambda o: o.sample_id, batch))
+            # Orders queued are not downloaded again while in the sender
+            with self._lock:
+                self.downloaded.update(sample_ids)
+            self.sender.send(list(records),
+                             callback=self.get_callback(sample_ids))
+
+        if orders:
+            logger.info("{} orders queued for download".format(len(orders)))
+        return len(orders)
+
+    def get_callback(self, sample_ids):
+        """Returns the function the sender calls once the batch of orders is
+        delivered or the transfer aborted
+        """
+        def callback(delivered):
+            if delivered:
+                logger.info("{} orders downloaded".format(len(sample_ids)))
+                return
+            logger.warn("{} orders not delivered. Downloading them again "
+                        "in {}s".format(len(sample_ids), self.interval))
+            with self._lock:
+                self.downloaded.difference_update(sample_ids)
+        return callback
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.SERIAL.CLI.
+#
+# SENAITE.SERIAL.CLI is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2020 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+import io
+import json
+import os
+import threading
+import time
+
+from . import logger
+from .records import get_results
+from .records import to_text
+
+#: Export formats
+NDJSON = "ndjson"
+CSV = "csv"
+FORMATS = (NDJSON, CSV)
+
+#: Columns of the exported results, in order
+COLUMNS = ("instrument", "sample_id", "code", "value", "units", "flags",
+           "status", "date", "received")
+
+#: Suffix of the file being written. It is removed on rotation, so files
+#: without it are complete and ready for import
+PARTIAL_SUFFIX = ".part"
+
+#: Default size in bytes of the write buffer
+BUFFER_SIZE = 64 * 1024
+
+
+def to_csv(values):
+    """Returns a CSV line with the values passed-in, all quoted
+    """
+    values = map(lambda v: u'"{}"'.format(v.replace(u'"', u'""')), values)
+    return u",".join(values) + u"\r\n"
+
+
+def to_ndjson(row):
+    """Returns a JSON line with the row passed-in
+    """
+    return to_text(json.dumps(row, sort_keys=True)) + u"\n"
+
+
+class Exporter(object):
+    """Writes the results of the messages received to files in NDJSON or CSV
+    format, one line per result, for their import in bulk. Writes are
+    buffered, and files are rotated when they reach the maximum size or when
+    the rotation interval elapses, whatever comes first
+    """
+
+    def __init__(self, path, fmt=NDJSON, max_size=64 * 1024 * 1024,
+                 interval=3600, buffer_size=BUFFER_SIZE):
+        if fmt not in FORMATS:
+            raise ValueError("Format not supported: {}".format(fmt))
+        self.path = path
+        self.format = fmt
+        self.max_size = max_size
+        self.interval = interval
+        self.buffer_size = buffer_size
+        self._file = None
+        self._file_path = None
+        self._opened = 0
+        self._size = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopped = threading.Event()
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def start(self):
+        """Rotates the file in a background thread when the interval elapses,
+        so files are ready for import even if no more messages arrive
+        """
+        self._thread = threading.Thread(target=self.run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self.close()
+
+    def run(self):
+        while not self._stopped.wait(1):
+            with self._lock:
+                if self._file and self.is_expired():
+                    self.rotate()
+
+    def is_expired(self):
+        return time.time() - self._opened >= self.interval
+
+    def get_file_path(self):
+        """Returns the path of a new export file, named after the current
+        date and time
+        """
+        name = time.strftime("results-%Y%m%d-%H%M%S")
+        path = os.path.join(self.path, "{}.{}".format(name, self.format))
+        num = 1
+        while os.path.exists(path) or os.path.exists(path + PARTIAL_SUFFIX):
+            num += 1
+            path = os.path.join(self.path, "{}-{}.{}".format(
+                name, num, self.format))
+        return path
+
+    def open(self):
+        self._file_path = self.get_file_path()
+        self._file = io.open(self._file_path + PARTIAL_SUFFIX, "w",
+                             encoding="utf-8", newline="",
+                             buffering=self.buffer_size)
+        self._opened = time.time()
+        self._size = 0
+        if self.format == CSV:
+            self.write_text(to_csv(COLUMNS))
+
+    def write_text(self, text):
+        """Writes the text to the buffer of the file. The size written is
+        counted, for tell() would flush the buffer on each call
+        """
+        self._file.write(text)
+        self._size += len(text.encode("utf-8"))
+
+    def rotate(self):
+        """Closes the current file, making it available for import
+        """
+        if not self._file:
+            return
+        self._file.close()
+        self._file = None
+        self._size = 0
+        os.rename(self._file_path + PARTIAL_SUFFIX, self._file_path)
+        logger.info("Results exported to {}".format(self._file_path))
+
+    def close(self):
+        with self._lock:
+            self.rotate()
+
+    def write(self, message, results=None):
+        """Writes the results of the message. Results already parsed can be
+        passed-in. Returns the number of results
+        """
+        if results is None:
+            results = get_results(message)
+        if not results:
+            return 0
+        received = time.strftime("%Y%m%d%H%M%S")
+        lines = []
+        for result in results:
+            result["received"] = received
+            if self.format == CSV:
+                lines.append(to_csv(map(lambda c: result[c], COLUMNS)))
+            else:
+                lines.append(to_ndjson(result))
+
+        with self._lock:
+            if self._file and self.is_expired():
+                self.rotate()
+            if not self._file:
+                self.open()
+            self.write_text(u"".join(lines))
+            if self._size >= self.max_size:
+                self.rotate()
+        return len(results)
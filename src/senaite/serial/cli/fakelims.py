@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.SERIAL.CLI.
+#
+# SENAITE.SERIAL.CLI is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2020 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+import argparse
+import base64
+import json
+import logging
+import random
+import threading
+import time
+from datetime import datetime
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler
+    from BaseHTTPServer import HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs
+    from urlparse import urlparse
+except ImportError:
+    from http.server import BaseHTTPRequestHandler
+    from http.server import HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs
+    from urllib.parse import urlparse
+
+from . import logger
+from .lims import API_BASE_URL
+
+#: Version reported by the fake JSON API
+VERSION = "2.0.0"
+
+
+class FakeSenaiteServer(ThreadingMixIn, HTTPServer):
+    """Lightweight stand-in of SENAITE's JSON API, with the routes used by
+    this tool (version, users/current, search and push). Latency, errors and
+    authentication failures can be injected to test the upload path. Beyond
+    the capacity (requests at the same time), if set, the latency grows with
+    the number of requests, as in an overloaded SENAITE
+    """
+
+    daemon_threads = True
+
+    # Connections waiting to be accepted. Beyond, clients wait for the
+    # retransmission of the connection request
+    request_queue_size = 128
+
+    def __init__(self, address, user="admin", password="admin", latency=0,
+                 jitter=0, error_rate=0, auth_failure_rate=0, capacity=0,
+                 gateway_error_rate=0):
+        HTTPServer.__init__(self, address, FakeSenaiteRequestHandler)
+        self.user = user
+        self.password = password
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.auth_failure_rate = auth_failure_rate
+        self.capacity = capacity
+        self.gateway_error_rate = gateway_error_rate
+        self.stats = {
+            "requests": 0,
+            "pushed": 0,
+            "errors": 0,
+            "auth_failures": 0,
+            "concurrency": 0,
+            "max_concurrency": 0,
+        }
+        self.messages = []
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+    def count(self, key, amount=1):
+        with self.lock:
+            self.stats[key] += amount
+            if key == "concurrency":
+                self.stats["max_concurrency"] = max(
+                    self.stats["max_concurrency"], self.stats["concurrency"])
+
+    def add_sample(self, sample_id, review_state="sample_received"):
+        """Registers a sample, or changes its state
+        """
+        modified = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.%f")
+        with self.lock:
+            self.samples[sample_id] = {
+                "getId": sample_id,
+                "review_state": review_state,
+                "modified": modified,
+            }
+
+    def start(self):
+        """Serves requests in a background thread
+        """
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+
+class FakeSenaiteRequestHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        logger.debug("fakelims: " + format % args)
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def handle_request(self, method):
+        server = self.server
+        server.count("requests")
+        server.count("concurrency")
+        try:
+            self.simulate_latency()
+            self.dispatch(method)
+        finally:
+            server.count("concurrency", -1)
+
+    def simulate_latency(self):
+        server = self.server
+        latency = server.latency
+        if server.jitter:
+            latency += random.uniform(0, server.jitter)
+        if server.capacity:
+            latency *= max(1.0, float(server.stats["concurrency"]) /
+                           server.capacity)
+        if latency > 0:
+            time.sleep(latency)
+
+    def dispatch(self, method):
+        server = self.server
+        url = urlparse(self.path)
+        marker = "/{}/".format(API_BASE_URL)
+        if marker not in url.path:
+            return self.reply(404, {"message": "Not found"})
+        route = url.path.split(marker, 1)[1].strip("/")
+
+        if not self.is_authorized():
+            server.count("auth_failures")
+            return self.reply(401, {"message": "Unauthorized"})
+
+        if random.random() < server.error_rate:
+            server.count("errors")
+            return self.reply(500, {"message": "Internal error"})
+
+        if route == "version":
+            return self.reply(200, {"version": VERSION})
+
+        if route == "users/current":
+            return self.reply(200, {"items": [{
+                "username": server.user,
+                "authenticated": True,
+            }]})
+
+        if route == "search":
+            return self.search(parse_qs(url.query))
+
+        if route == "push" and method == "POST":
+            if random.random() < server.gateway_error_rate:
+                # Error page from a proxy in front of SENAITE
+                server.count("errors")
+                return self.reply_html(502, "Bad Gateway")
+            return self.push()
+
+        return self.reply(404, {"message": "Route not found"})
+
+    def is_authorized(self):
+        server = self.server
+        if random.random() < server.auth_failure_rate:
+            return False
+        header = self.headers.get("Authorization") or ""
+        if not header.startswith("Basic "):
+            return False
+        credentials = base64.b64decode(header[6:].encode("ascii"))
+        expected = "{}:{}".format(server.user, server.password)
+        return credentials == expected.encode("utf-8")
+
+    def search(self, query):
+        """Replies with the samples that match with the query, page by page
+        """
+        items = []
+        if query.get("portal_type") == ["AnalysisRequest"]:
+            with self.server.lock:
+                items = list(self.server.samples.values())
+        if "getId" in query:
+            items = filter(lambda i: i["getId"] in query["getId"], items)
+        if "review_state" in query:
+            items = filter(lambda i: i["review_state"] in
+                           query["review_state"], items)
+        items = sorted(items, key=lambda i: i["modified"],
+                       reverse=query.get("sort_order") == ["descending"])
+        start = int(query.get("b_start", ["0"])[0])
+        limit = int(query.get("limit", ["50"])[0])
+        page = items[start:start + limit]
+        more = start + limit < len(items)
+        return self.reply(200, {
+            "count": len(items),
+            "items": page,
+            "next": more and "{}&b_start={}".format(
+                self.path, start + limit) or None,
+        })
+
+    def push(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length).decode("utf-8")
+        form = parse_qs(body)
+        messages = form.get("messages") or []
+        if not messages:
+            return self.reply(200, {"success": False,
+                                    "message": "No messages"})
+        with self.server.lock:
+            self.server.messages.extend(messages)
+        self.server.count("pushed", len(messages))
+        return self.reply(200, {"success": True})
+
+    def reply(self, status, data):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def reply_html(self, status, title):
+        body = "<html><body><h1>{} {}</h1></body></html>".format(
+            status, title).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def main():
+    """Entry-point of the fake SENAITE JSON API server
+    """
+    parser = argparse.ArgumentParser(
+        description="Fake SENAITE JSON API server, for testing",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("-H", "--host", type=str, default="localhost",
+                        help="Host to listen at")
+    parser.add_argument("-p", "--port", type=int, default=8080,
+                        help="Port to listen at")
+    parser.add_argument("--user", type=str, default="admin",
+                        help="Username")
+    parser.add_argument("--password", type=str, default="admin",
+                        help="Password")
+    parser.add_argument("--latency", type=float, default=0,
+                        help="Time in seconds each request takes")
+    parser.add_argument("--jitter", type=float, default=0,
+                        help="Maximum random time in seconds added to the "
+                             "latency of each request")
+    parser.add_argument("--error-rate", type=float, default=0,
+                        help="Ratio of requests that fail with an error "
+                             "(0 to 1)")
+    parser.add_argument("--auth-failure-rate", type=float, default=0,
+                        help="Ratio of requests rejected as unauthorized "
+                             "(0 to 1)")
+    parser.add_argument("--gateway-error-rate", type=float, default=0,
+                        help="Ratio of pushes that fail with an HTML error "
+                             "page, as from a proxy (0 to 1)")
+    parser.add_argument("--capacity", type=int, default=0,
+                        help="Number of requests served at the same time "
+                             "without delay. Beyond, the latency grows with "
+                             "the number of requests. Set to 0 for no limit")
+    parser.add_argument("--samples", type=int, default=0,
+                        help="Number of received samples registered, with "
+                             "ids S-00001, S-00002, etc.")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="Verbose logging")
+    args = parser.parse_args()
+
+    logger.setLevel(args.verbose and logging.DEBUG or logging.INFO)
+    logger.addHandler(logging.StreamHandler())
+
+    server = FakeSenaiteServer((args.host, args.port),
+                               user=args.user,
+                               password=args.password,
+                               latency=args.latency,
+                               jitter=args.jitter,
+                               error_rate=args.error_rate,
+                               auth_failure_rate=args.auth_failure_rate,
+                               capacity=args.capacity,
+                               gateway_error_rate=args.gateway_error_rate)
+    for num in range(args.samples):
+        server.add_sample("S-{:05d}".format(num + 1))
+    print("Fake SENAITE listening at http://{}:{}@{}:{}, press Ctrl+c to "
+          "exit.".format(args.user, args.password, args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(server.stats, sort_keys=True))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.SERIAL.CLI.
+#
+# SENAITE.SERIAL.CLI is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2020 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+import argparse
+import json
+import logging
+import platform
+import time
+
+from . import logger
+from .charset import Decoder
+from .link import CommandReader
+from .lis1a import ENQ
+from .lis1a import EOT
+from .lis1a import Frame
+from .lis1a import LIS1AHandler
+from .sender import build_frames
+
+#: Records of the transfer received, with placeholders for the sample id and
+#: a value that makes the records long enough to be split in several frames
+RECORDS = [
+    u"H|\\^&|||Bench^SENAITE||||||||1|20200101000000",
+    u"P|1||||Müller^José",
+    u"O|1|{sample_id}||^^^ALL|R|20200101000000|||||A||||||||||||||F",
+    u"R|1|^^^Cu|61|mg/L||N||F||||20200101000000|Bench",
+    u"C|1|I|{comment}|G",
+    u"L|1|N",
+]
+
+
+class BenchHandler(LIS1AHandler):
+    """Handler that counts the messages notified instead of printing them
+    """
+
+    def __init__(self, **kwargs):
+        super(BenchHandler, self).__init__(**kwargs)
+        self.notified = 0
+
+    def notify(self, message):
+        self.notified += 1
+
+
+def get_transfer(num, encoding="latin-1", comment_size=400):
+    """Returns the bytes sent by the instrument for a transfer: <ENQ>, the
+    frames of the records and <EOT>
+    """
+    comment = u"x" * comment_size
+    records = map(lambda r: r.format(sample_id="B-{:06d}".format(num),
+                                     comment=comment), RECORDS)
+    records = map(lambda r: r.encode(encoding), records)
+    return ENQ + b"".join(build_frames(list(records))) + EOT
+
+
+def timeit(func, repeat):
+    """Returns the time in seconds it takes to call the function repeat times
+    """
+    start = time.time()
+    for num in range(repeat):
+        func()
+    return time.time() - start
+
+
+def run(transfers=1000, chunk_size=64, encoding="latin-1"):
+    """Feeds the transfers to the receiver as read from the serial port, in
+    chunks, and returns a dict with the results: throughput of the whole
+    receive path and of the byte-level steps on their own
+    """
+    handler = BenchHandler(decoder=Decoder(encoding))
+    reader = CommandReader()
+    data = [get_transfer(num, encoding=encoding) for num in range(transfers)]
+    frames = 0
+    start = time.time()
+    for transfer in data:
+        for offset in range(0, len(transfer), chunk_size):
+            for command in reader.feed(transfer[offset:offset + chunk_size]):
+                frames += command[:1] != ENQ and command[:1] != EOT
+                handler.write(command)
+                handler.read()
+    duration = time.time() - start
+    handler.release()
+
+    size = sum(map(len, data))
+    frame = Frame(build_frames([b"R|1|^^^Cu|61|mg/L||N||F"])[0])
+    text = data[0].decode(encoding).encode(encoding)
+    checksum = timeit(frame.is_valid, 100000)
+    decode = timeit(lambda: handler._decoder.decode(text), 10000)
+    return {
+        "interpreter": platform.python_implementation(),
+        "version": platform.python_version(),
+        "transfers": transfers,
+        "notified": handler.notified,
+        "frames": frames,
+        "bytes": size,
+        "duration": round(duration, 3),
+        "frames_per_second": int(frames / duration),
+        "bytes_per_second": int(size / duration),
+        "frame_checks_per_second": int(100000 / checksum),
+        "decodes_per_second": int(10000 / decode),
+    }
+
+
+def main():
+    """Entry-point of the receive path benchmark. Run it with each
+    interpreter to compare them
+    """
+    parser = argparse.ArgumentParser(
+        description="Receive path benchmark",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("-n", "--transfers", type=int, default=1000,
+                        help="Number of transfers received")
+    parser.add_argument("-c", "--chunk-size", type=int, default=64,
+                        help="Number of bytes read from the port at once")
+    parser.add_argument("-e", "--encoding", type=str, default="latin-1",
+                        help="Encoding of the instrument")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="Verbose logging")
+    args = parser.parse_args()
+
+    logger.setLevel(args.verbose and logging.DEBUG or logging.ERROR)
+    logger.addHandler(logging.StreamHandler())
+
+    results = run(transfers=args.transfers,
+                  chunk_size=args.chunk_size,
+                  encoding=args.encoding)
+    print(json.dumps(results, sort_keys=True))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.SERIAL.CLI.
+#
+# SENAITE.SERIAL.CLI is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2020 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+import argparse
+import json
+import logging
+import random
+import string
+import sys
+import time
+import traceback
+
+from . import logger
+from .link import CommandReader
+from .lis1a import ACK
+from .lis1a import ENQ
+from .lis1a import EOT
+from .lis1a import LF
+from .lis1a import NAK
+from .lis1a import STX
+from .lis1a import LIS1AHandler
+from .records import get_records
+from .sender import MAX_ATTEMPTS
+from .sender import build_frames
+
+#: Characters of the generated field values
+ALPHABET = string.ascii_letters + string.digits + " .-"
+
+#: Control characters injected as noise in the line
+NOISE = (ENQ, ACK, NAK, STX, LF)
+
+
+class FuzzHandler(LIS1AHandler):
+    """Handler that keeps the messages notified instead of printing them
+    """
+
+    def __init__(self, **kwargs):
+        super(FuzzHandler, self).__init__(**kwargs)
+        self.notified = []
+
+    def notify(self, message):
+        self.notified.append(message)
+
+
+class Violation(Exception):
+    """An invariant of the handler does not hold
+    """
+
+
+def get_value(rng):
+    """Returns a random field value. Some are long enough to be split in
+    several frames
+    """
+    size = rng.random() < 0.05 and rng.randint(200, 800) or rng.randint(1, 12)
+    return "".join(rng.choice(ALPHABET) for i in range(size))
+
+
+def get_transfer(rng):
+    """Returns the list of records of a random transfer
+    """
+    records = ["H|\\^&|||Fuzz^{}||||||||1|20200101000000".format(
+        rng.randint(1, 9))]
+    for patient in range(rng.randint(1, 2)):
+        records.append("P|{}".format(patient + 1))
+        for order in range(rng.randint(1, 3)):
+            records.append("O|{}|S-{:06d}||^^^ALL|{}".format(
+                order + 1, rng.randint(0, 999999), rng.choice("SAR")))
+            for result in range(rng.randint(1, 6)):
+                records.append("R|{}|^^^{}|{}|mg/L||N||F".format(
+                    result + 1, get_value(rng)[:8], get_value(rng)))
+    records.append("L|1|N")
+    return list(map(lambda r: r.encode("ascii"), records))
+
+
+def get_noise(rng):
+    """Returns random bytes with a high density of control characters. The
+    noise never contains <EOT>, as it would end the transfer
+    """
+    noise = b""
+    for num in range(rng.randint(1, 16)):
+        if rng.random() < 0.5:
+            noise += rng.choice(NOISE)
+        else:
+            noise += rng.choice(ALPHABET).encode("ascii")
+    return noise
+
+
+def corrupt(rng, frame):
+    """Returns the frame with a line fault: a bit flipped, a byte dropped, a
+    byte inserted or the frame truncated
+    """
+    data = bytearray(frame)
+    pos = rng.randrange(len(data))
+    fault = rng.randint(0, 3)
+    if fault == 0:
+        data[pos] ^= 1 << rng.randint(0, 7)
+    elif fault == 1:
+        del data[pos]
+    elif fault == 2:
+        # A NUL byte does not change the checksum. Leave it out, as no
+        # checksum-based protocol can detect it
+        data.insert(pos, rng.randint(1, 255))
+    else:
+        data = data[:pos]
+    return bytes(data)
+
+
+def get_garbage(rng, size):
+    """Returns adversarial bytes: random bytes, control characters and
+    fragments of frames
+    """
+    chunks = []
+    while sum(map(len, chunks)) < size:
+        choice = rng.random()
+        if choice < 0.3:
+            chunks.append(rng.choice((ENQ, EOT, ACK, NAK, STX, LF)))
+        elif choice < 0.6:
+            frame = build_frames([get_value(rng).encode("ascii")],
+                                 start_fn=rng.randint(0, 7))[0]
+            chunks.append(frame[:rng.randint(1, len(frame))])
+        else:
+            chunks.append(bytes(bytearray(
+                rng.randint(0, 255) for i in range(rng.randint(1, 32)))))
+    return b"".join(chunks)
+
+
+class Fuzzer(object):
+    """Drives transfers through the handler, playing the instrument side of
+    the protocol over a faulty line, and checks that:
+
+    - the handler never raises
+    - each frame gets an <ACK> or <NAK> reply
+    - transfers not aborted are notified exactly as sent, regardless of the
+      faults, the noise and the retransmissions
+    - aborted transfers never notify records that were not sent
+    - the handler is back in neutral state after each <EOT>
+    """
+
+    def __init__(self, seed=0, corruption=0.05, noise=0.02, adversarial=0.05):
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.corruption = corruption
+        self.noise = noise
+        self.adversarial = adversarial
+        self.handler = FuzzHandler()
+        self.reader = CommandReader()
+        self.elapsed = 0
+        self.stats = {
+            "transfers": 0,
+            "adversarial": 0,
+            "frames": 0,
+            "bytes": 0,
+            "faults": 0,
+            "naks": 0,
+            "aborted": 0,
+            "delivered": 0,
+            "violations": 0,
+        }
+
+    def transmit(self, data):
+        """Sends the data through the line in chunks of random size, as read
+        from the serial port. Returns the replies of the handler
+        """
+        replies = []
+        self.stats["bytes"] += len(data)
+        while data:
+            size = self.rng.randint(1, 256)
+            chunk, data = data[:size], data[size:]
+            start = time.time()
+            for command in self.reader.feed(chunk):
+                self.handler.write(command)
+                replies.append(self.handler.read())
+            self.elapsed += time.time() - start
+        return replies
+
+    def run_transfer(self):
+        """Sends a transfer and checks the invariants
+        """
+        rng = self.rng
+        records = get_transfer(rng)
+        self.handler.notified = []
+
+        self.transmit(ENQ)
+        aborted = False
+        for frame in build_frames(records):
+            self.stats["frames"] += 1
+            for attempt in range(MAX_ATTEMPTS):
+                if rng.random() < self.noise:
+                    self.transmit(get_noise(rng))
+                data = frame
+                if rng.random() < self.corruption:
+                    self.stats["faults"] += 1
+                    data = corrupt(rng, frame)
+                replies = [r for r in self.transmit(data) if r in (ACK, NAK)]
+                if replies and replies[-1] == ACK:
+                    break
+                # <NAK> or no reply (timeout). Retransmit the frame
+                self.stats["naks"] += 1
+            else:
+                aborted = True
+                break
+        self.transmit(EOT)
+        # Bytes of a frame truncated at the end of the transfer
+        self.reader.reset()
+        self.check_neutral()
+
+        notified = []
+        for message in self.handler.notified:
+            notified.extend(get_records(message))
+        expected = list(map(lambda r: r.decode("latin-1"), records))
+
+        if aborted:
+            self.stats["aborted"] += 1
+            unexpected = [r for r in notified if r not in expected]
+            if unexpected:
+                raise Violation("Records not sent were notified: {!r}"
+                                .format(unexpected[:3]))
+        elif notified != expected:
+            pos = 0
+            while pos < min(len(notified), len(expected)):
+                if notified[pos] != expected[pos]:
+                    break
+                pos += 1
+            raise Violation("Transfer not notified as sent. Record {}: {!r} "
+                            "(sent {!r})".format(pos, notified[pos:pos + 1],
+                                                 expected[pos:pos + 1]))
+        else:
+            self.stats["delivered"] += 1
+
+    def run_adversarial(self):
+        """Sends garbage, and checks the handler recovers afterwards
+        """
+        self.stats["adversarial"] += 1
+        self.transmit(get_garbage(self.rng, self.rng.randint(64, 4096)))
+        self.transmit(EOT)
+        self.reader.reset()
+        self.check_neutral()
+
+    def check_neutral(self):
+        handler = self.handler
+        if handler.in_transfer or handler.messages:
+            raise Violation("Handler not in neutral state after <EOT>")
+        if handler.response is not None:
+            raise Violation("Reply pending after <EOT>")
+
+    def run(self, transfers):
+        """Runs the given number of transfers. Returns the list of violations
+        """
+        violations = []
+        for num in range(transfers):
+            self.stats["transfers"] += 1
+            try:
+                if self.rng.random() < self.adversarial:
+                    self.run_adversarial()
+                else:
+                    self.run_transfer()
+            except Violation as e:
+                violations.append((num, str(e)))
+            except Exception:
+                violations.append((num, traceback.format_exc()))
+        self.stats["violations"] = len(violations)
+        return violations
+
+    def get_results(self):
+        results = dict(self.stats)
+        results.update({
+            "seed": self.seed,
+            "elapsed": round(self.elapsed, 3),
+            "bytes_per_second": int(self.elapsed and
+                                    self.stats["bytes"] / self.elapsed or 0),
+            "frames_per_second": int(self.elapsed and
+                                     self.stats["frames"] / self.elapsed or 0),
+        })
+        return results
+
+
+def main():
+    """Entry-point of the fuzzing harness of the LIS1-A receiver
+    """
+    parser = argparse.ArgumentParser(
+        description="Fuzzing and stress harness of the LIS1-A receiver",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("-n", "--transfers", type=int, default=1000,
+                        help="Number of transfers")
+    parser.add_argument("-s", "--seed", type=int,
+                        help="Seed of the random generator. Random if not set")
+    parser.add_argument("--corruption", type=float, default=0.05,
+                        help="Ratio of frames corrupted by a line fault")
+    parser.add_argument("--noise", type=float, default=0.02,
+                        help="Ratio of frames preceded by noise")
+    parser.add_argument("--adversarial", type=float, default=0.05,
+                        help="Ratio of transfers replaced by garbage")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="Verbose logging")
+    args = parser.parse_args()
+
+    logger.setLevel(args.verbose and logging.DEBUG or logging.CRITICAL)
+    logger.addHandler(logging.StreamHandler())
+
+    seed = args.seed
+    if seed is None:
+        seed = random.randint(0, 2 ** 32)
+    fuzzer = Fuzzer(seed=seed,
+                    corruption=args.corruption,
+                    noise=args.noise,
+                    adversarial=args.adversarial)
+    violations = fuzzer.run(args.transfers)
+    for num, violation in violations[:10]:
+        print("Transfer {}: {}".format(num, violation))
+    print(json.dumps(fuzzer.get_results(), sort_keys=True))
+    if violations:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -23,10 +23,25 @@ import re
 import requests
 
 from . import logger
+from .profiling import span
+from .ratelimit import RateLimiter
 
 # SENAITE.JSONAPI route
 API_BASE_URL = "@@API/senaite/v1"
 
+#: Rate limit for the requests to SENAITE, shared by all sessions
+limiter = RateLimiter()
+
+
+def get_size(payload):
+    """Returns the approximate size in bytes of the payload passed-in
+    """
+    size = 0
+    for key, value in payload.items():
+        values = isinstance(value, (list, tuple)) and value or [value]
+        size += sum(map(lambda v: len(key) + len(str(v)) + 2, values))
+    return size
+
 
 class Session(object):
 
@@ -37,6 +52,13 @@ class Session(object):
         self.password = password
 
     def auth(self):
+        """Starts a session with SENAITE. Returns whether the JSON API is
+        available and the credentials are valid
+        """
+        with span("auth", url=self.url):
+            return self._auth()
+
+    def _auth(self):
         logger.info("Starting session with SENAITE ...")
         self.session = requests.Session()
         self.session.auth = (self.username, self.password)
@@ -62,20 +84,24 @@ class Session(object):
         """Sends a POST request to SENAITE
         """
         url = self.get_url(endpoint)
+        size = get_size(payload)
+        limiter.acquire(size)
         try:
-            response = self.session.post(url, data=payload)
+            with span("post", url=url, size=size):
+                response = self.session.post(url, data=payload)
         except Exception as e:
             message = "Could not send POST to {}".format(url)
             logger.error(message)
             logger.error(e)
             return {}
 
-        return response.json()
+        return self.parse(response, url)
 
     def get(self, endpoint, timeout=60):
         """Fetch the given url or endpoint and return a parsed JSON object
         """
         url = self.get_url(endpoint)
+        limiter.acquire()
         try:
             response = self.session.get(url, timeout=timeout)
         except Exception as e:
@@ -90,7 +116,19 @@ class Session(object):
             logger.error(message)
             return {}
 
-        return response.json()
+        return self.parse(response, url)
+
+    def parse(self, response, url):
+        """Returns the parsed JSON object of the response, or an empty dict
+        if the response is not JSON (e.g. an error page from a proxy)
+        """
+        try:
+            return response.json()
+        except ValueError:
+            message = "No JSON from {} ({} {})".format(
+                url, response.status_code, response.headers.get("Content-Type"))
+            logger.error(message)
+            return {}
 
     def get_url(self, endpoint):
         """Create an API URL from an endpoint or absolute url
@@ -98,8 +136,9 @@ class Session(object):
         return "{}/{}/{}".format(self.url, API_BASE_URL, endpoint)
 
 
-def get_senaite_connection_info(url):
+def parse_senaite_url(url):
     """Returns a dict with the connection information (url, user, password)
+    from the full URL address passed-in, without connecting
     """
     def get_schema(url):
         sch = url.split("://")
@@ -115,7 +154,7 @@ def get_senaite_connection_info(url):
             raise ValueError("malformed url")
         user_pass = tokens[1].split("@") or [""]
         user_pass = map(lambda s: s.strip(), user_pass[0].split(":"))
-        user_pass = filter(None, user_pass)
+        user_pass = list(filter(None, user_pass))
         if not user_pass or len(user_pass) < 2:
             raise ValueError("missing user:password")
         elif len(user_pass) > 2:
@@ -145,6 +184,15 @@ def get_senaite_connection_info(url):
     # Get the url
     url = get_senaite_url(url)
 
+    return dict(url=url, user=user, password=password)
+
+
+def get_senaite_connection_info(url):
+    """Returns a dict with the connection information (url, user, password)
+    """
+    info = parse_senaite_url(url)
+    url, user, password = info["url"], info["user"], info["password"]
+
     # Try to connect
     logger.info("Trying connection with {} ...".format(url))
     session = Session(url, user, password)
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.SERIAL.CLI.
+#
+# SENAITE.SERIAL.CLI is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2020 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+import json
+import re
+
+import serial
+
+from . import logger
+from .charset import AUTO
+from .lis1a import ACK
+from .lis1a import ENQ
+from .lis1a import EOT
+from .lis1a import LF
+from .lis1a import NAK
+
+#: Control characters that are sent alone, without a line terminator
+CONTROL_CHARACTERS = (ENQ, EOT, ACK, NAK)
+
+#: End of a command: a control character or the <LF> that ends a frame
+COMMAND_END = re.compile(b"[" + b"".join(CONTROL_CHARACTERS) + LF + b"]")
+
+#: Built-in link profiles
+PROFILES = {
+    "default": {},
+    "fast": {
+        "baudrate": 115200,
+        "rtscts": True,
+        "inter_byte_timeout": 0.05,
+        "chunk_size": 1024,
+        "low_latency": True,
+    },
+    "xonxoff": {
+        "xonxoff": True,
+    },
+    "legacy": {
+        "baudrate": 1200,
+        "bytesize": 7,
+        "parity": "E",
+        "stopbits": 1,
+    },
+}
+
+
+class LinkProfile(object):
+    """Settings of the serial link with an instrument, including the
+    character encoding of the messages it sends
+    """
+
+    def __init__(self, name="default", baudrate=9600, bytesize=8, parity="N",
+                 stopbits=1, rtscts=False, xonxoff=False, timeout=2,
+                 write_timeout=10, inter_byte_timeout=None, chunk_size=256,
+                 low_latency=False, encoding=AUTO):
+        self.name = name
+        self.baudrate = baudrate
+        self.bytesize = bytesize
+        self.parity = parity
+        self.stopbits = stopbits
+        self.rtscts = rtscts
+        self.xonxoff = xonxoff
+        self.timeout = timeout
+        self.write_timeout = write_timeout
+        self.inter_byte_timeout = inter_byte_timeout
+        self.chunk_size = chunk_size
+        self.low_latency = low_latency
+        self.encoding = encoding
+
+    def update(self, **kwargs):
+        """Updates the profile with the settings passed-in
+        """
+        for key, value in kwargs.items():
+            if not hasattr(self, key):
+                raise ValueError("Unknown link setting: {}".format(key))
+            setattr(self, key, value)
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+    def open(self, port):
+        """Opens the serial port with the settings of this profile
+        """
+        ser = serial.Serial(port,
+                            baudrate=self.baudrate,
+                            bytesize=self.bytesize,
+                            parity=self.parity,
+                            stopbits=self.stopbits,
+                            rtscts=self.rtscts,
+                            xonxoff=self.xonxoff,
+                            timeout=self.timeout,
+                            write_timeout=self.write_timeout,
+                            inter_byte_timeout=self.inter_byte_timeout)
+        if self.low_latency:
+            self.set_low_latency(ser)
+        return ser
+
+    def set_low_latency(self, ser):
+        """Sets the low latency flag of the serial port. Only supported by
+        Linux serial drivers
+        """
+        if not hasattr(ser, "set_low_latency_mode"):
+            logger.warn("Low latency mode not supported on this platform")
+            return
+        try:
+            ser.set_low_latency_mode(True)
+        except ValueError as e:
+            logger.warn("Low latency mode not set: {}".format(e))
+
+    def __repr__(self):
+        return "<LinkProfile {} {}/{}{}{}>".format(
+            self.name, self.baudrate, self.bytesize, self.parity,
+            self.stopbits)
+
+
+def get_link_profile(name="default", path=None):
+    """Returns the link profile with the given name. The profile is searched
+    in the JSON file passed-in first (a mapping of profile names to settings)
+    and in the built-in profiles afterwards
+    """
+    profiles = dict(PROFILES)
+    if path:
+        with open(path, "r") as f:
+            profiles.update(json.load(f))
+
+    settings = profiles.get(name)
+    if settings is None:
+        raise ValueError("Link profile not found: {}".format(name))
+
+    profile = LinkProfile(name=name)
+    profile.update(**settings)
+    return profile
+
+
+class CommandReader(object):
+    """Splits the stream of bytes coming from the serial port into commands:
+    control characters sent alone (<ENQ>, <EOT>, <ACK> and <NAK>) and frames,
+    terminated by <LF>
+    """
+
+    def __init__(self):
+        self.buffer = b""
+
+    def feed(self, data):
+        """Adds the data to the buffer and returns the list of commands that
+        are complete
+        """
+        self.buffer += data
+        commands = []
+        while self.buffer:
+            match = COMMAND_END.search(self.buffer)
+            if not match:
+                break
+            end = match.start()
+            if self.buffer[end:end + 1] == LF:
+                commands.append(self.buffer[:end + 1])
+            else:
+                # Control characters are not allowed within a frame, so the
+                # bytes before belong to a frame that was cut off
+                if end > 0:
+                    logger.debug("Incomplete frame discarded: {!r}".format(
+                        self.buffer[:end]))
+                commands.append(self.buffer[end:end + 1])
+            self.buffer = self.buffer[end + 1:]
+        return commands
+
+    def reset(self):
+        self.buffer = b""
+
+
+def read(ser, chunk_size):
+    """Reads the bytes available from the serial port, up to chunk_size. Waits
+    for the first byte until the timeout of the port is reached
+    """
+    data = ser.read(1)
+    if not data:
+        return data
+    waiting = min(ser.in_waiting, chunk_size - 1)
+    if waiting > 0:
+        data += ser.read(waiting)
+    return data
@@ -18,12 +18,28 @@
 # Copyright 2020 by it's authors.
 # Some rights reserved, see README and LICENSE.
 
-import threading
+import logging
+import sys
 import time
 
-import lims
 from . import logger
+from .charset import Decoder
+from .dedup import FLAG
+from .dedup import SUPPRESS
 from .handler import MessageHandler
+from .pipeline import Parser
+from .pipeline import Pipeline
+from .pipeline import Stage
+from .pipeline import Transfer
+from .profiling import span
+from .query import is_query
+from .records import iter_chunks
+from .records import iter_split
+from .session import SPOOL_SIZE
+from .session import Spool
+from .session import budget
+from .session import pool
+from .uploader import Uploader
 
 #: Message start token.
 STX = b'\x02'
@@ -44,6 +60,20 @@ CR  = b'\x0D'
 #: CR + LF shortcut.
 CRLF = CR + LF
 
+#: Frame cut off or with missing control characters
+FRAMING_ERROR = "framing"
+#: Frame number out of range
+FN_ERROR = "fn"
+#: Frame checksum does not match
+CHECKSUM_ERROR = "checksum"
+#: Frame number not consecutive to the last frame accepted
+SEQUENCE_ERROR = "sequence"
+#: Data received that is neither a frame nor a control character expected
+NOISE_ERROR = "noise"
+#: Frame accepted already and sent again, as our reply did not reach the
+#: sender
+REPLY_ERROR = "reply"
+
 MAPPINGS = {
     STX: "<STX>",
     ETX: "<ETX>",
@@ -65,19 +95,28 @@ class Message(object):
     E 1394. Messages are sent in frames, each frame contains a maximum of 247
     characters (including frame overhead). Messages longer than 240 characters
     are divided between two or more frames.
+
+    Only the state of the message is kept here. The text of the frames is
+    written to the spool of the session, so the memory held by a message does
+    not grow with the number of frames
     """
 
-    frames = None
+    __slots__ = ("start_fn", "count", "complete", "record_type")
 
     def __init__(self, start_fn=1):
-        self.frames = []
         self.start_fn = start_fn
+        self.count = 0
+        self.complete = False
+        self.record_type = None
 
     def add_frame(self, frame):
         """Tries to add a frame into the current message
         """
         if self.can_add_frame(frame):
-            self.frames.append(frame)
+            if not self.count:
+                self.record_type = frame.text[:1]
+            self.count += 1
+            self.complete = frame.is_final
 
     def can_add_frame(self, frame):
         """A frame should be rejected because:
@@ -90,7 +129,7 @@ class Message(object):
         """
         if not frame.is_valid():
             return False
-        elif frame.fn != (len(self.frames) + self.start_fn) % 8:
+        elif frame.fn != (self.count + self.start_fn) % 8:
             logger.info("No valid frame: FN is not consecutive")
             return False
         elif self.is_complete():
@@ -101,20 +140,18 @@ class Message(object):
     def is_complete(self):
         """Returns whether the current message is complete
         """
-        if self.is_empty():
-            return False
-        return self.frames[-1].is_final
+        return self.complete
 
     def is_empty(self):
         """Returns whether this message is empty
         """
-        return not self.frames
+        return not self.count
 
-    def text(self):
-        """Text representation of the message
+    def is_terminator(self):
+        """Returns whether this message is a Message Terminator Record (L),
+        that is the last record of a LIS2-A message
         """
-        texts = map(lambda frame: frame.text, self.frames)
-        return CRLF.join(texts)
+        return self.record_type == b"L"
 
 
 class Frame(object):
@@ -122,7 +159,8 @@ class Frame(object):
     housekeeping such as error checks and acknowledgements. A frame contains a
     maximum of 247 characters (including frame overhead)
     """
-    frame = None
+
+    __slots__ = ("frame", )
 
     def __init__(self, frame):
         """
@@ -142,10 +180,13 @@ class Frame(object):
 
         Any characters occurring before the <STX> or after the end of the
         block character (the <ETB> or <ETX>) are ignored by the receiver when
-        checking the frame.
+        checking the frame. Since <STX> is not allowed within the frame, the
+        frame starts at the last <STX>, so a frame cut off by a line fault
+        does not get merged with the frame that follows
         """
+        self.frame = None
         if STX in frame:
-            self.frame = frame[frame.index(STX):]
+            self.frame = frame[frame.rindex(STX):]
 
     @property
     def fn(self):
@@ -157,7 +198,7 @@ class Frame(object):
         is incremented by one for every new frame transmitted. After 7, the
         frame number rolls over to 0, and continues in this fashion.
         """
-        return int(self.frame[1])
+        return int(self.frame[1:2])
 
     @property
     def text(self):
@@ -201,33 +242,41 @@ class Frame(object):
             received frame,
         :return:
         """
+        return self.get_error() is None
+
+    def get_error(self):
+        """Returns the kind of error of the frame (FRAMING_ERROR, FN_ERROR or
+        CHECKSUM_ERROR), or None if the frame is valid
+        """
         if not self.frame or len(self.frame) < 7:
             logger.error("No valid frame: len < 7")
-            return False
+            return FRAMING_ERROR
 
-        if self.frame[0] != STX:
+        if self.frame[:1] != STX:
             logger.error("No valid frame: STX not found")
-            return False
+            return FRAMING_ERROR
 
         if self.frame[-2:] != CRLF:
             logger.error("No valid frame: CRLF not found")
-            return False
+            return FRAMING_ERROR
 
         if not self.is_valid_fn():
-            return False
+            return FN_ERROR
 
         if all([self.is_intermediate, self.is_final]):
             # Both intermediate and final (ETB + ETX)
             logger.error("No valid frame: ETB + ETX")
-            return False
+            return FRAMING_ERROR
 
         if not any([self.is_intermediate, self.is_final]):
             # Neither intermediate nor final
             logger.error("No valid frame: ETB or ETX is missing")
-            return False
+            return FRAMING_ERROR
 
         # Leave the checksum check for later
-        return self.is_valid_checksum()
+        if not self.is_valid_checksum():
+            return CHECKSUM_ERROR
+        return None
 
     def is_valid_fn(self):
         """Returns whether the current frame number (fn) is valid or not. Frame
@@ -235,7 +284,7 @@ class Frame(object):
         """
         try:
             fn = self.fn
-        except:
+        except (IndexError, TypeError, ValueError):
             logger.error("No valid frame: FN")
             return False
         if fn < 0:
@@ -270,18 +319,18 @@ class Frame(object):
         7 followed by the character A.
         """
         end = self.is_intermediate and ETB or ETX
-        seed = map(ord, self.frame[1:self.frame.index(end) + 1])
-        return hex(sum(seed) & 0xFF)[2:].upper().zfill(2).encode()
+        seed = bytearray(self.frame[1:self.frame.index(end) + 1])
+        return "{:02X}".format(sum(seed) & 0xFF).encode("ascii")
 
     def is_valid_checksum(self):
         """Returns whether the checksum for this frame is valid or not
         """
         try:
             expected = self.calculate_checksum()
-            if expected == self.checksum_characters:
-                return True
-        except:
-            pass
+        except (TypeError, ValueError):
+            expected = None
+        if expected and expected == self.checksum_characters:
+            return True
         logger.error("No valid frame: checksum")
         return False
 
@@ -290,10 +339,131 @@ class LIS1AHandler(MessageHandler):
     """Generic receiver compliant with LIS1-A standard (formerly ASTM E1381)
     """
 
-    messages = []
-    in_transfer = False
-    last_communication = None
-    response = None
+    def __init__(self, **kwargs):
+        super(LIS1AHandler, self).__init__(**kwargs)
+        self._pool = kwargs.get("pool")
+        if self._pool is None:
+            # The pool might be empty, so it is not checked for truth
+            self._pool = pool
+        self._stream = kwargs.get("stream") or False
+        self._sender = kwargs.get("sender")
+        self._responder = kwargs.get("responder")
+        self._archive = kwargs.get("archive")
+        self._exporter = kwargs.get("exporter")
+        self._decoder = kwargs.get("decoder") or Decoder()
+        self._spool_size = kwargs.get("spool-size", SPOOL_SIZE)
+        self._monitor = kwargs.get("monitor")
+        self._pipeline = None
+        self.paused = False
+        self.response = None
+        if kwargs.get("pipeline"):
+            self._pipeline = self.get_pipeline(
+                kwargs.get("pipeline"), kwargs.get("parse-processes") or 0)
+            self._pipeline.start()
+        # Session state, taken from the pool for each transfer only
+        self.state = None
+
+    def get_pipeline(self, size, processes=0):
+        """Returns the pipeline that processes the messages received apart
+        from the thread that talks to the instrument: results are parsed
+        first, and then passed to each sink (archive, export and notification)
+        through its own bounded queue
+        """
+        funcs = []
+        if self._archive:
+            funcs.append(("archive", self.archive))
+        if self._exporter:
+            funcs.append(("export", self.export))
+        funcs.append(("notify", self.notify_transfer))
+        sinks = list(map(lambda f: Stage(f[0], self.get_sink(f[1]),
+                                         maxsize=size), funcs))
+        parse = Stage("parse", self.get_parse(Parser(processes), len(sinks)),
+                      maxsize=size, workers=max(processes, 1))
+        parse.connect(*sinks)
+        return Pipeline([parse] + sinks)
+
+    def get_parse(self, parser, sinks):
+        """Returns the first stage of the pipeline, that parses the transfer
+        and passes it to the number of sinks passed-in, each one holding it
+        until done
+        """
+        def parse(transfer):
+            try:
+                transfer = parser(transfer)
+            except Exception:
+                # Not passed to the sinks
+                transfer.release()
+                raise
+            transfer.hold(sinks - 1)
+            return transfer
+        return parse
+
+    def get_sink(self, func):
+        """Returns the sink of the pipeline that runs the function with the
+        transfer and releases it, so the spool of the transfer is closed by
+        the last sink done with it
+        """
+        def sink(transfer):
+            try:
+                return func(transfer)
+            finally:
+                transfer.release()
+        return sink
+
+    @property
+    def messages(self):
+        state = self.state
+        if state is None:
+            return []
+        return state.messages
+
+    @messages.setter
+    def messages(self, value):
+        self.state.messages = value
+
+    @property
+    def in_transfer(self):
+        state = self.state
+        return state is not None and state.in_transfer
+
+    @property
+    def last_communication(self):
+        state = self.state
+        if state is None:
+            return None
+        return state.last_communication
+
+    @last_communication.setter
+    def last_communication(self, value):
+        self.state.last_communication = value
+
+    def open(self):
+        """Takes a session state from the pool for the transfer that starts
+        """
+        if self.state is None:
+            self.state = self._pool.acquire()
+        self.state.in_transfer = True
+        self.last_communication = int(time.time())
+
+    def release(self):
+        """Gives the session state back to the pool, if in transfer. The
+        handler must not be used after this call
+        """
+        if self._pipeline:
+            # Process the messages received before leaving
+            self._pipeline.stop()
+        if self._exporter:
+            # Make the last export file available
+            self._exporter.stop()
+        self.release_state()
+
+    def release_state(self):
+        """Gives the session state back to the pool, so the line is in
+        neutral state
+        """
+        state, self.state = self.state, None
+        if state is not None:
+            self._pool.release(state)
 
     def is_timeout(self):
         """Returns whether a timeout has been reached within a transfer phase
@@ -303,43 +473,123 @@ class LIS1AHandler(MessageHandler):
         # or <EOT> is not received within 30 s, a timeout occurs. After a
         # timeout, the receiver discards the last incomplete message and regards
         # the line to be in the neutral state.
+        if self._sender and self._sender.is_timeout():
+            return True
+
         is_timeout = False
         if self.in_transfer and self.last_communication:
             is_timeout = int(time.time()) - self.last_communication >= 30
         return is_timeout
 
+    def get_spool(self):
+        """Returns the spool of the current session, where the text of the
+        frames received is written
+        """
+        if self.state.spool is None:
+            self.state.spool = Spool(self._spool_size, budget=budget)
+        return self.state.spool
+
+    def detach_spool(self):
+        """Returns the spool of the current session and starts a new one, so
+        the data received so far can be processed apart
+        """
+        spool = self.get_spool()
+        self.state.spool = None
+        return spool
+
+    def decode(self, data):
+        """Returns the data decoded to text with the encoding of the
+        instrument
+        """
+        with span("decode"):
+            return self._decoder.decode(data)
+
     def get_full_message(self):
-        """Returns the full message received
+        """Returns the full message received so far
+        """
+        spool = self.state.spool
+        return self.decode(spool and spool.read() or b"")
+
+    def get_transfer(self, messages, spool):
+        """Returns the transfer with the messages and the data passed-in.
+        Data is decoded once, unless the spool was written to disk. Spilled
+        transfers are left in the spool instead, and read from the disk line
+        by line each time they are needed, so they are never held in memory
+        as a whole
         """
-        return CRLF.join(map(lambda m: m.text(), self.messages))
+        if spool.spilled:
+            logger.info("Transfer of {} bytes spilled to disk".format(
+                spool.size))
+            return Transfer(messages, spool=spool, decoder=self._decoder)
+        text = self.decode(spool.read())
+        spool.close()
+        return Transfer(messages, text)
 
     def get_current_message(self):
         """Returns the last incomplete message or a new one
         """
         if not self.messages:
-            self.messages = [Message()]
+            self.messages = [Message(start_fn=self.state.next_fn)]
 
         if self.messages[-1].is_complete():
             last_message = self.messages[-1]
-            start_fn = last_message.start_fn + len(last_message.frames)
+            start_fn = last_message.start_fn + last_message.count
             self.messages.append(Message(start_fn=start_fn))
 
         # Pop the last message
         return self.messages.pop()
 
     def is_busy(self):
-        # TODO
-        return self.response is not None
+        if self.response is not None:
+            return True
+        if self.in_transfer:
+            return False
+        # Do not accept new transfers while paused or the pipeline is full
+        pipeline = self._pipeline
+        return self.paused or bool(pipeline and pipeline.is_full())
+
+    def is_idle(self):
+        """Returns whether the line is in neutral state, with no transfer in
+        either direction
+        """
+        if self.in_transfer:
+            return False
+        return not (self._sender and self._sender.is_active())
+
+    def get_status(self):
+        """Returns a dict with the state of the session and the number of
+        messages waiting to be processed
+        """
+        status = {
+            "paused": self.paused,
+            "in_transfer": self.in_transfer,
+            "messages": len(self.messages),
+            "last_communication": self.last_communication,
+            "queued": 0,
+            "memory": budget.used,
+        }
+        if self._sender:
+            status["sender"] = self._sender.state
+        if self._monitor is not None:
+            status["line"] = self._monitor.to_dict()
+        if self._pipeline:
+            stats = list(self._pipeline.get_stats())
+            status["pipeline"] = stats
+            status["queued"] += sum(map(lambda s: s["queued"], stats))
+            status["queued"] += self._pipeline.get_backlog()
+        return status
 
     def close(self):
         """Closes the current session and enters to neutral state
         """
-        logger.info("* Entering Neutral state{}".format(CRLF))
-        self.messages = []
-        self.last_communication = None
-        self.in_transfer = False
+        logger.info("* Entering Neutral state\r\n")
+        self.release_state()
 
     def reset(self):
+        if self._sender and self._sender.is_timeout():
+            # The host did not get a reply to the data it sent
+            self._sender.reset()
+            return
         self.close()
 
     def to_str(self, command):
@@ -349,19 +599,28 @@ class LIS1AHandler(MessageHandler):
             return "EMPTY"
 
         if len(command) > 1:
-            items = filter(None, list(command))
-            items = "".join(map(self.to_str, items))
-            return items
+            # Slices, so characters are bytes in both Python 2 and 3
+            items = map(lambda i: command[i:i + 1], range(len(command)))
+            return "".join(map(self.to_str, items))
 
         if command in MAPPINGS:
             return MAPPINGS[command]
 
+        if not isinstance(command, str):
+            # Python 3. Show the bytes as they are
+            return command.decode("latin-1")
         return command
 
     def write(self, command):
         """Writes the command to the receiver
         """
-        logger.debug("-> {}".format(self.to_str(command)))
+        if logger.isEnabledFor(logging.DEBUG):
+            # Not built unless logged, as it goes through every byte
+            logger.debug("-> {}".format(self.to_str(command)))
+
+        if self._sender and self._sender.write(command):
+            # Reply from the instrument to the data sent by the host
+            return
 
         if self.is_busy():
             # A receiver that cannot immediately receive information, replies
@@ -387,6 +646,7 @@ class LIS1AHandler(MessageHandler):
             else:
                 # No valid message
                 logger.error("No valid message. No <STX> or <EOT> received")
+                self.track(NOISE_ERROR)
                 self.response = NAK
 
         elif command == ENQ:
@@ -395,15 +655,15 @@ class LIS1AHandler(MessageHandler):
             # state, it transmits the <ENQ> transmission control character to
             # the intended receiver. Sender will ignore all responses other than
             # <ACK>, <NAK>, or <ENQ>.
-            logger.info("{}* Establishment Phase completed".format(CRLF))
+            logger.info("\r\n* Establishment Phase completed")
             logger.info("* Transfer Phase started ...")
-            self.last_communication = int(time.time())
-            self.in_transfer = True
+            self.open()
             self.response = ACK
 
         else:
             # Establishment phase not yet initiated
             logger.error("Establishment phase not initiated")
+            self.track(NOISE_ERROR)
             self.response = NAK
 
     def write_frame(self, frame_string):
@@ -431,35 +691,225 @@ class LIS1AHandler(MessageHandler):
             return NAK
 
         # Not successfully received or wrong. Reply <NAK>
-        frame = Frame(frame_string)
-        if not frame.is_valid():
-            logger.error("Not a valid frame: {}".format(frame_string))
+        with span("parse"):
+            frame = Frame(frame_string)
+        with span("validate"):
+            error = frame.get_error()
+        if error:
+            logger.error("Not a valid frame: {}".format(
+                self.to_str(frame_string)))
+            self.track(error)
             return NAK
 
         logger.info("Frame {} received".format(frame.fn))
 
+        # Is this a retransmission of the last frame accepted?
+        if self.is_retransmission(frame):
+            # Our reply to the last frame got lost or arrived late. The frame
+            # is accepted (so the sender moves forward), but ignored
+            logger.info("Frame {} already accepted, ignored".format(frame.fn))
+            self.track(REPLY_ERROR)
+            return ACK
+
         # Get the message to work with (last if incomplete, or a new one)
         message = self.get_current_message()
 
         # Does this frame can be added to the message?
         if not message.can_add_frame(frame):
             logger.error("Cannot add frame to message")
+            if not message.is_empty():
+                # Keep the message, the sender will retransmit the frame
+                self.messages.append(message)
+            self.track(SEQUENCE_ERROR)
             return NAK
 
-        # Add the frame to the message
+        if self._stream and message.is_empty():
+            # First frame of a record. The order before might be complete
+            self.stream_order(frame)
+
+        # Add the frame to the message. Text of consecutive messages is
+        # separated by <CR><LF>
         message.add_frame(frame)
+        self.state.last_frame = frame
+        spool = self.get_spool()
+        if message.count == 1 and spool.size:
+            spool.write(CRLF)
+        spool.write(frame.text)
 
         # Add the message for the current transfer phase
         self.messages.append(message)
+        self.track()
+
+        if self._stream:
+            self.keep_record(message, frame)
+
+        if self._stream and message.is_complete() and message.is_terminator():
+            # Stream mode. Notify as soon as the message is complete, but not
+            # before the last frame of a Terminator record sent in several
+            self.flush()
 
         # Response ACK
         return ACK
 
+    def is_retransmission(self, frame):
+        """Returns whether the frame is a retransmission of the last frame
+        accepted: same frame number and same content. The frame number of a
+        retransmitted frame is the same as the last accepted frame, while the
+        frame number of a new frame is one number higher (modulo 8)
+        """
+        last_frame = self.state.last_frame
+        if not last_frame:
+            return False
+        if frame.fn != last_frame.fn:
+            return False
+        if frame.frame != last_frame.frame:
+            logger.error("Frame {} does not match the frame accepted with "
+                         "the same frame number".format(frame.fn))
+            return False
+        return True
+
+    def track(self, error=None):
+        """Reports the outcome of the last command received (the kind of
+        error, if any) to the line monitor
+        """
+        if self._monitor is not None:
+            self._monitor.add_frame(error)
+
+    def keep_record(self, message, frame):
+        """Stream mode. Keeps the Header and Patient records of the order
+        being received, so they can be sent again with each order
+        """
+        state = self.state
+        if message.record_type == b"H":
+            if message.count == 1:
+                state.header = b""
+                state.patient = None
+                state.order = False
+            state.header += frame.text
+        elif message.record_type == b"P":
+            if message.count == 1:
+                state.patient = b""
+            state.patient += frame.text
+        elif message.record_type == b"O":
+            state.order = True
+
+    def stream_order(self, frame):
+        """Stream mode. Notifies the order received so far, with its results
+        and comments, as soon as the next Patient or Order record starts, so
+        a message with many orders is pushed order by order instead of at the
+        Terminator record. Each order is notified as a message on its own,
+        with the Header and Patient records it belongs to
+        """
+        state = self.state
+        record_type = frame.text[:1]
+        if record_type not in (b"P", b"O") or not state.order:
+            return
+        header = state.header or b""
+        delimiter = header[1:2] or b"|"
+        spool = self.get_spool()
+        spool.write(CRLF)
+        spool.write(delimiter.join([b"L", b"1", b"N"]) + CR)
+        self.flush()
+
+        # The next order starts with the same Header and Patient records
+        state.order = False
+        spool = self.get_spool()
+        if header:
+            spool.write(header)
+        if record_type == b"O" and state.patient:
+            spool.write(CRLF)
+            spool.write(state.patient)
+
+    def flush(self):
+        """Notifies the messages received so far and releases them, keeping
+        track of the frame number the next message has to start with
+        """
+        messages = self.messages
+        last_message = messages[-1]
+        self.state.next_fn = last_message.start_fn + last_message.count
+        self.state.notified += 1
+        self.messages = []
+        self.dispatch(messages, self.detach_spool())
+
+    def dispatch(self, messages, spool):
+        """Archives the messages, then answers them if they are a query, or
+        exports and notifies them otherwise. Messages are decoded once, and
+        the text is shared by all the steps
+        """
+        transfer = self.get_transfer(messages, spool)
+        if self._pipeline:
+            self.dispatch_pipeline(transfer)
+            return
+        try:
+            if self._archive:
+                self.archive(transfer)
+            if self.answer(transfer.get_message()):
+                return
+            if self._exporter:
+                self.export(transfer)
+            self.notify_transfer(transfer)
+        finally:
+            transfer.release()
+
+    def dispatch_pipeline(self, transfer):
+        """Answers the transfer if it is a query, or passes it to the
+        pipeline otherwise. Only queries are handled in this thread, as the
+        reply must be sent before the line is released. The pipeline never
+        holds this thread up: when full, the transfer waits with its data in
+        the spool and new transfers are refused until there is room
+        """
+        if self.answer(transfer.get_message()):
+            if self._archive:
+                self.archive(transfer)
+            transfer.release()
+            return
+        self._pipeline.put(transfer)
+
+    def archive(self, transfer):
+        """Pipeline sink that adds the transfer to the archive
+        """
+        with span("archive"):
+            self._archive.add(transfer.get_message(),
+                              timestamp=transfer.received)
+        return None
+
+    def export(self, transfer):
+        """Pipeline sink that writes the results of the transfer to the
+        export files
+        """
+        with span("export"):
+            self._exporter.write(transfer.get_message(),
+                                 results=transfer.results)
+        return None
+
+    def notify_transfer(self, transfer):
+        """Pipeline sink that notifies the messages of the transfer
+        """
+        with span("notify", messages=len(transfer.messages)):
+            self.notify(transfer.get_message())
+        return None
+
+    def answer(self, message):
+        """Queues the reply to the queries (Q records) from the full message,
+        so it is sent as soon as the line is in neutral state. Returns whether
+        the message was a query
+        """
+        if not all([self._sender, self._responder]):
+            return False
+        if not is_query(message):
+            return False
+        self._sender.send(self._responder.get_reply(message))
+        return True
+
     def write_eot(self):
         """Handles an End Of Transmission message
         """
         message = self.messages and self.messages[-1] or None
-        if not message:
+        if not message and self.state.notified:
+            # All messages were already notified while streaming
+            logger.info("* Transfer Phase completed")
+
+        elif not message:
             # Transmission without message
             logger.warn("No message transmitted")
 
@@ -470,22 +920,36 @@ class LIS1AHandler(MessageHandler):
         else:
             # Message complete, notify
             logger.info("* Transfer Phase completed")
-            self.notify()
+            self.dispatch(self.messages, self.detach_spool())
 
         # Close transmission session
         self.close()
 
         return ACK
 
-    def notify(self):
-        """Prints the whole message in stdout
+    def notify(self, message):
+        """Prints the whole message in stdout. The message is either a text,
+        or an iterable of text chunks for transfers spilled to disk
         """
         print("-" * 80)
-        print(self.get_full_message())
+        for chunk in iter_chunks(message):
+            if not isinstance(chunk, str):
+                # Python 2. Print the text as UTF-8, whatever the locale
+                chunk = chunk.encode("utf-8")
+            sys.stdout.write(chunk)
+        print("")
         print("-" * 80)
 
     def read(self):
-        if self.response:
+        if not self.response and self._sender and not self.in_transfer:
+            # Nothing to reply. Send the data pending, if any
+            self.response = self._sender.read()
+            idle = not self.response and not self._sender.is_active()
+            if idle and not self.paused:
+                # Start a new session, unless paused
+                self.response = self._sender.start()
+
+        if self.response and logger.isEnabledFor(logging.DEBUG):
             logger.debug("<- {}".format(self.to_str(self.response)))
         resp = self.response
         self.response = None
@@ -504,54 +968,111 @@ class LIS1AToSenaiteHandler(LIS1AHandler):
         self._retries = kwargs and kwargs.get("retries") or 5
         self._delay = kwargs and kwargs.get("delay") or 10
         self._dry_run = kwargs and kwargs.get("dry-run") or False
-
-    def notify(self):
-        super(LIS1AToSenaiteHandler, self).notify()
+        self._index = kwargs.get("dedup")
+        self._dedup_mode = kwargs and kwargs.get("dedup-mode") or SUPPRESS
+        self._split = kwargs and kwargs.get("split") or False
+        self._samples = kwargs.get("samples")
+        self._worklist = kwargs.get("worklist")
+        self._uploader = kwargs.get("uploader")
+        if self._uploader is None:
+            self._uploader = Uploader(url, user, password,
+                                      retries=self._retries,
+                                      delay=self._delay,
+                                      workers=kwargs.get("workers") or 4,
+                                      index=self._index,
+                                      adaptive=kwargs.get("adaptive"),
+                                      samples=self._samples)
+            self._uploader.start()
+
+    def get_status(self):
+        status = super(LIS1AToSenaiteHandler, self).get_status()
+        status["uploader"] = dict(getattr(self._uploader, "stats", {}))
+        status["uploader"]["queued"] = self._uploader.qsize()
+        concurrency = getattr(self._uploader, "concurrency", None)
+        if concurrency is not None:
+            status["uploader"]["concurrency"] = concurrency.to_dict()
+        status["queued"] += self._uploader.qsize()
+        if self._samples is not None:
+            status["samples"] = self._samples.to_dict()
+        return status
+
+    def configure(self, **kwargs):
+        """Changes the settings of the push to SENAITE: url, user, password,
+        retries and delay. The local copies of the samples and the worklist
+        follow the URL
+        """
+        self._retries = kwargs.get("retries", self._retries)
+        self._delay = kwargs.get("delay", self._delay)
+        if kwargs.get("url"):
+            self._url = kwargs["url"]
+            self._user = kwargs.get("user")
+            self._password = kwargs.get("password")
+            for cache in (self._samples, self._worklist):
+                if cache is not None:
+                    cache.configure(self._url, self._user, self._password)
+        self._uploader.configure(**kwargs)
+
+    def release(self):
+        if self._pipeline:
+            # Notify the messages received before leaving
+            self._pipeline.stop()
+        # Push the messages queued before leaving
+        self._uploader.stop()
+        super(LIS1AToSenaiteHandler, self).release()
+
+    def notify(self, message):
+        super(LIS1AToSenaiteHandler, self).notify(message)
 
         if self._dry_run:
             # Dry Run. Do not notify SENAITE LIMS
             return
 
-        if self.messages:
-            # Notify SENAITE LIMS
-            thread = threading.Thread(target=self.notify_senaite,
-                                      args=(self.messages,))
-            thread.start()
-
-    def notify_senaite(self, messages):
-        # Number of retries and delay in seconds between retries
-        retries = self._retries >= 0 and self._retries + 1 or 4
-        delay = self._delay > 0 and self._delay or 5
-
-        # Build the POST payload
-        payload = {
-            "consumer": "senaite.lis2a.import",
-            "messages": messages,
-        }
+        if not message:
+            return
 
-        # Try to push messages to SENAITE
-        success = False
-        while retries > 0:
+        if not self._split:
+            self.push(message)
+            return
 
-            # Open a session with SENAITE and authenticate
-            session = lims.Session(self._url, self._user, self._password)
-            authenticated = session.auth()
-            if authenticated:
+        # Push each sample on its own, so they are pushed concurrently by
+        # the workers and a failing sample does not hold the others back
+        units = 0
+        for unit in iter_split(message):
+            self.push(unit)
+            units += 1
+        if units > 1:
+            logger.info("Message split in {} samples".format(units))
+
+    def push(self, message):
+        """Queues the message for push to SENAITE, unless it is a duplicate
+        or its samples do not accept results
+        """
+        if not self.validate(message):
+            return
 
-                # Send the message
-                response = session.post("push", payload)
-                success = response.get("success")
-                if success:
-                    break
+        # Check whether the same content was pushed recently
+        digest = None
+        duplicate = False
+        if self._index is not None:
+            digest = self._index.claim(message)
+            duplicate = digest is None
 
-            # Sleep before we retry
-            time.sleep(delay)
-            retries -= 1
+        if duplicate and self._dedup_mode != FLAG:
+            logger.warn("Duplicate message, already pushed. Skipping")
+            return
 
-            if retries > 0:
-                logger.warn("Could not push. Retrying {}/{}".format(
-                    self._retries - retries + 1, self._retries
-                ))
+        elif duplicate:
+            logger.warn("Duplicate message, already pushed. Flagged")
 
-        if not success:
-            logger.error("Could not push the message")
+        # Notify SENAITE LIMS
+        self._uploader.put(message, digest=digest, duplicate=duplicate)
+
+    def validate(self, message):
+        """Returns whether the message has to be pushed. Messages whose
+        samples are all closed or unknown to the local copy are parked. The
+        samples not in the local copy are checked by the uploader, so the
+        serial line never waits for SENAITE
+        """
+        if self._samples is None:
+            return True
+        return self._samples.validate(message, lookup=False)
@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.SERIAL.CLI.
+#
+# SENAITE.SERIAL.CLI is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2020 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+import multiprocessing
+import threading
+import time
+from collections import deque
+
+try:
+    from Queue import Full
+    from Queue import Queue
+except ImportError:
+    from queue import Full
+    from queue import Queue
+
+from . import logger
+from .records import get_results
+
+#: Sentinel that tells the workers of a stage to stop
+STOP = object()
+
+
+class Transfer(object):
+    """Messages received within a transfer, as they move through the stages
+    of the pipeline. The text is either kept in memory, or left in the spool
+    when spilled to disk. Iterating over the transfer yields its text chunk
+    by chunk, decoded from the spool line by line, so a spilled transfer is
+    never held in memory as a whole. The spool is closed once released by
+    all its holders: the one that created the transfer, and each one that
+    called hold afterwards
+    """
+
+    __slots__ = ("messages", "spool", "decoder", "results", "received",
+                 "_text", "_holders", "_lock")
+
+    def __init__(self, messages, text=None, spool=None, decoder=None):
+        self.messages = messages
+        self.spool = spool
+        self.decoder = decoder
+        self.results = None
+        self.received = time.time()
+        self._text = text
+        self._holders = 1
+        self._lock = threading.Lock()
+
+    def __iter__(self):
+        if self.spool is None:
+            if self._text:
+                yield self._text
+            return
+        for text in self.decoder.iter_decode(self.spool.iter_lines()):
+            yield text
+
+    @property
+    def spilled(self):
+        return self.spool is not None
+
+    def hold(self, count=1):
+        """Keeps the spool open until released by count more holders
+        """
+        with self._lock:
+            self._holders += count
+
+    def release(self):
+        """Releases the transfer. The spool is closed by the last holder
+        """
+        with self._lock:
+            self._holders -= 1
+            last = self._holders == 0
+        if last and self.spool is not None:
+            self.spool.close()
+
+    def get_message(self):
+        """Returns the message to pass to the sinks: the text, or the transfer
+        itself (an iterable of text chunks) when spilled to disk. The
+        functions that read records accept both
+        """
+        if self.spool is None:
+            return self._text
+        return self
+
+
+class Stage(object):
+    """Step of the pipeline. Items put in the bounded queue of the stage are
+    processed by its workers, and the value returned by the function, if not
+    None, is passed to the connected stages. Putting an item in a full stage
+    blocks until there is room, so a slow stage slows down the stages before
+    it instead of piling up items in memory
+    """
+
+    def __init__(self, name, func, maxsize=100, workers=1):
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.queue = Queue(maxsize)
+        self.outputs = []
+        self.stats = {
+            "processed": 0,
+            "errors": 0,
+            "busy": 0.0,
+        }
+        self._lock = threading.Lock()
+        self._threads = []
+        self._started = None
+
+    def connect(self, *stages):
+        """Connects the stages passed-in to the output of this one
+        """
+        self.outputs.extend(stages)
+        return self
+
+    def put(self, item, block=True):
+        self.queue.put(item, block)
+
+    def is_full(self):
+        return self.queue.full()
+
+    def start(self):
+        self._started = time.time()
+        for num in range(self.workers):
+            name = "{}-{}".format(self.name, num + 1)
+            thread = threading.Thread(target=self.run, name=name)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """Processes the items queued and stops the workers
+        """
+        for thread in self._threads:
+            self.queue.put(STOP)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is STOP:
+                break
+            start = time.time()
+            error = False
+            try:
+                result = self.func(item)
+            except Exception as e:
+                logger.error("Stage '{}' failed: {}".format(self.name, e))
+                result = None
+                error = True
+            with self._lock:
+                self.stats["processed"] += 1
+                self.stats["errors"] += error and 1 or 0
+                self.stats["busy"] += time.time() - start
+            if result is None:
+                continue
+            for stage in self.outputs:
+                stage.put(result)
+
+    def get_stats(self):
+        """Returns the stats of the stage: items processed and failed, items
+        queued, throughput (items per second) and utilization of the workers
+        """
+        with self._lock:
+            stats = dict(self.stats)
+        elapsed = self._started and time.time() - self._started or 0
+        stats.update({
+            "stage": self.name,
+            "queued": self.queue.qsize(),
+            "throughput": elapsed and stats["processed"] / elapsed or 0,
+            "utilization": elapsed and stats["busy"] / (
+                elapsed * self.workers) or 0,
+        })
+        return stats
+
+
+class Pipeline(object):
+    """Chain of stages. Items are put in the first stage, and the stages are
+    stopped in order, so all items are processed before leaving. Putting an
+    item never waits: when the first stage is full, the item waits in the
+    backlog until there is room, and the pipeline is full meanwhile
+    """
+
+    def __init__(self, stages, interval=60):
+        self.stages = stages
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._backlog = deque()
+        self._condition = threading.Condition()
+        self._feeder = None
+
+    def put(self, item):
+        """Puts the item in the first stage, or in the backlog if the stage
+        is full. Returns whether the item went straight to the stage
+        """
+        with self._condition:
+            if not self._backlog:
+                try:
+                    self.stages[0].put(item, block=False)
+                    return True
+                except Full:
+                    pass
+            self._backlog.append(item)
+            self._condition.notify()
+        logger.warn("Pipeline is full, {} items waiting".format(
+            self.get_backlog()))
+        return False
+
+    def is_full(self):
+        return bool(self._backlog) or self.stages[0].is_full()
+
+    def get_backlog(self):
+        """Returns the number of items waiting for room in the first stage
+        """
+        return len(self._backlog)
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+        self._feeder = threading.Thread(target=self.feed)
+        self._feeder.daemon = True
+        self._feeder.start()
+        thread = threading.Thread(target=self.run)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        if self._stopped.is_set():
+            return
+        with self._condition:
+            self._stopped.set()
+            self._condition.notify()
+        if self._feeder:
+            # Items in the backlog are processed too
+            self._feeder.join()
+        for stage in self.stages:
+            stage.stop()
+        self.log_stats()
+
+    def feed(self):
+        """Moves the items of the backlog to the first stage, in order, as
+        soon as there is room
+        """
+        while True:
+            with self._condition:
+                while not self._backlog and not self._stopped.is_set():
+                    self._condition.wait()
+                if not self._backlog:
+                    break
+                item = self._backlog[0]
+            self.stages[0].put(item)
+            with self._condition:
+                self._backlog.popleft()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self.log_stats()
+
+    def get_stats(self):
+        return map(lambda stage: stage.get_stats(), self.stages)
+
+    def log_stats(self):
+        for stats in self.get_stats():
+            logger.info(
+                "Stage {stage}: {processed} processed ({throughput:.2f}/s), "
+                "{errors} errors, {queued} queued, {utilization:.0%} "
+                "busy".format(**stats))
+
+
+class Parser(object):
+    """Parses the results of the transfers. Parsing is done in a pool of
+    processes when set, so it can use several cores
+    """
+
+    def __init__(self, processes=0):
+        self._pool = None
+        if processes:
+            self._pool = multiprocessing.Pool(processes)
+
+    def __call__(self, transfer):
+        if self._pool and not transfer.spilled:
+            transfer.results = self._pool.apply(get_results,
+                                                (transfer.get_message(),))
+        else:
+            # Transfers spilled to disk are parsed as they are read
+            transfer.results = get_results(transfer.get_message())
+        return transfer
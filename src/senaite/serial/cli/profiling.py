@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.SERIAL.CLI.
+#
+# SENAITE.SERIAL.CLI is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2020 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+import cProfile
+import json
+import signal
+import threading
+import time
+
+from . import logger
+
+
+class Span(object):
+    """Measures the time spent in a block of code and records it in the
+    tracer on exit
+    """
+
+    __slots__ = ("tracer", "name", "attrs", "start")
+
+    def __init__(self, tracer, name, attrs):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        duration = time.time() - self.start
+        if exc_type:
+            self.attrs["error"] = exc_type.__name__
+        self.tracer.record(self.name, self.start, duration, **self.attrs)
+
+
+class NullSpan(object):
+    """Span that does nothing, used when tracing is disabled
+    """
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class Tracer(object):
+    """Writes the spans of the processing stages (read, frame parse,
+    validation, reply, notification, authentication and POST) to a trace
+    file, one JSON object per line. Disabled unless a path is set
+    """
+
+    def __init__(self, path=None):
+        self._file = None
+        self._lock = threading.Lock()
+        if path:
+            self.open(path)
+
+    def open(self, path):
+        self._file = open(path, "a")
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+    @property
+    def enabled(self):
+        return self._file is not None
+
+    def span(self, name, **attrs):
+        """Returns a context manager that records the time spent within
+        """
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, attrs)
+
+    def record(self, name, start, duration, **attrs):
+        """Writes a span to the trace file
+        """
+        if not self.enabled:
+            return
+        attrs.update({
+            "span": name,
+            "start": round(start, 6),
+            "duration": round(duration, 6),
+            "thread": threading.current_thread().name,
+        })
+        line = json.dumps(attrs, sort_keys=True)
+        with self._lock:
+            if self._file:
+                self._file.write(line + "\n")
+                self._file.flush()
+
+
+#: Tracer shared by the whole process
+tracer = Tracer()
+
+
+def span(name, **attrs):
+    """Returns a span of the process tracer
+    """
+    return tracer.span(name, **attrs)
+
+
+def run_profiled(path, func, *args, **kwargs):
+    """Runs the function within the profiler and dumps the stats to the path
+    on exit. Stats are also dumped on SIGUSR1 (where available), without
+    stopping the profiler. Only the calling thread is profiled
+    """
+    profiler = cProfile.Profile()
+
+    def dump(signum=None, frame=None):
+        profiler.dump_stats(path)
+        logger.info("Profile stats written to {}".format(path))
+        if signum is not None:
+            # dump_stats disables the profiler
+            profiler.enable()
+
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, dump)
+
+    profiler.enable()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        profiler.disable()
+        dump()
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.SERIAL.CLI.
+#
+# SENAITE.SERIAL.CLI is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2020 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+import argparse
+import json
+import logging
+import time
+
+from . import lims
+from . import logger
+from .fakelims import FakeSenaiteServer
+from .uploader import Uploader
+
+#: Message pushed, with placeholders for the sample id and priority
+MESSAGE = "\r\n".join([
+    "H|\\^&|||Bench^SENAITE||||||||1|20200101000000",
+    "P|1",
+    "O|1|{sample_id}||^^^ALL|{priority}|20200101000000|||||A||||||||||||||F",
+    "R|1|^^^Cu|61|mg/L||N||F||||20200101000000|Bench",
+    "L|1|N",
+])
+
+#: Priorities of the messages, in turns
+PRIORITIES = "RRRRRRRRAS"
+
+
+def get_message(num):
+    """Returns the message to push with the given number
+    """
+    return MESSAGE.format(sample_id="B-{:06d}".format(num),
+                          priority=PRIORITIES[num % len(PRIORITIES)])
+
+
+def run(url, user, password, messages=1000, workers=4, retries=3, delay=0.1,
+        adaptive=False):
+    """Pushes the given number of messages to SENAITE and returns a dict with
+    the results: duration, throughput, retries and failures
+    """
+    uploader = Uploader(url, user, password, retries=retries, delay=delay,
+                        workers=workers, adaptive=adaptive)
+    for num in range(messages):
+        uploader.put(get_message(num))
+
+    start = time.time()
+    uploader.start()
+    uploader.stop()
+    uploader.join()
+    duration = time.time() - start
+
+    results = dict(uploader.stats)
+    results.update({
+        "messages": messages,
+        "workers": workers,
+        "duration": round(duration, 3),
+        "throughput": round(results["pushed"] / duration, 2),
+    })
+    if uploader.concurrency is not None:
+        results["concurrency"] = uploader.concurrency.to_dict()
+    return results
+
+
+def main():
+    """Entry-point of the push throughput benchmark. Pushes messages to a
+    fake SENAITE started in-process, unless an url is given
+    """
+    parser = argparse.ArgumentParser(
+        description="Push throughput benchmark",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("-u", "--url", type=str,
+                        help="SENAITE full URL address, with username and "
+                             "password. A fake SENAITE is started if not set")
+    parser.add_argument("-n", "--messages", type=int, default=1000,
+                        help="Number of messages to push")
+    parser.add_argument("-w", "--workers", type=str, default="4",
+                        help="Number of messages pushed at the same time. "
+                             "Several values separated by comma are allowed")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="Adapt the number of messages pushed at the "
+                             "same time, up to the number of workers")
+    parser.add_argument("-r", "--retries", type=int, default=3,
+                        help="Number of retries of each push")
+    parser.add_argument("-d", "--delay", type=float, default=0.1,
+                        help="Time delay in seconds between retries")
+    parser.add_argument("--latency", type=float, default=0.01,
+                        help="Latency of the fake SENAITE")
+    parser.add_argument("--jitter", type=float, default=0,
+                        help="Jitter of the latency of the fake SENAITE")
+    parser.add_argument("--error-rate", type=float, default=0,
+                        help="Error rate of the fake SENAITE")
+    parser.add_argument("--auth-failure-rate", type=float, default=0,
+                        help="Authentication failure rate of the fake "
+                             "SENAITE")
+    parser.add_argument("--capacity", type=int, default=0,
+                        help="Requests served at the same time by the fake "
+                             "SENAITE without delay")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="Verbose logging")
+    args = parser.parse_args()
+
+    logger.setLevel(args.verbose and logging.DEBUG or logging.ERROR)
+    logger.addHandler(logging.StreamHandler())
+
+    server = None
+    if args.url:
+        info = lims.get_senaite_connection_info(args.url)
+        url, user, password = info["url"], info["user"], info["password"]
+    else:
+        server = FakeSenaiteServer(("localhost", 0),
+                                   latency=args.latency,
+                                   jitter=args.jitter,
+                                   error_rate=args.error_rate,
+                                   auth_failure_rate=args.auth_failure_rate,
+                                   capacity=args.capacity)
+        server.start()
+        url, user, password = server.url, server.user, server.password
+
+    workers = map(int, args.workers.split(","))
+    for num in workers:
+        results = run(url, user, password,
+                      messages=args.messages,
+                      workers=num,
+                      retries=args.retries,
+                      delay=args.delay,
+                      adaptive=args.adaptive)
+        if server:
+            results["max_concurrency"] = server.stats["max_concurrency"]
+            server.stats["max_concurrency"] = 0
+        print(json.dumps(results, sort_keys=True))
+
+    if server:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.SERIAL.CLI.
+#
+# SENAITE.SERIAL.CLI is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2020 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+import collections
+import json
+import threading
+import time
+
+import serial
+
+from . import logger
+from .lis1a import FRAMING_ERROR
+from .lis1a import NOISE_ERROR
+from .lis1a import REPLY_ERROR
+
+#: The errors are reported and a link profile change is suggested
+SUGGEST = "suggest"
+#: The link profile change suggested is applied to the port, and reverted if
+#: the line does not improve
+APPLY = "apply"
+#: Errors are counted, but neither reported nor acted upon
+OFF = "off"
+
+MODES = (SUGGEST, APPLY, OFF)
+
+#: Number of frames the error rate is computed from
+WINDOW = 200
+
+#: Minimum number of frames received to judge the quality of the line
+MIN_FRAMES = 50
+
+#: Ratio of frames with errors beyond which the line is degraded
+ERROR_THRESHOLD = 0.05
+
+#: Average time in seconds from a frame received to the reply sent beyond
+#: which replies are slow. Senders wait for the reply up to 15 seconds
+TURNAROUND_THRESHOLD = 5
+
+#: Time in seconds between alerts of the same kind
+ALERT_INTERVAL = 300
+
+#: Time in seconds a link profile change applied is given to prove itself.
+#: A change at our end alone can stop the traffic, so the change is reverted
+#: if less than MIN_FRAMES frames are received by then
+TRIAL_TIMEOUT = 900
+
+#: Standard baud rates, from lowest to highest
+BAUDRATES = (1200, 2400, 4800, 9600, 19200, 38400, 57600, 115200)
+
+#: Errors caused by bytes lost in the line, that flow control prevents
+LOSS_ERRORS = (FRAMING_ERROR, NOISE_ERROR)
+
+
+class LineMonitor(object):
+    """Quality of the serial line of a port: rolling error rate of the frames
+    received, by kind of error, retransmissions and turnaround of the replies.
+    When the line degrades, an alert is logged and a change of the link
+    profile is suggested: hardware flow control when bytes get lost, a lower
+    baud rate otherwise. When set to apply, the change is applied to the port
+    as soon as the line is in neutral state, and reverted if the line does
+    not improve, or if the traffic stops
+    """
+
+    def __init__(self, port, profile, mode=SUGGEST,
+                 threshold=ERROR_THRESHOLD, window=WINDOW,
+                 trial_timeout=TRIAL_TIMEOUT):
+        self.port = port
+        self.profile = profile
+        self.mode = mode
+        self.threshold = threshold
+        self.trial_timeout = trial_timeout
+        self.suggestion = None
+        self._outcomes = collections.deque(maxlen=window)
+        self._turnarounds = collections.deque(maxlen=window)
+        # Running totals of the window, so they are not summed per frame
+        self._errors = 0
+        self._turnaround = 0.0
+        self._nak = False
+        self._pending = None
+        self._reverting = False
+        self._trial = None
+        self._tried = []
+        self._alerts = {}
+        self._lock = threading.Lock()
+        self.stats = {
+            "frames": 0,
+            "errors": 0,
+            "retransmissions": 0,
+            "alerts": 0,
+            "changes": 0,
+        }
+
+    def add_frame(self, error=None):
+        """Adds the outcome of a frame (or data) received: the kind of error,
+        or None if the frame was accepted
+        """
+        with self._lock:
+            if self._nak:
+                # Sent again after our <NAK>
+                self.stats["retransmissions"] += 1
+            self._nak = error is not None and error != REPLY_ERROR
+            self.stats["frames"] += 1
+            if error:
+                self.stats["errors"] += 1
+            if len(self._outcomes) == self._outcomes.maxlen:
+                self._errors -= self._outcomes[0] is not None
+            self._errors += error is not None
+            self._outcomes.append(error)
+        if self.mode != OFF:
+            self.evaluate()
+
+    def add_turnaround(self, elapsed):
+        """Adds the time in seconds from a frame received to the reply sent
+        """
+        with self._lock:
+            if len(self._turnarounds) == self._turnarounds.maxlen:
+                self._turnaround -= self._turnarounds[0]
+            self._turnaround += elapsed
+            self._turnarounds.append(elapsed)
+            if self.mode == OFF or len(self._turnarounds) < MIN_FRAMES:
+                return
+            turnaround = self.get_turnaround()
+            if turnaround < TURNAROUND_THRESHOLD:
+                return
+            if self.can_alert("turnaround"):
+                logger.warn("Slow replies on {}: {:.1f}s on average. Senders "
+                            "time out after 15s".format(self.port,
+                                                        turnaround))
+
+    def get_turnaround(self):
+        """Returns the average turnaround of the replies within the window
+        """
+        if not self._turnarounds:
+            return 0
+        return self._turnaround / len(self._turnarounds)
+
+    def get_error_rate(self):
+        """Returns the ratio of frames with errors within the window
+        """
+        if not self._outcomes:
+            return 0
+        return float(self._errors) / len(self._outcomes)
+
+    def get_errors(self):
+        """Returns the number of errors of each kind within the window
+        """
+        return dict(collections.Counter(filter(None, self._outcomes)))
+
+    def can_alert(self, kind):
+        """Returns whether an alert of the given kind can be raised, at most
+        one per alert interval
+        """
+        now = time.time()
+        if now - self._alerts.get(kind, 0) < ALERT_INTERVAL:
+            return False
+        self._alerts[kind] = now
+        self.stats["alerts"] += 1
+        return True
+
+    def evaluate(self):
+        """Judges the quality of the line from the frames within the window
+        """
+        with self._lock:
+            if len(self._outcomes) < MIN_FRAMES or self._pending:
+                return
+            rate = self.get_error_rate()
+            if self._trial is not None:
+                if len(self._outcomes) == self._outcomes.maxlen:
+                    # Judged on a full window, as errors come in bursts
+                    self.judge(rate)
+                return
+            if rate < self.threshold or not self.can_alert("errors"):
+                return
+            errors = self.get_errors()
+            logger.warn("Line quality of {} degraded: {:.0%} of the last {} "
+                        "frames with errors ({})".format(
+                            self.port, rate, len(self._outcomes),
+                            ", ".join(map(lambda e: "{} {}".format(*e),
+                                          sorted(errors.items())))))
+            self.suggestion = self.get_suggestion(errors)
+            if not self.suggestion:
+                logger.warn("No link profile change left to suggest. Check "
+                            "the cabling and the grounding of the line")
+            elif self.mode == APPLY:
+                logger.warn("Link profile change to apply: {}".format(
+                    json.dumps(self.suggestion)))
+                self._pending = (self.suggestion, rate)
+            else:
+                logger.warn("Suggested link profile change: {}. Set it at "
+                            "both ends of the line".format(
+                                json.dumps(self.suggestion)))
+
+    def judge(self, rate):
+        """Keeps the change applied if the line improved (errors below the
+        threshold or halved at least), or reverts it
+        """
+        previous, rate_before = self._trial[:2]
+        self._trial = None
+        if rate < self.threshold or rate <= rate_before / 2:
+            logger.info("Line quality of {} improved: {:.0%} of frames with "
+                        "errors, {:.0%} before".format(self.port, rate,
+                                                       rate_before))
+            return
+        logger.warn("Line quality of {} did not improve: {:.0%} of frames "
+                    "with errors, {:.0%} before. Reverting to {}".format(
+                        self.port, rate, rate_before, json.dumps(previous)))
+        self._pending = (previous, rate)
+        self._reverting = True
+
+    def get_suggestion(self, errors):
+        """Returns the settings of the link profile to change, or None if
+        there is nothing left to try
+        """
+        profile = self.profile
+        candidates = []
+        lost = sum(map(lambda kind: errors.get(kind, 0), LOSS_ERRORS))
+        if not profile.rtscts and not profile.xonxoff:
+            if lost * 2 >= sum(errors.values()):
+                # Bytes get lost, the receiving end cannot keep up
+                candidates.append({"rtscts": True})
+        lower = list(filter(lambda b: b < profile.baudrate, BAUDRATES))
+        if lower:
+            candidates.append({"baudrate": lower[-1]})
+        for candidate in candidates:
+            if candidate not in self._tried:
+                return candidate
+        return None
+
+    def check_trial(self):
+        """Judges the change applied once the trial time is over, even if the
+        window is not full. The change is reverted if too few frames were
+        received since, as the other end might not get through anymore
+        """
+        with self._lock:
+            if self._trial is None or self._pending:
+                return
+            previous, rate_before, started = self._trial
+            if time.time() - started < self.trial_timeout:
+                return
+            if len(self._outcomes) >= MIN_FRAMES:
+                self.judge(self.get_error_rate())
+                return
+            self._trial = None
+            logger.warn("Only {} frames received on {} in {}s since the link "
+                        "profile change. Reverting to {}".format(
+                            len(self._outcomes), self.port,
+                            self.trial_timeout, json.dumps(previous)))
+            self._pending = (previous, rate_before)
+            self._reverting = True
+
+    def poll(self, ser, idle=True):
+        """Applies the link profile change pending, if any, to the port. Only
+        while the line is idle, so no transfer is interrupted
+        """
+        self.check_trial()
+        if not self._pending or not idle:
+            return
+        with self._lock:
+            settings, rate = self._pending
+            self._pending = None
+            previous = dict(map(lambda key: (key, getattr(self.profile, key)),
+                                settings))
+            try:
+                for key, value in settings.items():
+                    setattr(ser, key, value)
+            except (ValueError, serial.SerialException) as e:
+                logger.error("Cannot change the link profile: {}".format(e))
+                self._reverting = False
+                return
+            self.profile.update(**settings)
+            self._outcomes.clear()
+            self._errors = 0
+            self._nak = False
+            if self._reverting:
+                self._reverting = False
+                logger.warn("Link profile of {} reverted: {}".format(
+                    self.port, json.dumps(settings)))
+                return
+            self._tried.append(settings)
+            self._trial = (previous, rate, time.time())
+            self.stats["changes"] += 1
+            logger.warn("Link profile of {} changed: {}".format(
+                self.port, json.dumps(settings)))
+
+    def to_dict(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats.update({
+                "mode": self.mode,
+                "window": len(self._outcomes),
+                "error_rate": round(self.get_error_rate(), 3),
+                "window_errors": self.get_errors(),
+                "turnaround": round(self.get_turnaround(), 4),
+                "baudrate": self.profile.baudrate,
+                "rtscts": self.profile.rtscts,
+                "suggestion": self.suggestion,
+            })
+        return stats
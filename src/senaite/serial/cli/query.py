@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.SERIAL.CLI.
+#
+# SENAITE.SERIAL.CLI is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2020 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+from datetime import datetime
+
+from . import logger
+from .records import get_record_type
+from .records import iter_delimited
+from .records import iter_records
+from .records import split_fields
+from .records import unescape
+
+#: Name of the host, as sent in the header of the messages
+SENDER_NAME = u"SENAITE"
+
+#: Query record: position of the Starting Range ID Number field
+QUERY_RANGE_ID = 2
+
+#: Order record: number of fields
+ORDER_FIELDS = 26
+
+
+def get_query_ids(message):
+    """Returns the list of specimen ids requested by the Request Information
+    (Q) records of the message passed-in
+    """
+    sample_ids = []
+    for record, delimiters in iter_delimited(message):
+        if get_record_type(record) != u"Q":
+            continue
+        fields = split_fields(record, delimiters["field"])
+        if len(fields) <= QUERY_RANGE_ID:
+            continue
+        # patient id^specimen id^..., with repeats
+        for value in fields[QUERY_RANGE_ID].split(delimiters["repeat"]):
+            components = value.split(delimiters["component"])
+            sample_id = len(components) > 1 and components[1] or components[0]
+            sample_id = unescape(sample_id, delimiters).strip()
+            if sample_id and sample_id.upper() != u"ALL":
+                sample_ids.append(sample_id)
+    return sample_ids
+
+
+def is_query(message):
+    """Returns whether the message contains Request Information (Q) records
+    """
+    records = iter_records(message)
+    return any(get_record_type(record) == u"Q" for record in records)
+
+
+def get_timestamp():
+    return datetime.now().strftime("%Y%m%d%H%M%S")
+
+
+def get_header_record():
+    """Returns the Header record of the messages sent by the host
+    """
+    return u"H|\\^&|||{}|||||||P|1|{}".format(SENDER_NAME, get_timestamp())
+
+
+def get_order_record(seq, order, report_type=u"Q"):
+    """Returns the Order record for the order passed-in
+    """
+    fields = [u""] * ORDER_FIELDS
+    fields[0] = u"O"
+    fields[1] = u"{}".format(seq)
+    fields[2] = order.sample_id
+    fields[4] = u"\\".join(map(lambda kw: u"^^^{}".format(kw),
+                               order.get_keywords()))
+    fields[5] = order.priority
+    fields[11] = u"N"
+    fields[25] = report_type
+    return u"|".join(fields)
+
+
+def get_order_records(orders, report_type=u"O"):
+    """Returns the records of a message to send the orders passed-in, a
+    Patient record followed by an Order record per order
+    """
+    records = [get_header_record()]
+    for num, order in enumerate(orders, 1):
+        records.append(u"P|{}".format(num))
+        records.append(get_order_record(1, order, report_type=report_type))
+    return records
+
+
+class QueryResponder(object):
+    """Answers the Request Information (Q) records sent by instruments with the
+    tests pending for the specimens requested, from the worklist cache
+    """
+
+    def __init__(self, worklist, encoding="latin-1"):
+        self.worklist = worklist
+        self.encoding = encoding
+
+    def get_reply(self, message):
+        """Returns the records (as bytes) of the message to send back in
+        response to the queries from the message passed-in
+        """
+        sample_ids = get_query_ids(message)
+        orders = filter(None, map(self.worklist.get, sample_ids))
+        orders = list(orders)
+        logger.info("Query for {}: {} orders found".format(
+            ", ".join(sample_ids) or "-", len(orders)))
+
+        if orders:
+            records = get_order_records(orders, report_type=u"Q")
+            records.append(u"L|1|N")
+        else:
+            # No information available from last query
+            records = [get_header_record(), u"L|1|I"]
+
+        return list(map(lambda r: r.encode(self.encoding), records))
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.SERIAL.CLI.
+#
+# SENAITE.SERIAL.CLI is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2020 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+import collections
+import threading
+import time
+
+from . import logger
+
+#: Number of latency samples the baseline (minimum latency) is taken from
+LATENCY_WINDOW = 1000
+
+#: Latency, relative to the baseline, beyond which SENAITE is regarded as
+#: overloaded
+LATENCY_TOLERANCE = 3.0
+
+#: Factor the concurrency is multiplied by on overload
+BACKOFF = 0.75
+
+
+class TokenBucket(object):
+    """Token bucket that refills at `rate` tokens per second, up to
+    `capacity` tokens. A rate of zero means no limit
+    """
+
+    def __init__(self, rate=0, capacity=None):
+        self._lock = threading.Lock()
+        self.configure(rate, capacity)
+
+    def configure(self, rate=0, capacity=None):
+        """Sets the rate and capacity of the bucket. The bucket starts full
+        """
+        with self._lock:
+            self.rate = rate or 0
+            self.capacity = capacity or max(self.rate, 1)
+            self.tokens = float(self.capacity)
+            self.timestamp = time.time()
+
+    def refill(self):
+        now = time.time()
+        elapsed = now - self.timestamp
+        self.timestamp = now
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+
+    def consume(self, amount=1):
+        """Takes the amount of tokens from the bucket, waiting until they are
+        available. An amount larger than the capacity is taken once the bucket
+        is full, leaving the bucket in debt. Returns the time waited
+        """
+        if not self.rate:
+            return 0
+        waited = 0
+        while True:
+            with self._lock:
+                self.refill()
+                needed = min(amount, self.capacity)
+                if self.tokens >= needed:
+                    self.tokens -= amount
+                    return waited
+                wait = (needed - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+    def level(self):
+        """Returns the fill level of the bucket, from 0 (empty) to 1 (full).
+        Always full when there is no limit
+        """
+        if not self.rate:
+            return 1.0
+        with self._lock:
+            self.refill()
+            return max(self.tokens, 0) / self.capacity
+
+
+class RateLimiter(object):
+    """Limits the number of requests and the number of bytes per second
+    """
+
+    def __init__(self, requests=0, nbytes=0):
+        self.requests = TokenBucket(requests)
+        self.bytes = TokenBucket(nbytes)
+
+    def configure(self, requests=0, nbytes=0):
+        self.requests.configure(requests)
+        self.bytes.configure(nbytes)
+
+    def acquire(self, size=0):
+        """Waits until a request of the given size in bytes can be sent
+        """
+        waited = self.requests.consume(1)
+        if size:
+            waited += self.bytes.consume(size)
+        if waited:
+            logger.debug("Rate limit reached, waited {:.3f}s".format(waited))
+        return waited
+
+    def levels(self):
+        """Returns the fill level of the buckets
+        """
+        return {
+            "requests": self.requests.level(),
+            "bytes": self.bytes.level(),
+        }
+
+
+class AdaptiveConcurrency(object):
+    """Limits the number of requests in flight, and adapts the limit to the
+    response times and the errors (AIMD). The limit grows by one per
+    successful request until the first overload (slow start), and by one per
+    round of requests afterwards. On overload, a request that failed or an
+    average latency much longer than the minimum latency observed, the limit
+    is cut down, once per round of requests
+    """
+
+    def __init__(self, maximum=4, minimum=1, tolerance=LATENCY_TOLERANCE,
+                 window=LATENCY_WINDOW):
+        self.maximum = max(maximum, minimum)
+        self.minimum = minimum
+        self.tolerance = tolerance
+        self.limit = float(minimum)
+        self.inflight = 0
+        self.latency = 0.0
+        self.slow_start = True
+        self._samples = collections.deque(maxlen=window)
+        self._backoff = 0
+        self._condition = threading.Condition()
+        self.stats = {
+            "overloads": 0,
+            "requests": 0,
+        }
+
+    def acquire(self):
+        """Waits until a request can be sent
+        """
+        with self._condition:
+            while self.inflight >= int(self.limit):
+                self._condition.wait()
+            self.inflight += 1
+
+    def release(self, elapsed, success=True):
+        """Updates the limit with the outcome of the request sent
+        """
+        with self._condition:
+            busy = self.inflight >= int(self.limit)
+            self.inflight -= 1
+            self.stats["requests"] += 1
+            self.latency = self.latency and (
+                0.8 * self.latency + 0.2 * elapsed) or elapsed
+            if success:
+                self._samples.append(elapsed)
+            baseline = self._samples and min(self._samples) or elapsed
+            overload = not success or self.latency > baseline * self.tolerance
+
+            if overload and time.time() >= self._backoff:
+                self.stats["overloads"] += 1
+                self.slow_start = False
+                self.limit = max(self.minimum, self.limit * BACKOFF)
+                # Back off once per round of requests
+                self._backoff = time.time() + max(self.latency, elapsed)
+                logger.debug("Overload, concurrency down to {}".format(
+                    int(self.limit)))
+            elif not overload and busy:
+                # Only grow while the requests are held back by the limit
+                step = self.slow_start and 1 or 1.0 / self.limit
+                self.limit = min(self.maximum, self.limit + step)
+            self._condition.notify_all()
+
+    def to_dict(self):
+        with self._condition:
+            stats = dict(self.stats)
+            stats.update({
+                "limit": int(self.limit),
+                "inflight": self.inflight,
+                "latency": round(self.latency, 3),
+                "baseline": round(self._samples and min(self._samples) or 0, 3),
+            })
+        return stats
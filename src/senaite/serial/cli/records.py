@@ -0,0 +1,403 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.SERIAL.CLI.
+#
+# SENAITE.SERIAL.CLI is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2020 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+import hashlib
+import itertools
+import re
+
+#: Type of the text strings: unicode in Python 2, str in Python 3
+TEXT_TYPE = type(u"")
+
+#: Default delimiters: field, repeat, component and escape
+DEFAULT_DELIMITERS = u"|\\^&"
+
+#: Header record: position of the Sender Name or ID field
+HEADER_SENDER = 4
+
+#: Header record: position of the Date and Time of Message field
+HEADER_DATETIME = 13
+
+#: Order record: position of the Specimen ID field
+ORDER_SPECIMEN_ID = 2
+
+#: Order record: position of the Instrument Specimen ID field
+ORDER_INSTRUMENT_SPECIMEN_ID = 3
+
+#: Order record: position of the Priority field
+ORDER_PRIORITY = 5
+
+#: Result record: positions of the Universal Test ID, Data or Measurement
+#: Value, Units, Result Abnormal Flags, Result Status and Date/Time Test
+#: Completed fields
+RESULT_TEST_ID = 2
+RESULT_VALUE = 3
+RESULT_UNITS = 4
+RESULT_FLAGS = 6
+RESULT_STATUS = 8
+RESULT_DATETIME = 12
+
+#: Position of the test code within the Universal Test ID components
+TEST_CODE = 3
+
+#: Order priorities, from highest to lowest: Stat, ASAP and Routine
+PRIORITIES = u"SAR"
+
+#: Records are terminated by <CR>. Frames add <CR><LF> in between
+RECORD_SEPARATOR = re.compile(u"[\r\n]+")
+
+#: Escape sequences of the delimiters: field, component, repeat and escape
+ESCAPES = {
+    u"F": "field",
+    u"S": "component",
+    u"R": "repeat",
+    u"E": "escape",
+}
+
+
+def to_text(value, encoding="latin-1"):
+    """Returns the value as a text (unicode) string. Iterables of text chunks
+    (e.g. a transfer spilled to disk) are joined
+    """
+    if isinstance(value, bytes):
+        return value.decode(encoding)
+    if isinstance(value, TEXT_TYPE):
+        return value
+    return u"".join(map(lambda chunk: to_text(chunk, encoding), value))
+
+
+def iter_chunks(message):
+    """Yields the chunks of the message passed-in, either a text (a single
+    chunk) or an iterable of text chunks
+    """
+    if isinstance(message, (bytes, TEXT_TYPE)):
+        yield message
+        return
+    for chunk in message:
+        yield chunk
+
+
+def iter_records(message):
+    """Yields the non-empty records from the message passed-in, either a
+    text or an iterable of text chunks. Chunks are read as records are
+    needed, so a message is never held in memory as a whole
+    """
+    pending = u""
+    for chunk in iter_chunks(message):
+        records = RECORD_SEPARATOR.split(pending + to_text(chunk))
+        # Last record might continue in next chunk
+        pending = records.pop()
+        for record in records:
+            record = record.strip()
+            if record:
+                yield record
+    pending = pending.strip()
+    if pending:
+        yield pending
+
+
+def iter_delimited(message):
+    """Yields tuples of (record, delimiters) for the non-empty records of the
+    message passed-in, with the delimiters of the last Header record
+    """
+    delimiters = get_delimiters([])
+    for record in iter_records(message):
+        if get_record_type(record) == u"H":
+            delimiters = get_delimiters([record])
+        yield record, delimiters
+
+
+def get_records(message):
+    """Returns the list of non-empty records from the message passed-in
+    """
+    return list(iter_records(message))
+
+
+def get_delimiters(records):
+    """Returns a dict with the delimiters defined in the Header record, or the
+    default ones if no header record is found
+    """
+    delimiters = DEFAULT_DELIMITERS
+    header = records and records[0] or u""
+    if header[:1] == u"H" and len(header) >= 5:
+        delimiters = header[1:5]
+    return dict(zip(("field", "repeat", "component", "escape"), delimiters))
+
+
+def get_record_type(record):
+    """Returns the record type identifier (H, P, O, R, C, Q, L, etc.)
+    """
+    return record[:1].upper()
+
+
+def split_fields(record, delimiter=u"|"):
+    """Returns the list of fields of the record
+    """
+    return record.split(delimiter)
+
+
+def normalize(message):
+    """Returns a normalized text representation of the message, suitable to
+    compare the content of two messages regardless of their transport. Empty
+    records and surrounding blanks are removed, as is the date and time of
+    the message from the header, as it changes on retransmission
+    """
+    return u"\r".join(iter_normalized(message))
+
+
+def iter_normalized(message):
+    """Yields the normalized records of the message (see normalize)
+    """
+    for record, delimiters in iter_delimited(message):
+        if get_record_type(record) == u"H":
+            delimiter = delimiters["field"]
+            fields = split_fields(record, delimiter)
+            if len(fields) > HEADER_DATETIME:
+                fields[HEADER_DATETIME] = u""
+            record = delimiter.join(fields)
+        yield record
+
+
+def get_digest(message):
+    """Returns the hex digest of the normalized content of the message. The
+    digest is computed record by record, so it is the same as the digest of
+    the normalized text without building it
+    """
+    digest = hashlib.sha1()
+    separator = b""
+    for record in iter_normalized(message):
+        digest.update(separator + record.encode("utf-8"))
+        separator = b"\r"
+    return digest.hexdigest()
+
+
+def unescape(value, delimiters):
+    """Returns the value with the escaped delimiters (&F&, &S&, &R& and &E&)
+    resolved
+    """
+    escape = delimiters["escape"]
+    if escape not in value:
+        return value
+    pattern = u"{0}([FSRE]){0}".format(re.escape(escape))
+    return re.sub(pattern, lambda m: delimiters[ESCAPES[m.group(1)]], value)
+
+
+def get_field(record, position, delimiters, component=None):
+    """Returns the value of the field at the given position of the record, or
+    an empty string if the record has no such field. If a component position
+    is set, returns the value of that component of the field instead
+    """
+    fields = split_fields(record, delimiters["field"])
+    value = len(fields) > position and fields[position] or u""
+    if component is not None:
+        components = value.split(delimiters["component"])
+        value = len(components) > component and components[component] or u""
+    return unescape(value, delimiters)
+
+
+def get_instrument(message):
+    """Returns the name of the instrument that sent the message, from the
+    Sender Name or ID field of the header
+    """
+    for record, delimiters in iter_delimited(message):
+        if get_record_type(record) == u"H":
+            return get_field(record, HEADER_SENDER, delimiters, component=0)
+    return u""
+
+
+def get_priority(message):
+    """Returns the highest priority (S, A or R) of the Order records of the
+    message. Routine (R) if no priority is set
+    """
+    priorities = [PRIORITIES.index(u"R")]
+    for record, delimiters in iter_delimited(message):
+        if get_record_type(record) == u"O":
+            priority = get_field(record, ORDER_PRIORITY, delimiters)
+            priority = priority[:1].upper()
+            if priority and priority in PRIORITIES:
+                priorities.append(PRIORITIES.index(priority))
+    return PRIORITIES[min(priorities)]
+
+
+def get_sample_id(record, delimiters):
+    """Returns the specimen id of the Order record passed-in, or the
+    instrument specimen id if not set
+    """
+    sample_id = get_field(record, ORDER_SPECIMEN_ID, delimiters, component=0)
+    if not sample_id.strip():
+        sample_id = get_field(record, ORDER_INSTRUMENT_SPECIMEN_ID,
+                              delimiters, component=0)
+    return sample_id.strip()
+
+
+def get_sample_ids(message):
+    """Returns the list of specimen ids from the Order records of the message,
+    in order of appearance and without duplicates
+    """
+    sample_ids = []
+    seen = set()
+    for record, delimiters in iter_delimited(message):
+        if get_record_type(record) != u"O":
+            continue
+        sample_id = get_sample_id(record, delimiters)
+        if sample_id and sample_id not in seen:
+            seen.add(sample_id)
+            sample_ids.append(sample_id)
+    return sample_ids
+
+
+def set_sequence(record, sequence, delimiters):
+    """Returns the record with the Sequence Number field set
+    """
+    fields = split_fields(record, delimiters["field"])
+    if len(fields) > 1:
+        fields[1] = u"{}".format(sequence)
+    return delimiters["field"].join(fields)
+
+
+def split_message(message):
+    """Splits the message at the Patient and Order records. Returns a list
+    of messages, one per Order record with the records that follow it
+    (results, comments, etc.), the Patient record it belongs to, and the
+    Header and Terminator records of the message. Sequence numbers of the
+    Patient and Order records are reset to 1, so each message is valid on its
+    own. A transfer with several messages (Header to Terminator) is split per
+    message first, so no records of a message end up in another. Returns a
+    list with the message alone if it has no Order records
+    """
+    return list(iter_split(message))
+
+
+def iter_split(message):
+    """Yields the messages split from the message passed-in (see
+    split_message) one at a time, so only one of them is held in memory. The
+    message alone is yielded if it has less than two Order records
+    """
+    units = iter_units(message)
+    first = next(units, None)
+    second = next(units, None)
+    if second is None:
+        yield message
+        return
+    for unit in itertools.chain([first, second], units):
+        yield u"\r".join(unit) + u"\r"
+
+
+def iter_units(message):
+    """Yields the records of each unit of the message (see split_message):
+    an Order record with the records that follow it, and the Header, Patient
+    and Terminator records it belongs to. Messages without Order records are
+    yielded as they are. The message (text or iterable of text chunks) is
+    read twice: first for the Terminator record of each message, then for the
+    units
+    """
+    terminators = []
+    is_open = False
+    for record in iter_records(message):
+        record_type = get_record_type(record)
+        if record_type == u"H" or not is_open:
+            terminators.append(u"L|1|N")
+            is_open = True
+        if record_type == u"L":
+            terminators[-1] = record
+            is_open = False
+
+    section = -1
+    is_open = False
+    header, patient, records, unit = [], [], [], None
+    terminator = None
+    for record, delimiters in iter_delimited(message):
+        record_type = get_record_type(record)
+        if record_type == u"H" or not is_open:
+            # New message. Records of the previous one were all read
+            if unit is not None:
+                yield header + unit + [terminator]
+            elif records:
+                yield records
+            section += 1
+            terminator = terminators[section]
+            is_open = True
+            header, patient, records, unit = [], [], [], None
+
+        if records is not None:
+            # Kept until the first Order record of the message
+            records.append(record)
+
+        if record_type == u"L":
+            if unit is not None:
+                yield header + unit + [terminator]
+            elif records:
+                yield records
+            header, patient, records, unit = [], [], [], None
+            is_open = False
+        elif record_type == u"P":
+            if unit is not None:
+                yield header + unit + [terminator]
+            patient = [set_sequence(record, 1, delimiters)]
+            unit = None
+        elif record_type == u"O":
+            if unit is not None:
+                yield header + unit + [terminator]
+            unit = patient + [set_sequence(record, 1, delimiters)]
+            records = None
+        elif unit is not None:
+            unit.append(record)
+        elif patient:
+            patient.append(record)
+        else:
+            header.append(record)
+
+    if unit is not None:
+        yield header + unit + [terminator]
+    elif records:
+        yield records
+
+
+def get_results(message):
+    """Returns a list of dicts, one per Result record of the message, with
+    the instrument, the sample id of the Order record the result belongs to,
+    the test code, the value, the units, the flags, the status and the date
+    """
+    instrument = u""
+    sample_id = u""
+    results = []
+    for record, delimiters in iter_delimited(message):
+        record_type = get_record_type(record)
+        if record_type == u"H":
+            instrument = get_field(record, HEADER_SENDER, delimiters,
+                                   component=0)
+        if record_type == u"O":
+            sample_id = get_sample_id(record, delimiters)
+        if record_type != u"R":
+            continue
+        code = get_field(record, RESULT_TEST_ID, delimiters,
+                         component=TEST_CODE)
+        if not code:
+            code = get_field(record, RESULT_TEST_ID, delimiters, component=0)
+        results.append({
+            "instrument": instrument,
+            "sample_id": sample_id,
+            "code": code,
+            "value": get_field(record, RESULT_VALUE, delimiters),
+            "units": get_field(record, RESULT_UNITS, delimiters),
+            "flags": get_field(record, RESULT_FLAGS, delimiters),
+            "status": get_field(record, RESULT_STATUS, delimiters),
+            "date": get_field(record, RESULT_DATETIME, delimiters),
+        })
+    return results
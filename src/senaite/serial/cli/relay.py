@@ -0,0 +1,561 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.SERIAL.CLI.
+#
+# SENAITE.SERIAL.CLI is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2020 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+import argparse
+import bisect
+import io
+import itertools
+import json
+import logging
+import os
+import socket
+import stat
+import struct
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+
+try:
+    from SocketServer import StreamRequestHandler
+    from SocketServer import ThreadingMixIn
+    from SocketServer import UnixStreamServer
+except ImportError:
+    from socketserver import StreamRequestHandler
+    from socketserver import ThreadingMixIn
+    from socketserver import UnixStreamServer
+
+from . import lims
+from . import logger
+from .dedup import FLAG
+from .dedup import MODES
+from .dedup import SUPPRESS
+from .dedup import PushIndex
+from .pipeline import Transfer
+from .records import iter_chunks
+from .records import to_text
+from .routing import RoutingUploader
+from .routing import load_router
+from .uploader import Uploader
+
+#: Length prefix of each message sent through the socket (4 bytes, unsigned)
+HEADER = struct.Struct("!I")
+
+#: Reply of the uploader process once a message is queued for push
+ACK = b"\x06"
+
+#: Name of the socket of the uploader process, in the runtime directory
+SOCKET_NAME = "senaite_serial.sock"
+
+#: Maximum time in seconds between attempts to reach the uploader process
+MAX_DELAY = 60
+
+#: Maximum number of messages sent to the uploader process at once
+BATCH_SIZE = 50
+
+#: Maximum number of messages kept in memory by the listeners. The messages
+#: beyond are kept in the spool directory until sent
+MAX_QUEUED = 1000
+
+#: Suffix of the files of the spool directory
+SPOOL_SUFFIX = ".msg"
+
+
+def get_runtime_dir():
+    """Returns the directory of the runtime files of the user: the one set
+    by XDG_RUNTIME_DIR, or a private directory in the temporary directory
+    """
+    path = os.environ.get("XDG_RUNTIME_DIR")
+    if path:
+        return path
+    name = "senaite_serial-{}".format(os.getuid())
+    return os.path.join(tempfile.gettempdir(), name)
+
+
+def make_private_dir(path):
+    """Creates the directory, readable by its owner only, unless it exists.
+    Raises a ValueError if the directory exists and other users can write
+    in it or replace it
+    """
+    if not os.path.exists(path):
+        os.makedirs(path, 0o700)
+        return
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode):
+        raise ValueError("Not a directory: {}".format(path))
+    if info.st_uid != os.getuid() or info.st_mode & 0o022:
+        raise ValueError("Directory not private: {}".format(path))
+
+
+#: Default path of the socket of the uploader process
+SOCKET_PATH = os.path.join(get_runtime_dir(), SOCKET_NAME)
+
+
+def get_spool_dir(port):
+    """Returns the default spool directory of the listener of the port, in
+    the runtime directory of the user
+    """
+    name = "spool-{}".format(os.path.basename(port.rstrip("/\\")))
+    return os.path.join(get_runtime_dir(), name)
+
+
+def send_message(sock, data):
+    """Sends the data (dict) through the socket, prefixed with its length
+    """
+    payload = json.dumps(data).encode("utf-8")
+    sock.sendall(HEADER.pack(len(payload)) + payload)
+
+
+def recv_exactly(stream, size):
+    """Reads exactly size bytes from the stream. Returns None if the stream
+    is closed before
+    """
+    data = b""
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+class RelayServer(ThreadingMixIn, UnixStreamServer):
+    """Unix socket server of the uploader process. Listeners of the serial
+    ports send the messages received through the socket, and the server
+    queues them in a single uploader, so all ports share the session with
+    SENAITE, the workers, the rate limit and the duplicates index
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path, uploader, index=None, dedup_mode=SUPPRESS):
+        if path == SOCKET_PATH:
+            make_private_dir(os.path.dirname(path))
+        if os.path.exists(path):
+            # Socket left by a previous run
+            os.remove(path)
+        UnixStreamServer.__init__(self, path, RelayRequestHandler)
+        # Only the listeners run by the same user can connect
+        os.chmod(path, 0o600)
+        self.path = path
+        self.uploader = uploader
+        self.index = index
+        self.dedup_mode = dedup_mode
+
+    def server_close(self):
+        UnixStreamServer.server_close(self)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def put(self, message):
+        """Queues the message for push, unless it is a duplicate
+        """
+        digest = None
+        duplicate = False
+        if self.index is not None:
+            digest = self.index.claim(message)
+            duplicate = digest is None
+
+        if duplicate and self.dedup_mode != FLAG:
+            logger.warn("Duplicate message, already pushed. Skipping")
+            return
+
+        elif duplicate:
+            logger.warn("Duplicate message, already pushed. Flagged")
+
+        self.uploader.put(message, digest=digest, duplicate=duplicate)
+
+
+class RelayRequestHandler(StreamRequestHandler):
+    """Handles the connection of a listener. Each message is acknowledged
+    once queued for push
+    """
+
+    def handle(self):
+        logger.info("Listener connected")
+        while True:
+            header = recv_exactly(self.rfile, HEADER.size)
+            if header is None:
+                break
+            payload = recv_exactly(self.rfile, HEADER.unpack(header)[0])
+            if payload is None:
+                break
+            data = json.loads(payload.decode("utf-8"))
+            for message in data["messages"]:
+                self.server.put(message)
+            self.wfile.write(ACK)
+            self.wfile.flush()
+        logger.info("Listener disconnected")
+
+
+class MessageSpool(object):
+    """Directory with the messages the listener could not send yet, one file
+    per message. Files are named after the time the message was queued, so
+    they are sent in the order they were received, also after a restart
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        if not os.path.isdir(path):
+            os.makedirs(path, 0o700)
+        names = os.listdir(path)
+        self._names = sorted(filter(lambda n: n.endswith(SPOOL_SUFFIX),
+                                    names))
+
+    def qsize(self):
+        return len(self._names)
+
+    def put(self, message, timestamp=None):
+        """Writes the message to the spool. The file is renamed once written,
+        so a message is never read partially
+        """
+        name = "{:017.6f}-{:06d}{}".format(timestamp or time.time(),
+                                           next(self._counter) % 1000000,
+                                           SPOOL_SUFFIX)
+        path = os.path.join(self.path, name)
+        with io.open(path + ".tmp", "w", encoding="utf-8",
+                     newline="") as f:
+            for chunk in iter_chunks(message):
+                f.write(to_text(chunk))
+        os.rename(path + ".tmp", path)
+        with self._lock:
+            bisect.insort(self._names, name)
+
+    def peek(self, size):
+        """Returns the first messages of the spool, as (name, message), up to
+        the size passed-in. Messages are left in the spool
+        """
+        with self._lock:
+            names = self._names[:size]
+        messages = []
+        for name in names:
+            path = os.path.join(self.path, name)
+            with io.open(path, encoding="utf-8", newline="") as f:
+                messages.append((name, f.read()))
+        return messages
+
+    def remove(self, names):
+        """Removes the messages sent from the spool
+        """
+        with self._lock:
+            for name in names:
+                self._names.remove(name)
+        for name in names:
+            os.remove(os.path.join(self.path, name))
+
+
+class RelayClient(object):
+    """Stand-in of the uploader for the listeners of the serial ports, that
+    sends the messages to the uploader process through its socket, in
+    batches. Messages are sent from a background thread, and kept in memory
+    up to a maximum. Messages beyond, and the ones not sent when stopped
+    while the uploader process is not available, are written to the spool
+    directory and sent first on next start. Attempts are spaced out up to
+    MAX_DELAY
+    """
+
+    def __init__(self, path=SOCKET_PATH, spool=None, delay=5, timeout=30,
+                 maxsize=MAX_QUEUED, batch_size=BATCH_SIZE):
+        self.path = path
+        self.spool = MessageSpool(spool) if spool else None
+        self.delay = delay
+        self.timeout = timeout
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.queue = deque()
+        self._sock = None
+        self._thread = None
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._stopped = threading.Event()
+        if self.spool is not None and self.spool.qsize():
+            logger.info("{} messages in the spool {}".format(
+                self.spool.qsize(), self.spool.path))
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run)
+        self._thread.start()
+
+    def stop(self):
+        """Tells the thread to stop once the messages queued are sent. If the
+        uploader process is not available, the thread stops right away and
+        the messages are written to the spool
+        """
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        self._stopped.set()
+
+    def join(self):
+        if self._thread:
+            self._thread.join()
+
+    def qsize(self):
+        spooled = self.spool is not None and self.spool.qsize() or 0
+        return len(self.queue) + spooled
+
+    def configure(self, delay=None, **kwargs):
+        """Changes the delay between attempts. The other settings belong to
+        the uploader process, so they are ignored
+        """
+        if delay is not None:
+            self.delay = delay
+
+    def put(self, message, digest=None, duplicate=False):
+        """Queues the message to be sent to the uploader process. Duplicates
+        are handled by the uploader process, so digest and duplicate are
+        ignored. Once the queue is full, or while there are messages in the
+        spool, the message goes to the spool, so the order is kept. Transfers
+        spilled to disk are released once notified, so they are copied to the
+        spool, or read if there is no spool
+        """
+        spilled = isinstance(message, Transfer)
+        if spilled and self.spool is None:
+            message = to_text(message)
+        with self._cond:
+            spooled = self.spool is not None and self.spool.qsize()
+            if self.spool is None or (len(self.queue) < self.maxsize and
+                                      not spooled and not spilled):
+                if len(self.queue) == self.maxsize:
+                    # No spool, so the queue is not bounded
+                    logger.warn("{} messages waiting for the uploader "
+                                "process".format(len(self.queue)))
+                self.queue.append((time.time(), message))
+            else:
+                self.spool.put(message)
+            self._cond.notify()
+
+    def get_batch(self):
+        """Waits for messages to send. Returns the next batch, as a list of
+        (timestamp, message, spool name), or None when stopped. Messages in
+        memory are older than the ones in the spool, so they go first
+        """
+        with self._cond:
+            while not self.qsize() and not self._stopping:
+                self._cond.wait()
+            if self.queue:
+                size = min(len(self.queue), self.batch_size)
+                return [self.queue[num] + (None, ) for num in range(size)]
+        if self.spool is not None and self.spool.qsize():
+            return list(map(lambda item: (None, item[1], item[0]),
+                            self.spool.peek(self.batch_size)))
+        return None
+
+    def remove(self, batch):
+        """Removes the batch sent from the queue or the spool
+        """
+        names = list(filter(None, map(lambda item: item[2], batch)))
+        if names:
+            self.spool.remove(names)
+            return
+        with self._cond:
+            for item in batch:
+                self.queue.popleft()
+
+    def run(self):
+        while True:
+            batch = self.get_batch()
+            if batch is None:
+                break
+            if not self.send_retry(list(map(lambda i: i[1], batch))):
+                # Stopped while the uploader process is not available
+                self.save()
+                break
+            self.remove(batch)
+        self.close()
+
+    def save(self):
+        """Writes the messages in memory to the spool, so they are sent on
+        next start. Messages are logged as lost if there is no spool
+        """
+        with self._cond:
+            if self.spool is None:
+                logger.error("{} messages not sent to the uploader process "
+                             "at {}. Lost".format(len(self.queue), self.path))
+                return
+            while self.queue:
+                timestamp, message = self.queue.popleft()
+                self.spool.put(message, timestamp=timestamp)
+        logger.error("{} messages not sent to the uploader process at {}. "
+                     "Kept in {}".format(self.spool.qsize(), self.path,
+                                         self.spool.path))
+
+    def send_retry(self, messages):
+        """Sends the messages until the uploader process accepts them, waiting
+        longer between attempts each time. Returns False if stopped before
+        """
+        delay = self.delay
+        while not self.send(messages):
+            logger.warn("Uploader process not available at {}. Retrying in "
+                        "{}s".format(self.path, delay))
+            if self._stopped.wait(delay):
+                return False
+            delay = min(delay * 2, max(MAX_DELAY, self.delay))
+        return True
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.path)
+        self._sock = sock
+
+    def close(self):
+        if self._sock:
+            self._sock.close()
+            self._sock = None
+
+    def send(self, messages):
+        """Sends the messages to the uploader process and waits for the
+        acknowledge. Returns whether the messages were accepted
+        """
+        try:
+            if not self._sock:
+                self.connect()
+            messages = list(map(to_text, messages))
+            send_message(self._sock, {"messages": messages})
+            if self._sock.recv(1) == ACK:
+                return True
+        except (socket.error, socket.timeout) as e:
+            logger.error("Cannot send the messages to the uploader: {}"
+                         .format(e))
+        self.close()
+        return False
+
+
+def main():
+    """Entry-point of the uploader process shared by the listeners of the
+    serial ports
+    """
+    parser = argparse.ArgumentParser(
+        description="SENAITE Serial uploader, shared by the listeners of "
+                    "several serial ports",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("url", type=str,
+                        help="SENAITE full URL address, with username and "
+                             "password: "
+                             "<protocol>://<user>:<password>@<senaite_url>")
+    parser.add_argument("-s", "--socket", type=str, default=SOCKET_PATH,
+                        help="Path of the Unix socket to listen at. By "
+                             "default, in the runtime directory of the user "
+                             "(XDG_RUNTIME_DIR or a private directory in the "
+                             "temporary directory)")
+    parser.add_argument("--routes", type=str, metavar="FILE",
+                        help="JSON file with the SENAITE instances to push "
+                             "the messages to, and the routes that map the "
+                             "instruments or the values of the records to "
+                             "them. SENAITE URL gets the messages no route "
+                             "matches")
+    parser.add_argument("-r", "--retries", type=int, default=3,
+                        help="Number of attempts of reconnection when SENAITE "
+                             "instance is not reachable")
+    parser.add_argument("-d", "--delay", type=int, default=5,
+                        help="Time delay in seconds between retries")
+    parser.add_argument("-w", "--workers", type=int, default=4,
+                        help="Number of messages pushed to SENAITE at the "
+                             "same time")
+    parser.add_argument("-b", "--batch", type=int, default=1,
+                        help="Maximum number of messages waiting that are "
+                             "pushed to SENAITE in a single request")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="Adapt the number of messages pushed at the "
+                             "same time to the response times of SENAITE, up "
+                             "to the number of workers")
+    parser.add_argument("--max-requests", type=float, default=0,
+                        help="Maximum number of requests per second sent to "
+                             "SENAITE. Set to 0 for no limit")
+    parser.add_argument("--max-bytes", type=int, default=0,
+                        help="Maximum number of bytes per second sent to "
+                             "SENAITE. Set to 0 for no limit")
+    parser.add_argument("--dedup", type=str, metavar="FILE",
+                        help="Journal file of the messages pushed, shared by "
+                             "all listeners to skip duplicates")
+    parser.add_argument("--dedup-mode", type=str, default=SUPPRESS,
+                        choices=MODES,
+                        help="What to do with duplicate messages")
+    parser.add_argument("--dedup-ttl", type=int, default=86400,
+                        help="Time in seconds a message pushed is remembered")
+    parser.add_argument("--dedup-size", type=int, default=10000,
+                        help="Maximum number of messages remembered")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="Verbose logging")
+    args = parser.parse_args()
+
+    logger.setLevel(args.verbose and logging.DEBUG or logging.INFO)
+    logger.addHandler(logging.StreamHandler())
+
+    lims.limiter.configure(requests=args.max_requests, nbytes=args.max_bytes)
+    try:
+        info = lims.get_senaite_connection_info(args.url)
+    except ValueError as e:
+        logger.error(e)
+        sys.exit(-1)
+
+    index = None
+    if args.dedup:
+        index = PushIndex(args.dedup, maxsize=args.dedup_size,
+                          ttl=args.dedup_ttl)
+
+    if args.routes:
+        # Each SENAITE instance has its own uploader
+        try:
+            router = load_router(args.routes)
+        except (IOError, ValueError) as e:
+            logger.error(e)
+            sys.exit(-1)
+        router.add_default(info)
+        uploader = RoutingUploader(router, retries=args.retries,
+                                   delay=args.delay, workers=args.workers,
+                                   index=index, adaptive=args.adaptive,
+                                   batch_size=args.batch)
+    else:
+        uploader = Uploader(info["url"], info["user"], info["password"],
+                            retries=args.retries, delay=args.delay,
+                            workers=args.workers, index=index,
+                            adaptive=args.adaptive, batch_size=args.batch)
+
+    try:
+        server = RelayServer(args.socket, uploader, index=index,
+                             dedup_mode=args.dedup_mode)
+    except (ValueError, socket.error) as e:
+        logger.error(e)
+        sys.exit(-1)
+    uploader.start()
+
+    print("Uploader listening at {}, press Ctrl+c to exit.".format(
+        args.socket))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        # Push the messages queued before leaving
+        uploader.stop()
+        uploader.join()
+        if index is not None:
+            index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,380 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.SERIAL.CLI.
+#
+# SENAITE.SERIAL.CLI is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2020 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+import bisect
+import fnmatch
+import hashlib
+import json
+import threading
+import time
+
+from . import lims
+from . import logger
+from .records import get_field
+from .records import get_instrument
+from .records import get_record_type
+from .records import get_sample_ids
+from .records import iter_delimited
+from .uploader import Uploader
+
+#: Name of the target of the SENAITE URL passed-in with --url
+DEFAULT_TARGET = "default"
+
+#: Number of points of each target in the hash ring
+REPLICAS = 160
+
+#: Consecutive failures after which a target is regarded as down
+FAILURE_THRESHOLD = 3
+
+#: Time in seconds a target that is down is not tried
+COOLDOWN = 30
+
+#: Messages queued in a target beyond which it is regarded as overloaded,
+#: so the messages are sent to the next equivalent target
+MAX_QUEUED = 100
+
+#: Settings of the routes file
+SETTINGS = ("targets", "routes", "max_queued")
+
+#: Settings of each route of the routes file
+ROUTE_SETTINGS = ("targets", "instrument", "record", "field", "component",
+                  "value")
+
+
+def get_hash(key):
+    """Returns the position of the key in the hash ring
+    """
+    digest = hashlib.md5(key.encode("utf-8")).hexdigest()
+    return int(digest[:8], 16)
+
+
+class Health(object):
+    """Health of a SENAITE target, from the outcome of the requests sent. A
+    target is down after a number of consecutive failures, and is tried again
+    once the cooldown elapses
+    """
+
+    def __init__(self, name, threshold=FAILURE_THRESHOLD, cooldown=COOLDOWN):
+        self.name = name
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.down_since = None
+        self.latency = 0.0
+        self._lock = threading.Lock()
+        self.stats = {
+            "succeeded": 0,
+            "errors": 0,
+        }
+
+    def update(self, success, elapsed=None):
+        """Updates the health with the outcome of a request
+        """
+        with self._lock:
+            if elapsed is not None:
+                # Exponentially weighted moving average
+                self.latency = 0.8 * self.latency + 0.2 * elapsed
+            if success:
+                self.stats["succeeded"] += 1
+                if self.down_since:
+                    logger.info("Target {} is up again".format(self.name))
+                self.failures = 0
+                self.down_since = None
+                return
+            self.stats["errors"] += 1
+            self.failures += 1
+            if self.failures >= self.threshold:
+                # Wait for the cooldown before trying again
+                if not self.down_since:
+                    logger.warn("Target {} is down".format(self.name))
+                self.down_since = time.time()
+
+    def is_healthy(self):
+        if not self.down_since:
+            return True
+        return time.time() - self.down_since >= self.cooldown
+
+    def to_dict(self):
+        with self._lock:
+            health = dict(self.stats)
+        health.update({
+            "healthy": self.is_healthy(),
+            "failures": self.failures,
+            "latency": round(self.latency, 3),
+        })
+        return health
+
+
+class HashRing(object):
+    """Consistent hashing of keys to names. Each name is placed at several
+    points of the ring, so keys are spread evenly, and adding or removing a
+    name only moves the keys of that name
+    """
+
+    def __init__(self, names, replicas=REPLICAS):
+        points = []
+        for name in names:
+            for num in range(replicas):
+                points.append((get_hash(u"{}-{}".format(name, num)), name))
+        points.sort()
+        self._points = points
+        self._hashes = list(map(lambda p: p[0], points))
+        self._names = list(names)
+
+    def get(self, key):
+        """Returns the names in order of preference for the key passed-in
+        """
+        if len(self._names) < 2:
+            return list(self._names)
+        start = bisect.bisect(self._hashes, get_hash(key))
+        names = []
+        for num in range(len(self._points)):
+            name = self._points[(start + num) % len(self._points)][1]
+            if name not in names:
+                names.append(name)
+                if len(names) == len(self._names):
+                    break
+        return names
+
+
+class Route(object):
+    """Maps the messages that match the conditions to a group of equivalent
+    targets: the instrument name and the value of a field of a record, both
+    with wildcards. A route without conditions matches all messages
+    """
+
+    def __init__(self, targets, instrument=None, record=None, field=None,
+                 component=None, value=None):
+        if not targets:
+            raise ValueError("Route without targets")
+        for name, num in (("field", field), ("component", component)):
+            if num is not None and not isinstance(num, int):
+                raise ValueError("Route {} is not a number: {}".format(
+                    name, num))
+        self.targets = targets
+        self.instrument = instrument
+        self.record = record and record.upper() or None
+        self.field = field
+        self.component = component
+        self.value = value
+        self.ring = HashRing(targets)
+
+    def matches(self, message):
+        if self.instrument:
+            if not fnmatch.fnmatch(get_instrument(message), self.instrument):
+                return False
+        if self.record and self.field is not None:
+            values = self.get_values(message)
+            pattern = self.value or u"*"
+            if not any(map(lambda v: fnmatch.fnmatch(v, pattern), values)):
+                return False
+        return True
+
+    def get_values(self, message):
+        """Returns the values of the field of the records of the route
+        """
+        values = []
+        for record, delimiters in iter_delimited(message):
+            if get_record_type(record) != self.record:
+                continue
+            values.append(get_field(record, self.field, delimiters,
+                                    component=self.component))
+        return values
+
+
+class Router(object):
+    """Selects the SENAITE target of each message. The first route that
+    matches the message gives the group of equivalent targets, and the
+    message is sent to one of them by consistent hashing of its sample id,
+    so the results of a sample always go to the same target while it is
+    healthy and not overloaded
+    """
+
+    def __init__(self, routes, targets, max_queued=MAX_QUEUED):
+        self.routes = routes
+        self.targets = targets
+        self.max_queued = max_queued
+        for route in routes:
+            unknown = set(route.targets) - set(targets)
+            if unknown:
+                raise ValueError("Unknown targets in route: {}".format(
+                    ", ".join(sorted(unknown))))
+
+    def add_default(self, info):
+        """Adds the default target (connection info), that gets the messages
+        no route matches
+        """
+        self.targets[DEFAULT_TARGET] = info
+        self.routes.append(Route([DEFAULT_TARGET]))
+
+    def get_candidates(self, message):
+        """Returns the names of the targets for the message, in order of
+        preference. Empty if no route matches
+        """
+        for route in self.routes:
+            if not route.matches(message):
+                continue
+            sample_ids = get_sample_ids(message)
+            key = sample_ids and sample_ids[0] or get_instrument(message)
+            return route.ring.get(key)
+        return []
+
+    def select(self, message, uploaders):
+        """Returns the name of the target the message is sent to: the first
+        candidate that is healthy and not overloaded, the first healthy one
+        otherwise, or the preferred one if none is healthy. None if the
+        message has no route
+        """
+        candidates = self.get_candidates(message)
+        healthy = list(filter(
+            lambda name: uploaders[name].health.is_healthy(), candidates))
+        for name in healthy:
+            if uploaders[name].qsize() < self.max_queued:
+                return name
+        if healthy:
+            return healthy[0]
+        return candidates and candidates[0] or None
+
+
+def load_router(path):
+    """Returns the router defined in the JSON file passed-in, with the
+    targets (name to SENAITE full URL address) and the routes
+    """
+    with open(path, "r") as f:
+        config = json.load(f)
+    if not isinstance(config, dict):
+        raise ValueError("Not a JSON object: {}".format(path))
+    unknown = set(config) - set(SETTINGS)
+    if unknown:
+        raise ValueError("Unknown settings in {}: {}".format(
+            path, ", ".join(sorted(unknown))))
+
+    targets = {}
+    for name, url in config.get("targets", {}).items():
+        try:
+            targets[name] = lims.parse_senaite_url(url)
+        except ValueError as e:
+            raise ValueError("Target {}: {}".format(name, e))
+
+    routes = []
+    for num, settings in enumerate(config.get("routes", []), 1):
+        if not isinstance(settings, dict):
+            raise ValueError("Route {}: not a JSON object".format(num))
+        unknown = set(settings) - set(ROUTE_SETTINGS)
+        if unknown:
+            raise ValueError("Route {}: unknown settings: {}".format(
+                num, ", ".join(sorted(unknown))))
+        settings = dict(settings)
+        try:
+            routes.append(Route(settings.pop("targets", None), **settings))
+        except ValueError as e:
+            raise ValueError("Route {}: {}".format(num, e))
+
+    if not targets:
+        raise ValueError("No targets defined in {}".format(path))
+    return Router(routes, targets, max_queued=config.get("max_queued",
+                                                         MAX_QUEUED))
+
+
+class RoutingUploader(object):
+    """Stand-in of the uploader that routes the messages to several SENAITE
+    instances. Each target has its own uploader, with its workers, sessions
+    and health, so a target that is down or slow only holds back its own
+    messages
+    """
+
+    def __init__(self, router, retries=3, delay=5, workers=4, index=None,
+                 adaptive=False, batch_size=1):
+        self.router = router
+        self.index = index
+        self.unrouted = 0
+        self.uploaders = {}
+        self._lock = threading.Lock()
+        for name, info in router.targets.items():
+            self.uploaders[name] = Uploader(info["url"], info["user"],
+                                            info["password"],
+                                            retries=retries, delay=delay,
+                                            workers=workers, index=index,
+                                            health=Health(name),
+                                            adaptive=adaptive,
+                                            batch_size=batch_size)
+
+    @property
+    def stats(self):
+        """Stats of all targets, with the stats of each one
+        """
+        stats = {
+            "pushed": 0,
+            "failed": 0,
+            "retries": 0,
+            "unrouted": self.unrouted,
+            "targets": {},
+        }
+        for name, uploader in self.uploaders.items():
+            target = dict(uploader.stats)
+            for key in ("pushed", "failed", "retries"):
+                stats[key] += target[key]
+            target.update(uploader.health.to_dict())
+            if uploader.concurrency is not None:
+                target["concurrency"] = uploader.concurrency.to_dict()
+            target["queued"] = uploader.qsize()
+            stats["targets"][name] = target
+        return stats
+
+    def start(self):
+        for uploader in self.uploaders.values():
+            uploader.start()
+
+    def stop(self):
+        for uploader in self.uploaders.values():
+            uploader.stop()
+
+    def join(self):
+        for uploader in self.uploaders.values():
+            uploader.join()
+
+    def qsize(self):
+        return sum(map(lambda u: u.qsize(), self.uploaders.values()))
+
+    def configure(self, url=None, user=None, password=None, **kwargs):
+        """Changes the settings of the uploaders. The URL and credentials are
+        the ones of the default target
+        """
+        for name, uploader in self.uploaders.items():
+            if name == DEFAULT_TARGET:
+                uploader.configure(url=url, user=user, password=password,
+                                   **kwargs)
+            else:
+                uploader.configure(**kwargs)
+
+    def put(self, message, digest=None, duplicate=False):
+        """Queues the message in the uploader of its target
+        """
+        name = self.router.select(message, self.uploaders)
+        if name is None:
+            with self._lock:
+                self.unrouted += 1
+            logger.error("No route for the message. Not pushed")
+            if digest and self.index is not None:
+                # Retransmissions of this message must be pushed
+                self.index.discard(digest)
+            return
+        logger.debug("Message routed to {}".format(name))
+        self.uploaders[name].put(message, digest=digest, duplicate=duplicate)
@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.SERIAL.CLI.
+#
+# SENAITE.SERIAL.CLI is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2020 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+import threading
+import time
+
+try:
+    from urllib import urlencode
+except ImportError:
+    from urllib.parse import urlencode
+
+from . import lims
+from . import logger
+from .cache import LRUCache
+from .records import get_sample_ids
+
+#: Review states of the samples that accept results. Samples in other states
+#: (e.g. verified, published, cancelled) are closed
+ACTIVE_STATES = ("sample_due", "sample_received", "to_be_verified")
+
+#: State stored for the sample ids that do not exist in SENAITE
+NOT_FOUND = ""
+
+#: Number of items to fetch per request
+PAGE_SIZE = 500
+
+#: Time in seconds to wait for the lookup of a sample id
+LOOKUP_TIMEOUT = 10
+
+
+class SampleCache(object):
+    """Local copy of the review states of the samples from SENAITE, used to
+    check the sample ids of the messages before they are pushed. The active
+    samples are loaded on start and the cache is refreshed incrementally
+    afterwards, by fetching the samples modified since the last refresh only.
+    Sample ids not in the cache are looked up in SENAITE once, and kept until
+    they expire or are evicted (least recently used first). Messages whose
+    samples are all unknown or closed are parked in the archive, if any
+    """
+
+    def __init__(self, url, user, password, interval=60, full_interval=3600,
+                 maxsize=100000, ttl=3600, parking=None):
+        self.session = lims.Session(url, user, password)
+        self.parking = parking
+        self.interval = interval
+        self.full_interval = full_interval
+        self._cache = LRUCache(maxsize=maxsize, ttl=ttl)
+        self._last_modified = ""
+        self._last_full = 0
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._thread = None
+        self._stopped = threading.Event()
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "lookups_failed": 0,
+            "parked": 0,
+        }
+
+    def count(self, key):
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def __len__(self):
+        return len(self._cache)
+
+    def __bool__(self):
+        # An empty cache is still a cache
+        return True
+
+    __nonzero__ = __bool__
+
+    def to_dict(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+        total = stats["hits"] + stats["misses"]
+        stats.update({
+            "size": len(self),
+            "hit_rate": round(total and float(stats["hits"]) / total or 0, 3),
+        })
+        return stats
+
+    def configure(self, url, user, password):
+        """Switches to another SENAITE. The samples of the previous one are
+        discarded, and all are loaded again on next refresh
+        """
+        with self._lock:
+            self.session = lims.Session(url, user, password)
+            self._cache = LRUCache(maxsize=self._cache.maxsize,
+                                   ttl=self._cache.ttl)
+            self._last_modified = ""
+            self._last_full = 0
+
+    def start(self):
+        """Loads the cache and keeps it refreshed in a background thread
+        """
+        self.refresh()
+        self._thread = threading.Thread(target=self.run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error("Cannot refresh the samples: {}".format(e))
+
+    def refresh(self):
+        """Refreshes the cache, either fully or incrementally
+        """
+        if not self.connect():
+            return
+        if time.time() - self._last_full >= self.full_interval:
+            self.refresh_full()
+        else:
+            self.refresh_modified()
+
+    def connect(self):
+        """Returns whether the session with SENAITE is started
+        """
+        with self._lock:
+            if self.session.session:
+                return True
+            return self.session.auth()
+
+    def refresh_full(self):
+        """Loads the active samples. Least recently modified first, so they
+        are the first ones evicted when the cache is full
+        """
+        last_modified = ""
+        loaded = 0
+        for item in self.search(review_state=ACTIVE_STATES,
+                                sort_on="modified",
+                                sort_order="ascending"):
+            self.add(item)
+            last_modified = max(last_modified, item.get("modified") or "")
+            loaded += 1
+        self._last_modified = last_modified
+        self._last_full = time.time()
+        logger.info("Samples loaded: {}".format(loaded))
+
+    def refresh_modified(self):
+        """Updates the cache with the samples modified since last refresh,
+        whatever their state, so samples closed meanwhile are known
+        """
+        last_modified = self._last_modified
+        updated = 0
+        for item in self.search(sort_on="modified",
+                                sort_order="descending"):
+            modified = item.get("modified") or ""
+            if last_modified and modified <= last_modified:
+                break
+            self._last_modified = max(self._last_modified, modified)
+            self.add(item)
+            updated += 1
+        logger.debug("Samples refreshed: {} updated".format(updated))
+
+    def add(self, item):
+        """Adds the sample (as returned by the JSON API) to the cache
+        """
+        sample_id = item.get("getId") or item.get("id")
+        if sample_id:
+            self._cache.set(sample_id, item.get("review_state") or "")
+
+    def get_state(self, sample_id, lookup=True):
+        """Returns the review state of the sample, NOT_FOUND if the sample
+        does not exist, or None if it cannot be known. Sample ids not in the
+        cache are looked up in SENAITE, unless lookup is False
+        """
+        state = self._cache.get(sample_id)
+        if not lookup:
+            return state
+        if state is not None:
+            self.count("hits")
+            return state
+        self.count("misses")
+        return self.lookup(sample_id)
+
+    def lookup(self, sample_id):
+        """Fetches the review state of the sample from SENAITE
+        """
+        if not self.connect():
+            self.count("lookups_failed")
+            return None
+        query = urlencode({
+            "portal_type": "AnalysisRequest",
+            "getId": sample_id,
+        })
+        response = self.session.get("search?{}".format(query),
+                                    timeout=LOOKUP_TIMEOUT)
+        if "items" not in response:
+            # SENAITE is not reachable, the state is unknown
+            self.count("lookups_failed")
+            return None
+        state = NOT_FOUND
+        for item in response["items"]:
+            if item.get("getId") == sample_id:
+                state = item.get("review_state") or ""
+        self._cache.set(sample_id, state)
+        return state
+
+    def is_valid(self, sample_id, lookup=True):
+        """Returns whether the sample accepts results. Samples with an unknown
+        state are regarded as valid, so they are checked by SENAITE
+        """
+        state = self.get_state(sample_id, lookup=lookup)
+        return state is None or state in ACTIVE_STATES
+
+    def get_invalid(self, sample_ids, lookup=True):
+        """Returns the sample ids that do not exist or are closed
+        """
+        return list(filter(lambda sid: not self.is_valid(sid, lookup=lookup),
+                           sample_ids))
+
+    def validate(self, message, lookup=True):
+        """Returns whether the message has to be pushed. Messages whose
+        samples are all unknown or closed are parked instead. With lookup
+        False, only the samples in the cache are checked, so the call never
+        waits for SENAITE
+        """
+        sample_ids = get_sample_ids(message)
+        invalid = self.get_invalid(sample_ids, lookup=lookup)
+        if not invalid:
+            return True
+        if len(invalid) < len(sample_ids):
+            # SENAITE imports the results of the other samples
+            logger.warn("Unknown or closed samples: {}".format(
+                ", ".join(invalid)))
+            return True
+        logger.warn("Message parked, unknown or closed samples: {}".format(
+            ", ".join(invalid)))
+        self.count("parked")
+        if self.parking is not None:
+            self.parking.add(message)
+        return False
+
+    def search(self, **query):
+        """Yields the samples from SENAITE that match with the query, page by
+        page
+        """
+        query.update({
+            "portal_type": "AnalysisRequest",
+            "limit": PAGE_SIZE,
+        })
+        start = 0
+        while True:
+            query["b_start"] = start
+            endpoint = "search?{}".format(urlencode(query, doseq=True))
+            response = self.session.get(endpoint)
+            items = response.get("items") or []
+            for item in items:
+                yield item
+            if not items or not response.get("next"):
+                break
+            start += len(items)
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.SERIAL.CLI.
+#
+# SENAITE.SERIAL.CLI is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2020 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+import time
+from collections import deque
+
+from . import logger
+from .handler import MessageHandler
+from .lis1a import ACK
+from .lis1a import CR
+from .lis1a import CRLF
+from .lis1a import ENQ
+from .lis1a import EOT
+from .lis1a import ETB
+from .lis1a import ETX
+from .lis1a import NAK
+from .lis1a import STX
+
+#: Maximum number of characters of text per frame
+MAX_FRAME_TEXT = 240
+
+#: Maximum number of times a frame is sent before the transfer is aborted
+MAX_ATTEMPTS = 6
+
+#: Time in seconds to wait before a new <ENQ> after a <NAK> reply to <ENQ>
+BUSY_DELAY = 10
+
+#: Time in seconds to wait before a new <ENQ> after a line contention
+CONTENTION_DELAY = 20
+
+#: Time in seconds the sender waits for a reply to <ENQ> or to a frame
+REPLY_TIMEOUT = 15
+
+# Sender states
+NEUTRAL = "neutral"
+ESTABLISHMENT = "establishment"
+TRANSFER = "transfer"
+
+
+def build_frame(fn, text, final=True):
+    """Returns a frame with the given frame number and text, with the
+    checksum computed
+    """
+    end = final and ETX or ETB
+    body = str(fn % 8).encode("ascii") + text + end
+    checksum = "{:02X}".format(sum(bytearray(body)) & 0xFF).encode("ascii")
+    return STX + body + checksum + CRLF
+
+
+def build_frames(records, start_fn=1):
+    """Returns the list of frames to send the records passed-in. Each record
+    is sent as a message, divided in frames of 240 characters at most
+    """
+    frames = []
+    fn = start_fn
+    for record in records:
+        text = record + CR
+        chunks = [text[i:i + MAX_FRAME_TEXT]
+                  for i in range(0, len(text), MAX_FRAME_TEXT)]
+        for num, chunk in enumerate(chunks, 1):
+            frames.append(build_frame(fn, chunk, final=num == len(chunks)))
+            fn += 1
+    return frames
+
+
+class LIS1ASender(MessageHandler):
+    """Sender side of the LIS1-A low-level protocol. Messages (lists of
+    records) are queued and sent to the instrument as soon as the line is in
+    neutral state. All the messages queued by then are sent in the same
+    session. Commands written to the sender are the replies from the
+    instrument, while reading from the sender returns what has to be sent
+    """
+
+    def __init__(self, **kwargs):
+        super(LIS1ASender, self).__init__(**kwargs)
+        self.queue = deque()
+        self.state = NEUTRAL
+        self.frames = []
+        self.index = 0
+        self.attempts = 0
+        self.fn = 1
+        self.wait_until = 0
+        self.last_sent = None
+        self.response = None
+
+    def send(self, records, callback=None):
+        """Queues a message (a list of records) to be sent to the instrument.
+        The callback, if any, is called with whether the message was delivered
+        once all its frames are acknowledged or the transfer is aborted
+        """
+        self.queue.append((records, callback))
+
+    def pop(self, delivered):
+        """Removes the message being transferred from the queue and reports
+        whether it was delivered
+        """
+        records, callback = self.queue.popleft()
+        if callback:
+            callback(delivered)
+
+    def is_active(self):
+        """Returns whether the sender owns the line
+        """
+        return self.state != NEUTRAL
+
+    def is_timeout(self):
+        """Returns whether the reply to the last <ENQ> or frame sent did not
+        arrive within the timeout period
+        """
+        if not self.is_active() or not self.last_sent:
+            return False
+        return time.time() - self.last_sent >= REPLY_TIMEOUT
+
+    def reset(self):
+        """Aborts the current session because of a timeout. The sender enters
+        the termination phase by sending <EOT>
+        """
+        logger.warn("No reply from receiver. Session aborted")
+        if self.state == TRANSFER:
+            # Discard the message being transferred
+            self.pop(False)
+        else:
+            # Receiver did not reply to <ENQ>, try again later
+            self.wait_until = time.time() + BUSY_DELAY
+        self.close()
+        self.response = EOT
+
+    def close(self):
+        """Returns to the neutral state
+        """
+        self.state = NEUTRAL
+        self.frames = []
+        self.index = 0
+        self.attempts = 0
+        self.last_sent = None
+
+    def start(self):
+        """Starts the establishment phase if there is something to send
+        """
+        if not self.queue or time.time() < self.wait_until:
+            return None
+        self.state = ESTABLISHMENT
+        self.attempts = 0
+        self.last_sent = time.time()
+        logger.info("* Sending ... Establishment Phase started")
+        return ENQ
+
+    def load_message(self):
+        """Prepares the frames of the next message from the queue. The frame
+        number keeps incrementing across the messages of the session
+        """
+        self.frames = build_frames(self.queue[0][0], start_fn=self.fn)
+        self.fn += len(self.frames)
+        self.index = 0
+        self.attempts = 1
+
+    def write(self, command):
+        """Handles the reply from the instrument. Returns False if the command
+        is not a reply for the sender
+        """
+        if self.state == ESTABLISHMENT and command == ENQ:
+            # Line contention. The instrument has priority to transmit, so
+            # the host stops trying and waits before its next turn
+            logger.info("Line contention, receiving first")
+            self.close()
+            self.wait_until = time.time() + CONTENTION_DELAY
+            return False
+        elif self.state == ESTABLISHMENT:
+            self.response = self.write_establishment(command)
+        elif self.state == TRANSFER:
+            self.response = self.write_transfer(command)
+        else:
+            return False
+        return True
+
+    def write_establishment(self, command):
+        """Handles the reply of the instrument to the <ENQ>
+        """
+        if command == ACK:
+            logger.info("* Sending ... Transfer Phase started")
+            self.state = TRANSFER
+            self.fn = 1
+            self.load_message()
+            return self.frames[0]
+
+        if command == NAK:
+            # Receiver is busy. Wait before sending another <ENQ>
+            logger.info("Receiver is busy")
+            self.wait_until = time.time() + BUSY_DELAY
+            self.close()
+            return None
+
+        # Ignore all responses other than <ACK>, <NAK> or <ENQ>
+        return None
+
+    def write_transfer(self, command):
+        """Handles the reply of the instrument to a frame
+        """
+        if command == ACK:
+            self.index += 1
+            self.attempts = 1
+            if self.index < len(self.frames):
+                return self.frames[self.index]
+
+            # Message sent. Send the next one within the same session
+            self.pop(True)
+            if self.queue:
+                self.load_message()
+                return self.frames[0]
+
+            logger.info("* Sending ... Transfer Phase completed")
+            self.close()
+            return EOT
+
+        if command == EOT:
+            # Receiver interrupt request. Treated as a plain <ACK>, the
+            # sender may ignore it
+            return self.write_transfer(ACK)
+
+        # <NAK> or any other character. Retransmit the frame
+        if self.attempts >= MAX_ATTEMPTS:
+            logger.error("Frame rejected {} times. Transfer aborted".format(
+                self.attempts))
+            self.pop(False)
+            self.close()
+            return EOT
+
+        self.attempts += 1
+        return self.frames[self.index]
+
+    def read(self):
+        resp = self.response
+        self.response = None
+        if resp and resp != EOT:
+            # Start the timer for the reply
+            self.last_sent = time.time()
+        return resp
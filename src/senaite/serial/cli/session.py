@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.SERIAL.CLI.
+#
+# SENAITE.SERIAL.CLI is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2020 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+import tempfile
+import threading
+
+#: Default maximum size in bytes of the data of a session held in memory
+SPOOL_SIZE = 8 * 1024 * 1024
+
+#: Size in bytes of the chunks read back from a spool
+CHUNK_SIZE = 64 * 1024
+
+
+class SessionState(object):
+    """State of a single communication session (from the establishment phase
+    until the line returns to the neutral state). Slotted, so the memory held
+    by each session is small and predictable
+    """
+
+    __slots__ = (
+        "messages",
+        "in_transfer",
+        "last_communication",
+        "next_fn",
+        "notified",
+        "last_frame",
+        "spool",
+        "header",
+        "patient",
+        "order",
+    )
+
+    def __init__(self):
+        self.spool = None
+        self.reset()
+
+    def reset(self):
+        """Resets the state back to neutral. Containers are replaced rather
+        than cleared in place, so anyone still holding a reference to the
+        messages of the previous session (e.g. a notification thread) is not
+        affected
+        """
+        self.messages = []
+        self.in_transfer = False
+        self.last_communication = None
+        self.next_fn = 1
+        self.notified = 0
+        self.last_frame = None
+        self.header = None
+        self.patient = None
+        self.order = False
+        if self.spool is not None:
+            # Data of a transfer that was not completed
+            self.spool.close()
+        self.spool = None
+
+
+class MemoryBudget(object):
+    """Thread-safe account of the bytes held in memory by the sessions of the
+    process, up to a limit. No limit if set to 0
+    """
+
+    def __init__(self, limit=0):
+        self.limit = limit
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def configure(self, limit):
+        self.limit = limit
+
+    def reserve(self, size):
+        """Accounts the size passed-in. Returns False if the limit would be
+        exceeded
+        """
+        with self._lock:
+            if self.limit and self.used + size > self.limit:
+                return False
+            self.used += size
+            return True
+
+    def release(self, size):
+        with self._lock:
+            self.used -= size
+
+
+class Spool(object):
+    """Data received within a session. Data is kept in memory up to max_size
+    (no limit if 0), or until the memory budget of the process is exhausted,
+    and written to a temporary file afterwards. The file is removed on close
+    """
+
+    def __init__(self, max_size=SPOOL_SIZE, budget=None):
+        self.max_size = max_size
+        self.budget = budget
+        self.size = 0
+        self.spilled = False
+        self._reserved = 0
+        self._file = tempfile.SpooledTemporaryFile(max_size=max_size)
+        self._lock = threading.Lock()
+
+    def write(self, data):
+        with self._lock:
+            if not self.spilled and self.budget is not None:
+                if self.budget.reserve(len(data)):
+                    self._reserved += len(data)
+                else:
+                    self.spill()
+            self._file.write(data)
+            self.size += len(data)
+            if self.max_size and self.size > self.max_size:
+                self.spill()
+
+    def spill(self):
+        """Moves the data to the temporary file
+        """
+        if self.spilled:
+            return
+        self._file.rollover()
+        self.spilled = True
+        self.release()
+
+    @property
+    def closed(self):
+        return self._file.closed
+
+    def release(self):
+        if self.budget is not None and self._reserved:
+            self.budget.release(self._reserved)
+        self._reserved = 0
+
+    def read(self):
+        """Returns all the data written so far
+        """
+        with self._lock:
+            self._file.seek(0)
+            return self._file.read()
+
+    def iter_lines(self, size=CHUNK_SIZE):
+        """Yields the data written so far line by line, each one with the
+        <CR> it ends with. Data is read chunk by chunk, and several readers
+        can iterate at the same time
+        """
+        position = 0
+        pending = b""
+        while True:
+            with self._lock:
+                self._file.seek(position)
+                chunk = self._file.read(size)
+            if not chunk:
+                break
+            position += len(chunk)
+            lines = (pending + chunk).split(b"\r")
+            pending = lines.pop()
+            for line in lines:
+                yield line + b"\r"
+        if pending:
+            yield pending
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+            self.release()
+
+
+class SessionPool(object):
+    """Thread-safe pool of recyclable session states
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._free = []
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Returns a session state in neutral state, either a recycled one or
+        a new one if the pool is empty
+        """
+        with self._lock:
+            if self._free:
+                return self._free.pop()
+        return SessionState()
+
+    def release(self, state):
+        """Gives back the session state to the pool, so it can be reused
+        """
+        state.reset()
+        with self._lock:
+            if len(self._free) < self.maxsize:
+                self._free.append(state)
+
+    def __len__(self):
+        return len(self._free)
+
+
+#: Default pool of session states shared by all handlers of the process
+pool = SessionPool()
+
+#: Memory budget of the sessions of the process
+budget = MemoryBudget()
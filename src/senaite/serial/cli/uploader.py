@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.SERIAL.CLI.
+#
+# SENAITE.SERIAL.CLI is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2020 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+import itertools
+import threading
+import time
+
+try:
+    from Queue import Empty
+    from Queue import PriorityQueue
+except ImportError:
+    from queue import Empty
+    from queue import PriorityQueue
+
+from . import lims
+from . import logger
+from .pipeline import Transfer
+from .ratelimit import AdaptiveConcurrency
+from .records import PRIORITIES
+from .records import get_instrument
+from .records import get_priority
+from .records import to_text
+
+#: Name of the consumer of the push endpoint from senaite.lis2a
+CONSUMER = "senaite.lis2a.import"
+
+#: Rank of the item that tells a worker to stop. Lower than any priority
+STOP = len(PRIORITIES)
+
+
+class Upload(object):
+    """A message to be pushed to SENAITE. The message is either a text, or an
+    iterable of text chunks (a transfer spilled to disk) that is only read
+    as a whole when pushed. The transfer is held until the upload is
+    released
+    """
+
+    __slots__ = ("message", "digest", "duplicate", "priority", "instrument")
+
+    def __init__(self, message, digest=None, duplicate=False):
+        self.message = message
+        self.digest = digest
+        self.duplicate = duplicate
+        self.priority = get_priority(message)
+        self.instrument = get_instrument(message)
+        if isinstance(message, Transfer):
+            message.hold()
+
+    def release(self):
+        if isinstance(self.message, Transfer):
+            self.message.release()
+
+
+class Uploader(object):
+    """Pushes the messages to SENAITE from a pool of worker threads. Messages
+    wait in a priority queue, so STAT messages are pushed first, ASAP messages
+    next and routine messages fill the remaining capacity. Messages with same
+    priority are pushed in turns among instruments, in arrival order. When
+    adaptive, the number of pushes at the same time goes up to the number of
+    workers, depending on the response times of SENAITE. With a batch size,
+    the messages waiting are pushed together, up to that number per request
+    """
+
+    def __init__(self, url, user, password, retries=3, delay=5, workers=4,
+                 index=None, health=None, adaptive=False, samples=None,
+                 batch_size=1):
+        self.url = url
+        self.user = user
+        self.password = password
+        self.retries = retries
+        self.delay = delay
+        self.workers = workers
+        self.index = index
+        self.health = health
+        self.samples = samples
+        self.batch_size = batch_size
+        self.concurrency = None
+        if adaptive:
+            self.concurrency = AdaptiveConcurrency(maximum=workers)
+        self.queue = PriorityQueue()
+        self._counter = itertools.count()
+        self._turns = {}
+        self._current = {}
+        self._lock = threading.Lock()
+        self._threads = []
+        self.stats = {
+            "pushed": 0,
+            "failed": 0,
+            "retries": 0,
+        }
+
+    def start(self):
+        """Starts the worker threads
+        """
+        for num in range(self.workers):
+            thread = threading.Thread(target=self.run)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """Tells the workers to stop once the messages queued are pushed
+        """
+        for thread in self._threads:
+            self.queue.put((STOP, 0, next(self._counter), None))
+
+    def qsize(self):
+        return self.queue.qsize()
+
+    def join(self):
+        """Waits for the workers to stop
+        """
+        for thread in self._threads:
+            thread.join()
+
+    def count(self, key, num=1):
+        with self._lock:
+            self.stats[key] += num
+
+    def put(self, message, digest=None, duplicate=False):
+        """Queues the message (full text) to be pushed to SENAITE
+        """
+        upload = Upload(message, digest=digest, duplicate=duplicate)
+        rank = PRIORITIES.index(upload.priority)
+        with self._lock:
+            # Turn of the instrument within its priority. An instrument that
+            # was idle does not get ahead of the turns already served
+            key = (rank, upload.instrument)
+            turn = max(self._turns.get(key, 0), self._current.get(rank, 0))
+            self._turns[key] = turn + 1
+        self.queue.put((rank, turn, next(self._counter), upload))
+        logger.debug("Queued for push ({}): {} pending, rate limit {}".format(
+            upload.priority, self.qsize(), lims.limiter.levels()))
+
+    def run(self):
+        session = None
+        while True:
+            item = self.queue.get()
+            if item[-1] is None:
+                break
+            items = self.get_batch(item)
+            with self._lock:
+                for rank, turn, count, upload in items:
+                    self._current[rank] = max(self._current.get(rank, 0),
+                                              turn)
+            if session and not self.is_current(session):
+                # SENAITE URL or credentials changed
+                session = None
+            uploads = list(map(lambda i: i[-1], items))
+            try:
+                session = self.push_batch(uploads, session)
+            except Exception:
+                # Keep the worker alive for the messages to come
+                logger.exception("Could not push the messages")
+                self.count("failed", len(uploads))
+                for upload in uploads:
+                    if upload.digest:
+                        self.index.discard(upload.digest)
+                session = None
+            finally:
+                for upload in uploads:
+                    upload.release()
+
+    def get_batch(self, item):
+        """Returns the queue item passed-in, followed by the next ones waiting
+        in the queue up to the batch size. Only messages with the same
+        duplicate flag are pushed together
+        """
+        items = [item]
+        while len(items) < self.batch_size:
+            try:
+                following = self.queue.get_nowait()
+            except Empty:
+                break
+            upload = following[-1]
+            if upload is None or upload.duplicate != item[-1].duplicate:
+                # Keeps its place in the queue
+                self.queue.put(following)
+                break
+            items.append(following)
+        return items
+
+    def configure(self, url=None, user=None, password=None, retries=None,
+                  delay=None):
+        """Changes the settings of the uploader while running. Messages
+        already queued are pushed with the new settings
+        """
+        with self._lock:
+            if url:
+                self.url, self.user, self.password = url, user, password
+            if retries is not None:
+                self.retries = retries
+            if delay is not None:
+                self.delay = delay
+
+    def is_current(self, session):
+        """Returns whether the session was opened with the current URL and
+        credentials
+        """
+        current = (self.url, self.user, self.password)
+        return (session.url, session.username, session.password) == current
+
+    def get_session(self):
+        """Returns a new authenticated session with SENAITE, or None
+        """
+        session = lims.Session(self.url, self.user, self.password)
+        if not session.auth():
+            return None
+        return session
+
+    def push(self, upload, session=None):
+        """Pushes the message to SENAITE, with retries. Returns the session
+        used, to be reused for next pushes
+        """
+        return self.push_batch([upload], session=session)
+
+    def push_batch(self, uploads, session=None):
+        """Pushes the messages to SENAITE in a single request, with retries.
+        Returns the session used, to be reused for next pushes
+        """
+        if self.samples is not None:
+            # Samples not in the local copy are looked up in SENAITE
+            valid = []
+            for upload in uploads:
+                if self.samples.validate(upload.message):
+                    valid.append(upload)
+                elif upload.digest:
+                    self.index.discard(upload.digest)
+            uploads = valid
+        if not uploads:
+            return session
+
+        # Number of retries and delay in seconds between retries
+        retries = self.retries >= 0 and self.retries + 1 or 4
+        delay = self.delay > 0 and self.delay or 5
+
+        # Build the POST payload
+        payload = {
+            "consumer": CONSUMER,
+            "messages": list(map(lambda u: to_text(u.message), uploads)),
+        }
+        if uploads[0].duplicate:
+            payload["duplicate"] = True
+
+        # Try to push messages to SENAITE
+        success = False
+        while retries > 0:
+
+            # Open a session with SENAITE and authenticate
+            if not session:
+                session = self.get_session()
+
+            if session:
+                # Send the message
+                response = {}
+                if self.concurrency is not None:
+                    self.concurrency.acquire()
+                start = time.time()
+                try:
+                    response = session.post("push", payload)
+                finally:
+                    elapsed = time.time() - start
+                    if self.concurrency is not None:
+                        # No response if SENAITE is not reachable
+                        self.concurrency.release(elapsed, bool(response))
+                success = response.get("success")
+                if self.health is not None:
+                    self.health.update(success, elapsed)
+                if success:
+                    break
+                # Authenticate again on next attempt
+                session = None
+
+            elif self.health is not None:
+                # SENAITE not reachable or wrong credentials
+                self.health.update(False)
+
+            # Sleep before we retry
+            time.sleep(delay)
+            retries -= 1
+
+            if retries > 0:
+                self.count("retries")
+                logger.warn("Could not push. Retrying {}/{}".format(
+                    self.retries - retries + 1, self.retries
+                ))
+
+        if not success:
+            self.count("failed", len(uploads))
+            logger.error("Could not push {} message(s)".format(len(uploads)))
+        else:
+            self.count("pushed", len(uploads))
+
+        for upload in uploads:
+            if upload.digest and success:
+                # Keep track of the message, so retransmissions are detected
+                self.index.commit(upload.digest)
+
+            elif upload.digest:
+                # Retransmissions of this message must be pushed
+                self.index.discard(upload.digest)
+
+        return session
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.SERIAL.CLI.
+#
+# SENAITE.SERIAL.CLI is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2020 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+import threading
+import time
+
+try:
+    from urllib import urlencode
+except ImportError:
+    from urllib.parse import urlencode
+
+from . import lims
+from . import logger
+
+#: Review states of the analyses pending of results
+PENDING_STATES = ("unassigned", "assigned")
+
+#: Number of items to fetch per request
+PAGE_SIZE = 500
+
+#: Priority sort key of SENAITE (1 highest, 5 lowest) to ASTM priority
+PRIORITIES = {
+    "1": "S",
+    "2": "A",
+}
+
+
+class Order(object):
+    """Tests pending of results for a given sample
+    """
+
+    __slots__ = ("sample_id", "keywords", "priority")
+
+    def __init__(self, sample_id, priority="R"):
+        self.sample_id = sample_id
+        self.priority = priority
+        self.keywords = {}
+
+    def get_keywords(self):
+        return sorted(set(self.keywords.values()))
+
+
+def get_priority(sort_key):
+    """Returns the ASTM priority (S, A or R) for the priority sort key of a
+    sample or analysis from SENAITE
+    """
+    sort_key = sort_key or ""
+    return PRIORITIES.get(sort_key[:1], "R")
+
+
+class WorklistCache(object):
+    """Local copy of the analyses from SENAITE that are pending of results,
+    grouped by sample. The cache is fully loaded on start and refreshed
+    incrementally afterwards, by fetching the analyses modified since the last
+    refresh only. Lookups never hit SENAITE
+    """
+
+    def __init__(self, url, user, password, interval=60, full_interval=3600):
+        self.session = lims.Session(url, user, password)
+        self.interval = interval
+        self.full_interval = full_interval
+        self._orders = {}
+        self._analyses = {}
+        self._last_modified = ""
+        self._last_full = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def get(self, sample_id):
+        """Returns the order for the given sample id, if any
+        """
+        return self._orders.get(sample_id)
+
+    def get_orders(self):
+        """Returns the list of orders from the worklist
+        """
+        return list(self._orders.values())
+
+    def __len__(self):
+        return len(self._orders)
+
+    def configure(self, url, user, password):
+        """Switches to another SENAITE. The analyses of the previous one are
+        discarded, and all are loaded again on next refresh
+        """
+        with self._lock:
+            self.session = lims.Session(url, user, password)
+            self._orders = {}
+            self._analyses = {}
+            self._last_modified = ""
+            self._last_full = 0
+
+    def start(self):
+        """Loads the cache and keeps it refreshed in a background thread
+        """
+        self.refresh()
+        self._thread = threading.Thread(target=self.run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error("Cannot refresh the worklist: {}".format(e))
+
+    def refresh(self):
+        """Refreshes the cache, either fully or incrementally
+        """
+        if not self.session.session and not self.session.auth():
+            return
+        if time.time() - self._last_full >= self.full_interval:
+            self.refresh_full()
+        else:
+            self.refresh_modified()
+
+    def refresh_full(self):
+        """Reloads all the analyses that are pending of results
+        """
+        orders = {}
+        analyses = {}
+        last_modified = ""
+        for item in self.search(review_state=PENDING_STATES):
+            self.add(item, orders, analyses)
+            last_modified = max(last_modified, item.get("modified") or "")
+
+        with self._lock:
+            self._orders = orders
+            self._analyses = analyses
+            self._last_modified = last_modified
+            self._last_full = time.time()
+        logger.info("Worklist loaded: {} samples".format(len(orders)))
+
+    def refresh_modified(self):
+        """Updates the cache with the analyses modified since last refresh
+        """
+        last_modified = self._last_modified
+        updated = 0
+        with self._lock:
+            for item in self.search(sort_on="modified",
+                                    sort_order="descending"):
+                modified = item.get("modified") or ""
+                if last_modified and modified <= last_modified:
+                    break
+                self._last_modified = max(self._last_modified, modified)
+                if item.get("review_state") in PENDING_STATES:
+                    self.add(item, self._orders, self._analyses)
+                else:
+                    self.remove(item, self._orders, self._analyses)
+                updated += 1
+        logger.debug("Worklist refreshed: {} analyses updated".format(updated))
+
+    def add(self, item, orders, analyses):
+        """Adds the analysis (as returned by the JSON API) to the worklist
+        """
+        uid = item.get("uid")
+        sample_id = item.get("getRequestID")
+        keyword = item.get("getKeyword")
+        if not all([uid, sample_id, keyword]):
+            return
+        order = orders.get(sample_id)
+        if not order:
+            priority = get_priority(item.get("getPrioritySortkey"))
+            order = Order(sample_id, priority=priority)
+            orders[sample_id] = order
+        order.keywords[uid] = keyword
+        analyses[uid] = sample_id
+
+    def remove(self, item, orders, analyses):
+        """Removes the analysis (as returned by the JSON API) from worklist
+        """
+        uid = item.get("uid")
+        sample_id = analyses.pop(uid, None)
+        order = orders.get(sample_id)
+        if not order:
+            return
+        order.keywords.pop(uid, None)
+        if not order.keywords:
+            del orders[sample_id]
+
+    def search(self, **query):
+        """Yields the analyses from SENAITE that match with the query, page
+        by page
+        """
+        query.update({
+            "portal_type": "Analysis",
+            "limit": PAGE_SIZE,
+        })
+        start = 0
+        while True:
+            query["b_start"] = start
+            endpoint = "search?{}".format(urlencode(query, doseq=True))
+            response = self.session.get(endpoint)
+            items = response.get("items") or []
+            for item in items:
+                yield item
+            if not items or not response.get("next"):
+                break
+            start += len(items)
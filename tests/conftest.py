@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.SERIAL.CLI.
+#
+# SENAITE.SERIAL.CLI is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2020 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+import os
+import sys
+
+import pytest
+
+# Run the tests against the sources, without installing the package
+SRC = os.path.join(os.path.dirname(os.path.dirname(__file__)), "src")
+if SRC not in sys.path:
+    sys.path.insert(0, SRC)
+
+
+class FakeUploader(object):
+    """Uploader that keeps the messages queued instead of pushing them
+    """
+
+    def __init__(self):
+        self.messages = []
+        self.settings = {}
+
+    def put(self, message, digest=None, duplicate=False):
+        if hasattr(message, "hold"):
+            # Transfer spilled to disk, kept open to be read afterwards
+            message.hold()
+        self.messages.append((message, digest, duplicate))
+
+    def qsize(self):
+        return 0
+
+    def configure(self, **settings):
+        self.settings.update(settings)
+
+    def stop(self):
+        pass
+
+
+@pytest.fixture
+def uploader():
+    return FakeUploader()
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.SERIAL.CLI.
+#
+# SENAITE.SERIAL.CLI is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2020 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+import multiprocessing
+import os
+
+from senaite.serial.cli.archive import KEY_SIZE
+from senaite.serial.cli.archive import KEYS_NAME
+from senaite.serial.cli.archive import Archive
+
+#: Sample ids that only differ after the size of the index entry fields
+LONG_IDS = [u"S" * KEY_SIZE + u"-1", u"S" * KEY_SIZE + u"-2"]
+
+
+def get_message(instrument, *sample_ids):
+    records = [u"H|\\^&|||{}".format(instrument), u"P|1"]
+    for num, sample_id in enumerate(sample_ids):
+        records.extend([u"O|{}|{}".format(num + 1, sample_id),
+                        u"R|1|^^^GLU|5"])
+    records.append(u"L|1|N")
+    return u"\r".join(records) + u"\r"
+
+
+def test_find_by_key(tmpdir):
+    archive = Archive(str(tmpdir))
+    first = get_message(u"A", u"S1", u"S2")
+    second = get_message(u"B", u"S2")
+    digest = archive.add(first, timestamp=100)
+    archive.add(second, timestamp=200)
+
+    assert [archive.read(e) for e in archive.find(sample_id=u"S2")] == [
+        first, second]
+    assert [archive.read(e) for e in archive.find(instrument=u"B")] == [
+        second]
+    assert [archive.read(e) for e in archive.find(digest=digest)] == [first]
+    assert [archive.read(e) for e in archive.find(sample_id=u"S2",
+                                                  since=150)] == [second]
+    assert len(archive.find(instrument=u"A")) == 1
+    assert archive.find(sample_id=u"S3") == []
+
+
+def test_find_by_long_key(tmpdir):
+    archive = Archive(str(tmpdir))
+    first = get_message(u"A", LONG_IDS[0])
+    second = get_message(u"A", LONG_IDS[1])
+    archive.add(first)
+    archive.add(second)
+
+    entries = archive.find(sample_id=LONG_IDS[1])
+    assert [archive.read(e) for e in entries] == [second]
+    assert entries[0].sample_id == LONG_IDS[1]
+    assert archive.find(sample_id=LONG_IDS[1][:KEY_SIZE]) == []
+
+
+def test_keys_are_indexed_from_the_entries(tmpdir):
+    archive = Archive(str(tmpdir))
+    message = get_message(u"A", u"S1")
+    archive.add(message)
+    os.remove(os.path.join(str(tmpdir), KEYS_NAME))
+
+    archive = Archive(str(tmpdir))
+    assert [archive.read(e) for e in archive.find(sample_id=u"S1")] == [
+        message]
+
+
+def test_find_by_time(tmpdir):
+    archive = Archive(str(tmpdir))
+    first = get_message(u"A", u"S1")
+    second = get_message(u"A", u"S2")
+    archive.add(first, timestamp=1000)
+    archive.add(second, timestamp=2000)
+
+    def find(**kwargs):
+        return [archive.read(e) for e in archive.find(**kwargs)]
+
+    assert find(until=500) == []
+    assert find(since=2500) == []
+    assert find(since=1000, until=1000) == [first]
+    assert find(since=1500) == [second]
+    assert find(until=2000) == [first, second]
+    assert find(since=0, instrument=u"A") == [first, second]
+
+
+def test_find_entries_not_in_time_order(tmpdir):
+    archive = Archive(str(tmpdir))
+    late = get_message(u"A", u"S1")
+    early = get_message(u"A", u"S2")
+    archive.add(late, timestamp=2000)
+    archive.add(early, timestamp=1000)
+
+    assert [archive.read(e) for e in archive.find(until=1500)] == [early]
+    assert [archive.read(e) for e in archive.find(since=1500)] == [late]
+    assert [archive.read(e) for e in archive.find()] == [early, late]
+
+
+def add_messages(path, num):
+    archive = Archive(path, segment_size=1024)
+    for count in range(20):
+        archive.add(get_message(u"P{}".format(num), u"S{}-{}".format(
+            num, count)))
+
+
+def test_archive_shared_by_processes(tmpdir):
+    path = str(tmpdir)
+    processes = list(map(lambda num: multiprocessing.Process(
+        target=add_messages, args=(path, num)), range(4)))
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert all(map(lambda p: p.exitcode == 0, processes))
+
+    archive = Archive(path)
+    entries = archive.find()
+    assert len(entries) == 80
+    for entry in entries:
+        assert archive.read(entry) == get_message(entry.instrument,
+                                                  entry.sample_id)
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.SERIAL.CLI.
+#
+# SENAITE.SERIAL.CLI is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2020 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+import pytest
+
+from senaite.serial.cli.charset import AUTO
+from senaite.serial.cli.charset import Decoder
+from senaite.serial.cli.charset import get_output_encoding
+
+HEADER = u"H|\\^&|||Analyzer\r"
+
+
+def test_auto_decodes_utf8():
+    text = HEADER + u"P|1||||M\xfcller^Jos\xe9\r"
+    assert Decoder(AUTO).decode(text.encode("utf-8")) == text
+
+
+def test_auto_falls_back_to_latin1():
+    data = (HEADER + u"P|1||||Müller\r").encode("latin-1")
+    assert Decoder(AUTO).decode(data) == HEADER + u"P|1||||Müller\r"
+
+
+def test_encoding_of_the_instrument():
+    text = HEADER + u"P|1||||Ærø€\r"
+    assert Decoder("cp1252").decode(text.encode("cp1252")) == text
+    text = HEADER + u"P|1||||山田\r"
+    assert Decoder("shift_jis").decode(text.encode("shift_jis")) == text
+
+
+def test_unknown_encoding_is_rejected():
+    with pytest.raises(ValueError):
+        Decoder("klingon")
+
+
+def test_text_is_normalized():
+    # Accent as a combining character
+    data = (HEADER + u"P|1||||Jose\u0301\r").encode("utf-8")
+    assert Decoder(AUTO).decode(data) == HEADER + u"P|1||||Jos\xe9\r"
+
+
+def test_escape_sequences_are_resolved():
+    decoder = Decoder("utf-8")
+    data = HEADER.encode("ascii") + b"P|1||||Jos&XC3A9&^&H&Bold&N&\r"
+    assert decoder.decode(data) == HEADER + u"P|1||||Jos\xe9^Bold\r"
+
+
+def test_escaped_delimiters_are_kept():
+    data = HEADER.encode("ascii") + b"C|1||A&X7C&B&F&C\r"
+    assert Decoder(AUTO).decode(data) == HEADER + u"C|1||A&X7C&B&F&C\r"
+
+
+def test_lines_are_decoded_with_delimiters_of_header():
+    lines = [b"H!@#$!!!Analyzer\r", b"P!1!!!!Jos$XE9$\r"]
+    decoded = list(Decoder("latin-1").iter_decode(lines))
+    assert decoded == [u"H!@#$!!!Analyzer\r", u"P!1!!!!Jos\xe9\r"]
+
+
+def test_output_encoding():
+    assert get_output_encoding(AUTO) == "latin-1"
+    assert get_output_encoding("cp1252") == "cp1252"
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.SERIAL.CLI.
+#
+# SENAITE.SERIAL.CLI is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2020 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+import os
+import stat
+
+import pytest
+
+from senaite.serial.cli.control import ControlServer
+from senaite.serial.cli.control import Controller
+from senaite.serial.cli.control import send_command
+from senaite.serial.cli.control import to_setting
+from senaite.serial.cli.fakelims import FakeSenaiteServer
+from senaite.serial.cli.lis1a import LIS1AToSenaiteHandler
+from senaite.serial.cli.samples import SampleCache
+from senaite.serial.cli.worklist import WorklistCache
+
+
+@pytest.fixture
+def handler(uploader):
+    handler = LIS1AToSenaiteHandler(None, None, None, uploader=uploader)
+    yield handler
+    handler.release()
+
+
+@pytest.fixture
+def control(tmpdir, handler):
+    path = os.path.join(str(tmpdir), "control.sock")
+    control = ControlServer(path, Controller(handler, "/dev/ttyUSB0"))
+    control.start()
+    yield control
+    control.shutdown()
+    control.server_close()
+
+
+@pytest.fixture
+def server():
+    server = FakeSenaiteServer(("127.0.0.1", 0))
+    server.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def get_full_url(server):
+    host, port = server.server_address[:2]
+    return "http://{}:{}@{}:{}".format(server.user, server.password, host,
+                                       port)
+
+
+def test_settings_are_converted():
+    assert to_setting("retries", "3") == 3
+    assert to_setting("max_requests", "2.5") == 2.5
+    assert to_setting("verbose", "on") is True
+    assert to_setting("verbose", "0") is False
+    with pytest.raises(ValueError):
+        to_setting("port", "/dev/ttyS0")
+
+
+def test_control_socket_is_private(control):
+    mode = stat.S_IMODE(os.stat(control.path).st_mode)
+    assert mode == 0o600
+
+
+def test_commands(control, handler):
+    reply = send_command(control.path, "status")
+    assert reply["success"]
+    assert reply["port"] == "/dev/ttyUSB0"
+    assert not reply["paused"]
+
+    assert send_command(control.path, "pause")["paused"]
+    assert handler.paused
+    assert not send_command(control.path, "resume")["paused"]
+
+    reply = send_command(control.path, "drain 1")
+    assert reply["drained"]
+    assert handler.paused
+
+
+def test_wrong_commands_are_reported(control):
+    for command in ("restart", "set retries", "set port /dev/ttyS0"):
+        reply = send_command(control.path, command)
+        assert not reply["success"]
+        assert reply["message"]
+
+
+def test_set_passes_settings_to_uploader(control, uploader):
+    assert send_command(control.path, "set retries 2")["success"]
+    assert uploader.settings == {"retries": 2}
+
+
+def test_set_url_switches_the_local_copies(server, uploader):
+    samples = SampleCache(server.url, server.user, server.password)
+    worklist = WorklistCache(server.url, server.user, server.password)
+    handler = LIS1AToSenaiteHandler(None, None, None, uploader=uploader,
+                                    samples=samples, worklist=worklist)
+    other = FakeSenaiteServer(("127.0.0.1", 0))
+    other.start()
+    try:
+        controller = Controller(handler, "/dev/ttyUSB0")
+        controller.handle("set url {}".format(get_full_url(other)))
+    finally:
+        handler.release()
+        other.shutdown()
+        other.server_close()
+    assert uploader.settings["url"] == other.url
+    assert samples.session.url == other.url
+    assert worklist.session.url == other.url
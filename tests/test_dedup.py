@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.SERIAL.CLI.
+#
+# SENAITE.SERIAL.CLI is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2020 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+from senaite.serial.cli.dedup import FLAG
+from senaite.serial.cli.dedup import PushIndex
+from senaite.serial.cli.lis1a import LIS1AToSenaiteHandler
+
+MESSAGE = u"\r".join([
+    u"H|\\^&|||Analyzer^1|||||||P|1|20200101000000",
+    u"P|1",
+    u"O|1|S-001||^^^GLU|R",
+    u"R|1|^^^GLU|5.1|mg/dL||N||F",
+    u"L|1|N",
+])
+
+
+def get_handler(uploader, **kwargs):
+    return LIS1AToSenaiteHandler(None, None, None, uploader=uploader,
+                                 **kwargs)
+
+
+def test_empty_index_is_used(uploader):
+    handler = get_handler(uploader, dedup=PushIndex())
+    try:
+        handler.push(MESSAGE)
+        handler.push(MESSAGE)
+    finally:
+        handler.release()
+    assert len(uploader.messages) == 1
+    message, digest, duplicate = uploader.messages[0]
+    assert digest
+    assert not duplicate
+
+
+def test_duplicate_flagged(uploader):
+    handler = get_handler(uploader, dedup=PushIndex(), **{"dedup-mode": FLAG})
+    try:
+        handler.push(MESSAGE)
+        handler.push(MESSAGE)
+    finally:
+        handler.release()
+    assert [m[2] for m in uploader.messages] == [False, True]
+
+
+def test_retransmission_with_new_header_is_duplicate():
+    index = PushIndex()
+    assert index.claim(MESSAGE)
+    retransmitted = MESSAGE.replace(u"20200101000000", u"20200101000500")
+    assert index.claim(retransmitted) is None
+
+
+def test_discarded_digest_can_be_claimed_again():
+    index = PushIndex()
+    digest = index.claim(MESSAGE)
+    index.discard(digest)
+    assert index.claim(MESSAGE) == digest
+
+
+def test_journal_survives_restart(tmpdir):
+    path = str(tmpdir.join("dedup.idx"))
+    index = PushIndex(path)
+    index.commit(index.claim(MESSAGE))
+    index.close()
+
+    index = PushIndex(path)
+    try:
+        assert index.claim(MESSAGE) is None
+    finally:
+        index.close()
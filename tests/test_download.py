@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.SERIAL.CLI.
+#
+# SENAITE.SERIAL.CLI is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2020 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+from senaite.serial.cli.download import OrderDownloader
+from senaite.serial.cli.lis1a import ACK
+from senaite.serial.cli.lis1a import EOT
+from senaite.serial.cli.lis1a import NAK
+from senaite.serial.cli.sender import MAX_ATTEMPTS
+from senaite.serial.cli.sender import LIS1ASender
+from senaite.serial.cli.worklist import Order
+
+
+class Worklist(object):
+    """Stand-in of the worklist cache, with fixed orders
+    """
+
+    def __init__(self, *sample_ids):
+        self.orders = list(map(Order, sample_ids))
+
+    def get_orders(self):
+        return self.orders
+
+
+def get_downloader(*sample_ids):
+    sender = LIS1ASender()
+    return OrderDownloader(Worklist(*sample_ids), sender), sender
+
+
+def test_orders_are_downloaded_once_delivered():
+    downloader, sender = get_downloader(u"S1", u"S2")
+    assert downloader.download() == 2
+
+    # Not downloaded again while in the sender
+    assert downloader.download() == 0
+
+    sender.start()
+    sender.write(ACK)
+    while sender.read() != EOT:
+        sender.write(ACK)
+    assert not sender.queue
+    assert downloader.downloaded == set([u"S1", u"S2"])
+    assert downloader.download() == 0
+
+
+def test_orders_are_downloaded_again_if_aborted():
+    downloader, sender = get_downloader(u"S1", u"S2")
+    assert downloader.download() == 2
+
+    sender.start()
+    sender.write(ACK)
+    for attempt in range(MAX_ATTEMPTS):
+        sender.write(NAK)
+    assert sender.read() == EOT
+    assert not sender.queue
+    assert downloader.downloaded == set()
+    assert downloader.download() == 2
+
+
+def test_orders_are_downloaded_again_on_timeout():
+    downloader, sender = get_downloader(u"S1")
+    assert downloader.download() == 1
+
+    sender.start()
+    sender.write(ACK)
+    sender.reset()
+    assert downloader.downloaded == set()
+    assert downloader.download() == 1
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.SERIAL.CLI.
+#
+# SENAITE.SERIAL.CLI is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2020 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+import io
+import json
+import os
+import time
+
+from senaite.serial.cli.export import CSV
+from senaite.serial.cli.export import PARTIAL_SUFFIX
+from senaite.serial.cli.export import Exporter
+
+
+def get_message(sample_id):
+    records = [u"H|\\^&|||Analyzer", u"P|1", u"O|1|{}".format(sample_id),
+               u"R|1|^^^GLU|5|mg/dL||N||F", u"R|2|^^^ALB|4|g/dL||N||F",
+               u"L|1|N"]
+    return u"\r".join(records) + u"\r"
+
+
+def get_files(path, suffix=""):
+    return sorted(filter(lambda n: n.endswith(suffix), os.listdir(path)))
+
+
+def read_rows(path, name):
+    with io.open(os.path.join(path, name), encoding="utf-8") as f:
+        return list(map(json.loads, f))
+
+
+def test_writes_are_buffered(tmpdir):
+    path = str(tmpdir)
+    exporter = Exporter(path)
+    assert exporter.write(get_message(u"S1")) == 2
+    partial = get_files(path, PARTIAL_SUFFIX)
+    assert len(partial) == 1
+    assert os.path.getsize(os.path.join(path, partial[0])) == 0
+
+    exporter.stop()
+    names = get_files(path)
+    assert len(names) == 1 and not names[0].endswith(PARTIAL_SUFFIX)
+    rows = read_rows(path, names[0])
+    assert [(r["sample_id"], r["code"]) for r in rows] == [
+        (u"S1", u"GLU"), (u"S1", u"ALB")]
+
+
+def test_rotation_by_size(tmpdir):
+    path = str(tmpdir)
+    exporter = Exporter(path, max_size=1)
+    exporter.write(get_message(u"S1"))
+    exporter.write(get_message(u"S2"))
+
+    # Each file is rotated once it reaches the maximum size
+    names = get_files(path)
+    assert len(names) == 2
+    assert not get_files(path, PARTIAL_SUFFIX)
+    sample_ids = map(lambda n: [r["sample_id"] for r in read_rows(path, n)],
+                     names)
+    assert sorted(sample_ids) == [[u"S1", u"S1"], [u"S2", u"S2"]]
+    exporter.stop()
+
+
+def test_rotation_by_time(tmpdir):
+    path = str(tmpdir)
+    exporter = Exporter(path, fmt=CSV, interval=60)
+    exporter.write(get_message(u"S1"))
+    assert not get_files(path, ".csv")
+
+    # Interval elapsed, the file is rotated before the next write
+    exporter._opened = time.time() - 60
+    exporter.write(get_message(u"S2"))
+    complete = get_files(path, ".csv")
+    assert len(complete) == 1
+    with io.open(os.path.join(path, complete[0]), encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    assert len(lines) == 3
+    assert lines[0].startswith(u'"instrument","sample_id"')
+    assert u'"S1"' in lines[1]
+    exporter.stop()
+    assert len(get_files(path, ".csv")) == 2
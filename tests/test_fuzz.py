@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.SERIAL.CLI.
+#
+# SENAITE.SERIAL.CLI is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2020 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+import pytest
+
+from senaite.serial.cli.fuzz import Fuzzer
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_fuzz(seed):
+    fuzzer = Fuzzer(seed=seed)
+    assert fuzzer.run(100) == []
+    results = fuzzer.get_results()
+    assert results["delivered"] > 0
+    assert sum(map(lambda key: results[key],
+                   ("delivered", "aborted", "adversarial"))) == 100
+
+
+def test_fuzz_faulty_line():
+    # Frames rejected often enough for some transfers to be aborted
+    fuzzer = Fuzzer(seed=0, corruption=0.6, noise=0.2)
+    assert fuzzer.run(100) == []
+    assert fuzzer.get_results()["aborted"] > 0
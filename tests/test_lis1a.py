@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.SERIAL.CLI.
+#
+# SENAITE.SERIAL.CLI is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2020 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+import pytest
+
+from senaite.serial.cli.fuzz import FuzzHandler
+from senaite.serial.cli.lis1a import ACK
+from senaite.serial.cli.lis1a import ENQ
+from senaite.serial.cli.lis1a import EOT
+from senaite.serial.cli.lis1a import NAK
+from senaite.serial.cli.records import get_records
+from senaite.serial.cli.session import SessionPool
+
+from .utils import get_frames
+from .utils import send
+from .utils import transmit
+
+HEADER = u"H|\\^&|||Analyzer"
+
+#: Message with a Result record long enough to be sent in several frames
+MESSAGE = [HEADER, u"P|1", u"O|1|S1", u"R|1|^^^GLU|" + u"5" * 500, u"L|1|N"]
+
+
+@pytest.fixture
+def handler():
+    handler = FuzzHandler()
+    yield handler
+    handler.release()
+
+
+def get_notified(handler):
+    records = []
+    for message in handler.notified:
+        records.extend(get_records(message))
+    return records
+
+
+def corrupt(frame):
+    """Returns the frame with a character of the text changed, so the
+    checksum does not match
+    """
+    pos = len(frame) // 2
+    char = frame[pos:pos + 1] == b"x" and b"y" or b"x"
+    return frame[:pos] + char + frame[pos + 1:]
+
+
+def test_message_in_several_frames(handler):
+    frames = get_frames(MESSAGE)
+    assert len(frames) > len(MESSAGE)
+    assert send(handler, frames) == [ACK] * len(frames)
+    assert get_notified(handler) == MESSAGE
+
+
+def test_frame_with_wrong_checksum_is_rejected(handler):
+    frames = get_frames(MESSAGE)
+    transmit(handler, ENQ)
+    for frame in frames:
+        assert transmit(handler, corrupt(frame)) == [NAK]
+        assert transmit(handler, frame) == [ACK]
+    transmit(handler, EOT)
+    assert get_notified(handler) == MESSAGE
+
+
+def test_retransmitted_frame_is_ignored(handler):
+    frames = get_frames(MESSAGE)
+    transmit(handler, ENQ)
+    for frame in frames:
+        # Reply to the frame lost, so the sender transmits it again
+        assert transmit(handler, frame) == [ACK]
+        assert transmit(handler, frame) == [ACK]
+    transmit(handler, EOT)
+    assert get_notified(handler) == MESSAGE
+
+
+def test_frame_out_of_sequence_is_rejected(handler):
+    frames = get_frames(MESSAGE)
+    transmit(handler, ENQ)
+    assert transmit(handler, frames[0]) == [ACK]
+    assert transmit(handler, frames[2]) == [NAK]
+    for frame in frames[1:]:
+        assert transmit(handler, frame) == [ACK]
+    transmit(handler, EOT)
+    assert get_notified(handler) == MESSAGE
+
+
+def test_frame_outside_transfer_is_rejected(handler):
+    frames = get_frames(MESSAGE)
+    assert transmit(handler, frames[0]) == [NAK]
+    assert handler.notified == []
+
+
+def test_aborted_transfer_is_not_notified_partially(handler):
+    frames = get_frames(MESSAGE)
+    transmit(handler, ENQ)
+    # Interrupted within the frames of the Result record
+    for frame in frames[:4]:
+        assert transmit(handler, frame) == [ACK]
+    transmit(handler, EOT)
+    assert all(map(lambda r: r in MESSAGE, get_notified(handler)))
+
+
+def test_stream_waits_for_last_frame_of_terminator():
+    # Terminator record sent in two frames
+    terminator = u"L|1|N|" + u"x" * 300
+    first = [HEADER, u"P|1", u"O|1|S1", terminator]
+    second = [HEADER, u"P|1", u"O|1|S2", u"L|1|N"]
+    frames = get_frames(first, second)
+    handler = FuzzHandler(stream=True)
+    try:
+        replies = send(handler, frames)
+    finally:
+        handler.release()
+    assert replies == [ACK] * len(frames)
+    assert len(handler.notified) == 2
+    assert get_records(handler.notified[0]) == first
+    assert get_records(handler.notified[1]) == second
+
+
+def test_handler_uses_pool_passed_in():
+    pool = SessionPool()
+    handler = FuzzHandler(pool=pool)
+    send(handler, get_frames(MESSAGE))
+    handler.release()
+    assert len(pool) == 1
+
+
+def test_session_state_is_taken_for_the_transfer_only():
+    pool = SessionPool()
+    handlers = [FuzzHandler(pool=pool), FuzzHandler(pool=pool)]
+    assert len(pool) == 0
+
+    # Taken on <ENQ> and given back on <EOT>
+    transmit(handlers[0], ENQ)
+    state = handlers[0].state
+    assert state is not None
+    send(handlers[1], get_frames(MESSAGE))
+    assert len(pool) == 1
+    for frame in get_frames(MESSAGE):
+        transmit(handlers[0], frame)
+    transmit(handlers[0], EOT)
+    assert handlers[0].state is None
+    assert len(pool) == 2
+
+    # Given back on timeout
+    transmit(handlers[1], ENQ)
+    handlers[1].last_communication -= 60
+    assert handlers[1].is_timeout()
+    handlers[1].reset()
+    assert handlers[1].state is None
+    assert not handlers[1].in_transfer
+    assert len(pool) == 2
+
+    for handler in handlers:
+        handler.release()
+    assert len(pool) == 2
+    assert get_notified(handlers[0]) == MESSAGE
+
+
+def test_stream_notifies_each_order_before_terminator():
+    message = [HEADER, u"P|1", u"O|1|S1", u"R|1|^^^GLU|5", u"C|1",
+               u"O|2|S2", u"R|1|^^^GLU|6", u"P|2", u"O|1|S3",
+               u"R|1|^^^GLU|" + u"7" * 500, u"L|1|N"]
+    frames = get_frames(message)
+    handler = FuzzHandler(stream=True)
+    try:
+        transmit(handler, ENQ)
+        for frame in frames[:7]:
+            assert transmit(handler, frame) == [ACK]
+        # First order is notified as soon as the second one starts
+        assert len(handler.notified) == 1
+        for frame in frames[7:]:
+            assert transmit(handler, frame) == [ACK]
+        transmit(handler, EOT)
+    finally:
+        handler.release()
+    assert len(handler.notified) == 3
+    terminator = u"L|1|N"
+    assert get_records(handler.notified[0]) == message[:5] + [terminator]
+    assert get_records(handler.notified[1]) == \
+        [HEADER, u"P|1"] + message[5:7] + [terminator]
+    assert get_records(handler.notified[2]) == [HEADER] + message[7:]
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.SERIAL.CLI.
+#
+# SENAITE.SERIAL.CLI is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2020 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+import threading
+import time
+
+from senaite.serial.cli.lis1a import ACK
+from senaite.serial.cli.lis1a import LIS1AHandler
+from senaite.serial.cli.pipeline import Pipeline
+from senaite.serial.cli.pipeline import Stage
+
+from .utils import get_frames
+from .utils import send
+
+
+def test_put_never_waits():
+    release = threading.Event()
+    processed = []
+
+    def process(item):
+        release.wait(5)
+        processed.append(item)
+
+    pipeline = Pipeline([Stage("slow", process, maxsize=1)])
+    pipeline.start()
+    start = time.time()
+    results = list(map(pipeline.put, range(5)))
+    assert time.time() - start < 1
+    assert results[-1] is False
+    assert pipeline.is_full()
+    assert pipeline.get_backlog() > 0
+
+    release.set()
+    pipeline.stop()
+    assert processed == list(range(5))
+    assert pipeline.get_backlog() == 0
+    assert not pipeline.is_full()
+
+
+class SlowHandler(LIS1AHandler):
+
+    def __init__(self, **kwargs):
+        super(SlowHandler, self).__init__(**kwargs)
+        self.resume = threading.Event()
+        self.notified = []
+
+    def notify(self, message):
+        self.resume.wait(5)
+        self.notified.append(message)
+
+
+def test_stream_frames_acknowledged_with_full_pipeline():
+    messages = [[u"H|\\^&|||A", u"P|1", u"O|1|S{}".format(num), u"L|1|N"]
+                for num in range(6)]
+    handler = SlowHandler(stream=True, pipeline=1)
+    try:
+        start = time.time()
+        replies = send(handler, get_frames(*messages))
+        assert time.time() - start < 1
+        assert replies == [ACK] * 24
+
+        # No new transfers while the pipeline is full
+        assert handler.is_busy()
+        handler.resume.set()
+    finally:
+        handler.release()
+    assert handler.notified == list(map(
+        lambda m: u"\r\r\n".join(m) + u"\r", messages))
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.SERIAL.CLI.
+#
+# SENAITE.SERIAL.CLI is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2020 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+from senaite.serial.cli.link import get_link_profile
+from senaite.serial.cli.lis1a import CHECKSUM_ERROR
+from senaite.serial.cli.quality import APPLY
+from senaite.serial.cli.quality import LineMonitor
+
+
+class Port(object):
+    """Stand-in of the serial port, with the settings applied
+    """
+
+
+def receive(monitor, frames, errors):
+    """Adds the outcome of the frames, one in every errors with a checksum
+    error. No errors if set to 0
+    """
+    for num in range(frames):
+        error = errors and num % errors == 0 and CHECKSUM_ERROR or None
+        monitor.add_frame(error)
+
+
+def get_monitor(**kwargs):
+    profile = get_link_profile("default")
+    return LineMonitor("/dev/ttyS0", profile, mode=APPLY, **kwargs)
+
+
+def degrade(monitor, port):
+    """Degrades the line, so a lower baud rate is applied to the port
+    """
+    receive(monitor, 200, 5)
+    monitor.poll(port)
+    assert port.baudrate == 4800
+    assert monitor.profile.baudrate == 4800
+
+
+def test_change_kept_if_line_improves():
+    monitor = get_monitor()
+    port = Port()
+    degrade(monitor, port)
+    receive(monitor, 200, 0)
+    monitor.poll(port)
+    assert port.baudrate == 4800
+    assert monitor.to_dict()["changes"] == 1
+
+
+def test_change_reverted_if_line_does_not_improve():
+    monitor = get_monitor()
+    port = Port()
+    degrade(monitor, port)
+    receive(monitor, 200, 5)
+    monitor.poll(port)
+    assert port.baudrate == 9600
+    assert monitor.profile.baudrate == 9600
+
+
+def test_change_reverted_if_traffic_stops():
+    monitor = get_monitor(trial_timeout=0)
+    port = Port()
+    degrade(monitor, port)
+    # Nothing received since the change
+    monitor.poll(port)
+    assert port.baudrate == 9600
+    assert monitor.profile.baudrate == 9600
+
+
+def test_change_judged_on_partial_window_after_trial():
+    monitor = get_monitor(trial_timeout=0)
+    port = Port()
+    degrade(monitor, port)
+    receive(monitor, 60, 0)
+    monitor.poll(port)
+    assert port.baudrate == 4800
+
+
+def test_change_not_reverted_before_trial_is_over():
+    monitor = get_monitor(trial_timeout=3600)
+    port = Port()
+    degrade(monitor, port)
+    monitor.poll(port)
+    assert port.baudrate == 4800
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.SERIAL.CLI.
+#
+# SENAITE.SERIAL.CLI is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2020 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+from senaite.serial.cli.fuzz import FuzzHandler
+from senaite.serial.cli.query import QueryResponder
+from senaite.serial.cli.query import get_query_ids
+from senaite.serial.cli.query import is_query
+from senaite.serial.cli.records import get_records
+from senaite.serial.cli.sender import LIS1ASender
+from senaite.serial.cli.worklist import Order
+
+from .utils import get_frames
+from .utils import send
+
+HEADER = u"H|\\^&|||Analyzer"
+
+
+class Worklist(object):
+    """Stand-in of the worklist cache, with an order per sample id
+    """
+
+    def __init__(self, **keywords):
+        self.orders = {}
+        for sample_id, keyword in keywords.items():
+            order = Order(sample_id, priority=u"S")
+            order.keywords[u"uid-" + sample_id] = keyword
+            self.orders[sample_id] = order
+
+    def get(self, sample_id):
+        return self.orders.get(sample_id)
+
+
+def get_query(*ranges):
+    records = [HEADER]
+    for num, value in enumerate(ranges, 1):
+        records.append(u"Q|{}|{}||||||||||O".format(num, value))
+    records.append(u"L|1|N")
+    return records
+
+
+def test_query_ids():
+    message = u"\r".join(get_query(u"^S1", u"P1^S2\\^S3", u"ALL")) + u"\r"
+    assert is_query(message)
+    assert get_query_ids(message) == [u"S1", u"S2", u"S3"]
+
+
+def test_query_ids_are_unescaped():
+    message = u"\r".join(get_query(u"^S&F&1")) + u"\r"
+    assert get_query_ids(message) == [u"S|1"]
+
+
+def test_message_without_query():
+    message = u"\r".join([HEADER, u"P|1", u"O|1|S1", u"L|1|N"]) + u"\r"
+    assert not is_query(message)
+    assert get_query_ids(message) == []
+
+
+def test_reply_with_orders_found():
+    responder = QueryResponder(Worklist(S1=u"GLU", S2=u"CHOL"))
+    message = u"\r".join(get_query(u"^S1\\^S3", u"^S2")) + u"\r"
+    records = list(map(lambda r: r.decode("latin-1"),
+                       responder.get_reply(message)))
+    assert records[0].startswith(u"H|\\^&|||SENAITE")
+    assert records[1:] == [
+        u"P|1", u"O|1|S1||^^^GLU|S||||||N||||||||||||||Q",
+        u"P|2", u"O|1|S2||^^^CHOL|S||||||N||||||||||||||Q",
+        u"L|1|N",
+    ]
+
+
+def test_reply_without_orders():
+    responder = QueryResponder(Worklist())
+    message = u"\r".join(get_query(u"^S1")) + u"\r"
+    records = responder.get_reply(message)
+    assert len(records) == 2
+    assert records[-1] == b"L|1|I"
+
+
+def test_query_is_answered_not_notified():
+    sender = LIS1ASender()
+    responder = QueryResponder(Worklist(S1=u"GLU"))
+    handler = FuzzHandler(sender=sender, responder=responder)
+    try:
+        send(handler, get_frames(get_query(u"^S1")))
+        send(handler, get_frames([HEADER, u"P|1", u"O|1|S1", u"L|1|N"]))
+    finally:
+        handler.release()
+    assert len(sender.queue) == 1
+    assert len(handler.notified) == 1
+    assert get_records(handler.notified[0])[2] == u"O|1|S1"
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.SERIAL.CLI.
+#
+# SENAITE.SERIAL.CLI is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2020 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+import threading
+import time
+
+from senaite.serial.cli.ratelimit import AdaptiveConcurrency
+from senaite.serial.cli.ratelimit import RateLimiter
+from senaite.serial.cli.ratelimit import TokenBucket
+
+
+def test_no_limit():
+    bucket = TokenBucket(0)
+    assert bucket.consume(1000) == 0
+    assert bucket.level() == 1.0
+
+
+def test_bucket_starts_full():
+    bucket = TokenBucket(10)
+    assert bucket.capacity == 10
+    start = time.time()
+    for i in range(10):
+        assert bucket.consume() == 0
+    assert time.time() - start < 0.1
+    assert bucket.level() < 0.1
+
+
+def test_waits_for_tokens():
+    bucket = TokenBucket(20, capacity=1)
+    bucket.consume()
+    start = time.time()
+    waited = bucket.consume()
+    assert 0.02 < waited < 0.1
+    assert time.time() - start >= 0.02
+
+
+def test_large_amount_leaves_bucket_in_debt():
+    bucket = TokenBucket(100, capacity=10)
+    assert bucket.consume(30) == 0
+    assert bucket.level() == 0
+    # The debt is paid before the next request
+    assert bucket.consume(1) > 0.15
+
+
+def test_limiter_counts_requests_and_bytes():
+    limiter = RateLimiter(requests=0, nbytes=100)
+    assert limiter.acquire(size=100) == 0
+    assert limiter.acquire(size=50) > 0.3
+    assert limiter.levels()["requests"] == 1.0
+
+    # Changed while running
+    limiter.configure(requests=0, nbytes=0)
+    assert limiter.acquire(size=10 ** 6) == 0
+    assert limiter.levels() == {"requests": 1.0, "bytes": 1.0}
+
+
+def send(concurrency, num=1, elapsed=0.01, success=True):
+    """Sends num requests with the outcome passed-in, keeping as many in
+    flight as the limit allows. The requests in flight are released at the
+    end
+    """
+    for i in range(num):
+        while concurrency.inflight < int(concurrency.limit):
+            concurrency.acquire()
+        concurrency.release(elapsed, success=success)
+    while concurrency.inflight:
+        concurrency.release(elapsed, success=success)
+
+
+def test_concurrency_slow_start():
+    concurrency = AdaptiveConcurrency(maximum=8)
+    assert concurrency.limit == 1
+    # One more per request until the first overload
+    send(concurrency, num=4)
+    assert concurrency.limit == 5
+    send(concurrency, num=10)
+    assert concurrency.limit == 8
+
+
+def test_concurrency_grows_only_when_held_back():
+    concurrency = AdaptiveConcurrency(maximum=8)
+    for i in range(5):
+        concurrency.acquire()
+        concurrency.release(0.01)
+    assert concurrency.limit == 2
+
+
+def test_concurrency_cut_down_on_failure():
+    concurrency = AdaptiveConcurrency(maximum=8)
+    send(concurrency, num=7)
+    assert concurrency.limit == 8
+    # Once per round of requests
+    send(concurrency, num=3, elapsed=10, success=False)
+    assert concurrency.limit == 6
+    assert not concurrency.slow_start
+    assert concurrency.stats["overloads"] == 1
+
+
+def test_concurrency_cut_down_on_high_latency():
+    concurrency = AdaptiveConcurrency(maximum=4, tolerance=3)
+    send(concurrency, elapsed=0.01)
+    assert concurrency.limit == 2
+    send(concurrency, elapsed=1.0)
+    assert concurrency.limit == 1.5
+    assert concurrency.stats["overloads"] == 1
+    assert concurrency.to_dict()["baseline"] == 0.01
+
+
+def test_concurrency_additive_increase():
+    concurrency = AdaptiveConcurrency(maximum=8)
+    concurrency.slow_start = False
+    concurrency.limit = 4.0
+    # About one more per round of requests
+    send(concurrency, num=4)
+    assert 4.9 < concurrency.limit < 5
+    send(concurrency, num=1)
+    assert int(concurrency.limit) == 5
+
+
+def test_concurrency_waits_below_limit():
+    concurrency = AdaptiveConcurrency(maximum=1)
+    concurrency.acquire()
+    acquired = threading.Event()
+
+    def request():
+        concurrency.acquire()
+        acquired.set()
+
+    thread = threading.Thread(target=request)
+    thread.start()
+    assert not acquired.wait(0.1)
+    concurrency.release(0.01)
+    assert acquired.wait(1)
+    thread.join()
+    assert concurrency.inflight == 1
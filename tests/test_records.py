@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.SERIAL.CLI.
+#
+# SENAITE.SERIAL.CLI is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2020 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+from senaite.serial.cli.records import get_records
+from senaite.serial.cli.records import split_message
+
+
+def get_message(*records):
+    return u"\r".join(records) + u"\r"
+
+
+def test_message_without_orders_is_not_split():
+    message = get_message(u"H|\\^&|||A", u"P|1", u"L|1|N")
+    assert split_message(message) == [message]
+
+
+def test_message_with_one_order_is_not_split():
+    message = get_message(u"H|\\^&|||A", u"P|1", u"O|1|S1", u"R|1|^^^GLU",
+                          u"L|1|N")
+    assert split_message(message) == [message]
+
+
+def test_split_per_order():
+    message = get_message(u"H|\\^&|||A",
+                          u"P|1|PID1",
+                          u"O|1|S1", u"R|1|^^^GLU|5",
+                          u"O|2|S2", u"R|1|^^^GLU|6", u"C|1|I|Hemolyzed",
+                          u"P|2|PID2",
+                          u"O|1|S3", u"R|1|^^^GLU|7",
+                          u"L|1|N")
+    units = split_message(message)
+    assert units == [
+        get_message(u"H|\\^&|||A", u"P|1|PID1", u"O|1|S1",
+                    u"R|1|^^^GLU|5", u"L|1|N"),
+        get_message(u"H|\\^&|||A", u"P|1|PID1", u"O|1|S2",
+                    u"R|1|^^^GLU|6", u"C|1|I|Hemolyzed", u"L|1|N"),
+        get_message(u"H|\\^&|||A", u"P|1|PID2", u"O|1|S3",
+                    u"R|1|^^^GLU|7", u"L|1|N"),
+    ]
+
+
+def test_split_transfer_with_several_messages():
+    message = get_message(u"H|\\^&|||A", u"P|1", u"O|1|S1", u"R|1|^^^GLU|5",
+                          u"L|1|N",
+                          u"H!\\^&!!!B", u"P!1", u"O!1!S2", u"R!1!^^^K!4",
+                          u"O!2!S3", u"L!1!F")
+    units = split_message(message)
+    assert units == [
+        get_message(u"H|\\^&|||A", u"P|1", u"O|1|S1", u"R|1|^^^GLU|5",
+                    u"L|1|N"),
+        get_message(u"H!\\^&!!!B", u"P!1", u"O!1!S2", u"R!1!^^^K!4",
+                    u"L!1!F"),
+        get_message(u"H!\\^&!!!B", u"P!1", u"O!1!S3", u"L!1!F"),
+    ]
+    for unit in units:
+        records = get_records(unit)
+        assert [r[:1] for r in records].count(u"H") == 1
+        assert records[-1][:1] == u"L"
+
+
+def test_message_without_orders_kept_in_transfer():
+    message = get_message(u"H|\\^&|||A", u"L|1|N",
+                          u"H|\\^&|||B", u"P|1", u"O|1|S1", u"L|1|N")
+    assert split_message(message) == [
+        get_message(u"H|\\^&|||A", u"L|1|N"),
+        get_message(u"H|\\^&|||B", u"P|1", u"O|1|S1", u"L|1|N"),
+    ]
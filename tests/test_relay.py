@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.SERIAL.CLI.
+#
+# SENAITE.SERIAL.CLI is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2020 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+import os
+import stat
+import tempfile
+import threading
+
+import pytest
+
+from senaite.serial.cli import relay
+from senaite.serial.cli.relay import RelayClient
+from senaite.serial.cli.relay import RelayServer
+
+MESSAGE = u"H|\\^&|||A\rL|1|N\r"
+
+
+@pytest.fixture
+def server(tmpdir, uploader):
+    server = RelayServer(str(tmpdir.join("uploader.sock")), uploader)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_socket_private(server):
+    mode = stat.S_IMODE(os.stat(server.path).st_mode)
+    assert mode == 0o600
+
+
+def test_message_relayed(server, uploader):
+    client = RelayClient(server.path, delay=0.01)
+    client.start()
+    client.put(MESSAGE)
+    client.stop()
+    client.join()
+    assert uploader.messages == [(MESSAGE, None, False)]
+
+
+def test_client_stops_without_uploader(tmpdir):
+    client = RelayClient(str(tmpdir.join("missing.sock")), delay=0.01)
+    client.start()
+    client.put(MESSAGE)
+    client.put(MESSAGE)
+    client.stop()
+    client._thread.join(5)
+    assert not client._thread.is_alive()
+    # Without spool, left in memory
+    assert client.qsize() == 2
+
+
+def get_messages(count):
+    return list(map(lambda num: MESSAGE.replace(u"A", u"A{}".format(num)),
+                    range(count)))
+
+
+def test_messages_sent_in_batches(server, uploader):
+    batches = []
+
+    class Client(RelayClient):
+        def send(self, messages):
+            batches.append(len(messages))
+            return super(Client, self).send(messages)
+
+    messages = get_messages(5)
+    client = Client(server.path, delay=0.01, batch_size=3)
+    for message in messages:
+        client.put(message)
+    client.start()
+    client.stop()
+    client.join()
+    assert batches == [3, 2]
+    assert list(map(lambda m: m[0], uploader.messages)) == messages
+
+
+def test_messages_spooled_until_uploader_available(tmpdir, server, uploader):
+    spool = str(tmpdir.join("spool"))
+    messages = get_messages(5)
+    client = RelayClient(str(tmpdir.join("missing.sock")), spool=spool,
+                         delay=0.01, maxsize=2)
+    client.start()
+    for message in messages:
+        client.put(message)
+    # Messages beyond the maximum are written to the spool
+    assert len(client.queue) <= 2
+    client.stop()
+    client.join()
+    # Messages in memory are spooled on stop
+    assert len(client.queue) == 0
+    assert len(os.listdir(spool)) == 5
+
+    client = RelayClient(server.path, spool=spool, delay=0.01)
+    assert client.qsize() == 5
+    client.start()
+    client.put(MESSAGE)
+    client.stop()
+    client.join()
+    assert os.listdir(spool) == []
+    assert list(map(lambda m: m[0], uploader.messages)) == messages + [
+        MESSAGE]
+
+
+def test_default_socket_in_runtime_dir(monkeypatch, tmpdir):
+    monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmpdir))
+    assert relay.get_runtime_dir() == str(tmpdir)
+    monkeypatch.delenv("XDG_RUNTIME_DIR")
+    path = relay.get_runtime_dir()
+    assert os.path.dirname(path) == tempfile.gettempdir()
+    assert str(os.getuid()) in os.path.basename(path)
+
+
+def test_private_dir(tmpdir):
+    path = str(tmpdir.join("run"))
+    relay.make_private_dir(path)
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o700
+    os.chmod(path, 0o777)
+    with pytest.raises(ValueError):
+        relay.make_private_dir(path)
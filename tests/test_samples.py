@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.SERIAL.CLI.
+#
+# SENAITE.SERIAL.CLI is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2020 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+import pytest
+
+from senaite.serial.cli.fakelims import FakeSenaiteServer
+from senaite.serial.cli.lis1a import LIS1AToSenaiteHandler
+from senaite.serial.cli.samples import SampleCache
+from senaite.serial.cli.uploader import Upload
+from senaite.serial.cli.uploader import Uploader
+
+
+def get_message(*sample_ids):
+    records = [u"H|\\^&|||A", u"P|1"]
+    for num, sample_id in enumerate(sample_ids):
+        records.append(u"O|{}|{}".format(num + 1, sample_id))
+    records.append(u"L|1|N")
+    return u"\r".join(records) + u"\r"
+
+
+class Parking(object):
+
+    def __init__(self):
+        self.messages = []
+
+    def add(self, message):
+        self.messages.append(message)
+
+
+@pytest.fixture
+def server():
+    server = FakeSenaiteServer(("127.0.0.1", 0))
+    server.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def samples(server):
+    return SampleCache(server.url, server.user, server.password,
+                       parking=Parking())
+
+
+def test_empty_cache_is_used(samples, uploader):
+    assert len(samples) == 0
+    handler = LIS1AToSenaiteHandler(None, None, None, uploader=uploader,
+                                    samples=samples)
+    try:
+        assert handler._samples is samples
+        assert "samples" in handler.get_status()
+    finally:
+        handler.release()
+
+
+def test_serial_path_checks_the_cache_only(server, samples, uploader):
+    handler = LIS1AToSenaiteHandler(None, None, None, uploader=uploader,
+                                    samples=samples)
+    try:
+        # Unknown locally: queued, the uploader looks it up
+        requests = server.stats["requests"]
+        handler.push(get_message(u"S-1"))
+        assert server.stats["requests"] == requests
+        assert len(uploader.messages) == 1
+
+        # Known to be closed: parked right away
+        samples.add({"getId": u"S-2", "review_state": u"published"})
+        handler.push(get_message(u"S-2"))
+        assert len(uploader.messages) == 1
+        assert samples.parking.messages == [get_message(u"S-2")]
+    finally:
+        handler.release()
+
+
+def test_uploader_looks_up_unknown_samples(server, samples):
+    server.add_sample(u"S-1")
+    uploader = Uploader(server.url, server.user, server.password,
+                        retries=0, delay=0.01, samples=samples)
+    session = uploader.push(Upload(get_message(u"S-1")))
+    session = uploader.push(Upload(get_message(u"S-9")), session)
+    assert server.messages == [get_message(u"S-1")]
+    assert samples.parking.messages == [get_message(u"S-9")]
+    assert samples.to_dict()["parked"] == 1
+    assert samples.get_state(u"S-9", lookup=False) == u""
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.SERIAL.CLI.
+#
+# SENAITE.SERIAL.CLI is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2020 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+import time
+
+from senaite.serial.cli.archive import Archive
+from senaite.serial.cli.charset import Decoder
+from senaite.serial.cli.fakelims import FakeSenaiteServer
+from senaite.serial.cli.fuzz import FuzzHandler
+from senaite.serial.cli.lis1a import LIS1AToSenaiteHandler
+from senaite.serial.cli.pipeline import Transfer
+from senaite.serial.cli.records import get_results
+from senaite.serial.cli.records import to_text
+from senaite.serial.cli.session import Spool
+from senaite.serial.cli.uploader import Uploader
+
+from .utils import get_frames
+from .utils import send
+
+RECORDS = [u"H|\\^&|||Analyzer", u"P|1"]
+for num in range(50):
+    RECORDS.extend([u"O|1|S{}".format(num), u"R|1|^^^GLU|{}".format(num)])
+RECORDS.append(u"L|1|N")
+
+TEXT = u"\r".join(RECORDS) + u"\r"
+
+
+def get_transfer(text=TEXT, size=100):
+    spool = Spool(max_size=size)
+    spool.write(text.encode("latin-1"))
+    assert spool.spilled
+    return Transfer([], spool=spool, decoder=Decoder())
+
+
+def test_spilled_transfer_read_line_by_line():
+    transfer = get_transfer()
+    assert transfer.spilled
+    assert transfer.get_message() is transfer
+    chunks = list(transfer)
+    assert len(chunks) == len(RECORDS)
+    assert u"".join(chunks) == TEXT
+    # Read again, as many times as needed
+    assert to_text(transfer) == TEXT
+
+
+def test_spilled_transfer_decoded_as_a_whole():
+    text = u"H|\\^&|||A\rR|1|^^^NA|&X4D67&|µg\rL|1|N\r"
+    transfer = get_transfer(text, size=10)
+    assert to_text(transfer) == Decoder().decode(text.encode("latin-1"))
+    assert get_results(transfer) == get_results(to_text(transfer))
+
+
+def test_spilled_transfer_archived(tmpdir):
+    archive = Archive(str(tmpdir))
+    digest = archive.add(get_transfer())
+    assert digest == archive.add(TEXT)
+    entries = list(archive.find(sample_id=u"S49"))
+    assert len(entries) == 2
+    assert archive.read(entries[0]) == TEXT
+
+
+def test_spilled_transfer_pushed_without_reading(uploader):
+    handler = LIS1AToSenaiteHandler(None, None, None, uploader=uploader,
+                                    **{"spool-size": 100})
+    try:
+        send(handler, get_frames(RECORDS))
+    finally:
+        handler.release()
+    message = uploader.messages[0][0]
+    assert isinstance(message, Transfer)
+    # Records are sent as messages, separated by <CR><LF>
+    assert to_text(message) == u"\r\r\n".join(RECORDS) + u"\r"
+
+
+def test_spilled_transfer_split(uploader):
+    handler = LIS1AToSenaiteHandler(None, None, None, uploader=uploader,
+                                    split=True, **{"spool-size": 100})
+    try:
+        send(handler, get_frames(RECORDS))
+    finally:
+        handler.release()
+    messages = list(map(lambda m: m[0], uploader.messages))
+    assert len(messages) == 50
+    assert messages[-1] == u"\r".join([
+        u"H|\\^&|||Analyzer", u"P|1", u"O|1|S49", u"R|1|^^^GLU|49",
+        u"L|1|N"]) + u"\r"
+
+
+def test_spool_closed_by_last_holder():
+    transfer = get_transfer()
+    transfer.hold(2)
+    transfer.release()
+    transfer.release()
+    assert not transfer.spool.closed
+    assert to_text(transfer) == TEXT
+    transfer.release()
+    assert transfer.spool.closed
+
+
+def test_spilled_transfer_closed_after_pipeline(tmpdir):
+    handler = FuzzHandler(pipeline=2, archive=Archive(str(tmpdir)),
+                          **{"spool-size": 100})
+    try:
+        send(handler, get_frames(RECORDS))
+    finally:
+        handler.release()
+    transfer = handler.notified[0]
+    assert isinstance(transfer, Transfer)
+    assert transfer.spool.closed
+
+
+def test_spilled_transfer_closed_once_pushed():
+    server = FakeSenaiteServer(("127.0.0.1", 0))
+    server.start()
+    uploader = Uploader(server.url, server.user, server.password,
+                        retries=0, delay=0.01, workers=1)
+    uploader.start()
+    transfer = get_transfer()
+    try:
+        uploader.put(transfer)
+        # Held by the uploader until pushed
+        transfer.release()
+        limit = time.time() + 5
+        while not uploader.stats["pushed"] and time.time() < limit:
+            time.sleep(0.01)
+    finally:
+        uploader.stop()
+        uploader.join()
+        server.shutdown()
+        server.server_close()
+    assert server.messages == [TEXT]
+    assert transfer.spool.closed
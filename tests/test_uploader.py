@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.SERIAL.CLI.
+#
+# SENAITE.SERIAL.CLI is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2020 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+import time
+
+import pytest
+
+from senaite.serial.cli import lims
+from senaite.serial.cli.fakelims import FakeSenaiteServer
+from senaite.serial.cli.uploader import Uploader
+
+MESSAGE = "H|\\^&|||Analyzer\rL|1|N\r"
+
+
+@pytest.fixture
+def server():
+    server = FakeSenaiteServer(("127.0.0.1", 0))
+    server.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def wait_for(condition, timeout=5):
+    limit = time.time() + timeout
+    while not condition():
+        if time.time() > limit:
+            raise AssertionError("Timed out")
+        time.sleep(0.01)
+
+
+def get_uploader(server, **kwargs):
+    kwargs.setdefault("retries", 0)
+    kwargs.setdefault("delay", 0.01)
+    kwargs.setdefault("workers", 1)
+    return Uploader(server.url, server.user, server.password, **kwargs)
+
+
+def test_html_error_page_is_a_failed_push(server):
+    server.gateway_error_rate = 1
+    session = lims.Session(server.url, server.user, server.password)
+    assert session.auth()
+    assert session.post("push", {"messages": [MESSAGE]}) == {}
+
+
+def test_html_error_page_is_retried(server):
+    server.gateway_error_rate = 1
+    uploader = get_uploader(server, retries=2)
+    uploader.start()
+    try:
+        uploader.put(MESSAGE)
+        wait_for(lambda: uploader.stats["failed"])
+        assert uploader.stats["retries"] == 2
+        assert server.stats["errors"] == 3
+
+        # The worker is still alive
+        server.gateway_error_rate = 0
+        uploader.put(MESSAGE)
+        wait_for(lambda: uploader.stats["pushed"])
+    finally:
+        uploader.stop()
+        uploader.join()
+    assert server.messages == [MESSAGE]
+
+
+def test_worker_survives_unexpected_errors(server, monkeypatch):
+    post = lims.Session.post
+    calls = []
+
+    def broken_post(self, endpoint, payload):
+        calls.append(endpoint)
+        if len(calls) == 1:
+            raise RuntimeError("Unexpected")
+        return post(self, endpoint, payload)
+
+    monkeypatch.setattr(lims.Session, "post", broken_post)
+    uploader = get_uploader(server)
+    uploader.start()
+    try:
+        uploader.put(MESSAGE)
+        uploader.put(MESSAGE)
+        wait_for(lambda: uploader.stats["pushed"])
+    finally:
+        uploader.stop()
+        uploader.join()
+    assert uploader.stats["failed"] == 1
+    assert server.messages == [MESSAGE]
+
+
+def test_messages_waiting_are_pushed_in_batches(server):
+    uploader = get_uploader(server, batch_size=3)
+    messages = list(map(lambda num: MESSAGE.replace(
+        "Analyzer", "Analyzer{}".format(num)), range(5)))
+    for message in messages:
+        uploader.put(message)
+    uploader.put(MESSAGE, duplicate=True)
+    uploader.start()
+    uploader.stop()
+    uploader.join()
+    assert uploader.stats["pushed"] == 6
+    assert sorted(server.messages) == sorted(messages + [MESSAGE])
+    # Batches of 3 and 2, and the duplicate on its own, after the two
+    # requests of the authentication
+    assert server.stats["requests"] == 5
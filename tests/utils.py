@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.SERIAL.CLI.
+#
+# SENAITE.SERIAL.CLI is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2020 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+from senaite.serial.cli.link import CommandReader
+from senaite.serial.cli.lis1a import ENQ
+from senaite.serial.cli.lis1a import EOT
+from senaite.serial.cli.sender import build_frames
+
+
+def get_frames(*messages):
+    """Returns the frames to send the messages (lists of records) in a single
+    transfer
+    """
+    records = []
+    for message in messages:
+        records.extend(map(lambda r: r.encode("ascii"), message))
+    return build_frames(records)
+
+
+def transmit(handler, data):
+    """Writes the data to the handler as read from the serial port. Returns
+    the replies of the handler
+    """
+    replies = []
+    for command in CommandReader().feed(data):
+        handler.write(command)
+        replies.append(handler.read())
+    return replies
+
+
+def send(handler, frames):
+    """Sends a full transfer with the frames passed-in. Returns the replies
+    of the handler to the frames
+    """
+    transmit(handler, ENQ)
+    replies = []
+    for frame in frames:
+        replies.extend(transmit(handler, frame))
+    transmit(handler, EOT)
+    return replies